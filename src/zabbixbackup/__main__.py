@@ -13,8 +13,16 @@ if __name__ == "__main__":
     from .utils import create_name, pretty_log_args
     from .backup_postgre import backup_postgresql
     from .backup_mysql import backup_mysql
-    from .archiver import save_files, archive
+    from .restore import restore
+    from .catalog import catalog, fill_checksums, record_backup
+    from .archiver import save_files, archive, open_stream, close_stream, abort_stream
     from .rotation import rotate
+    from .chunks import commit_watermarks
+    from .unchanged import commit_checksums
+    from .progress import TIMINGS, disk_usage, timings_table, write_timings
+    from .metrics import write_metrics
+    from .tasks import TaskGraph
+    from .digests import write_artifacts
     import atexit
 
     logger = logging.getLogger()
@@ -23,9 +31,23 @@ if __name__ == "__main__":
     args = parse(sys.argv[1:])
     scope = args.scope
 
+    if scope["action"] == "restore":
+        pretty_log_args(args)
+        status, message = restore(args)
+        if status != 0:
+            logger.fatal(message)
+        sys.exit(status)
+
+    if scope["action"] == "catalog":
+        status, message = catalog(args)
+        if status != 0:
+            logger.fatal(message)
+        sys.exit(status)
+
     # TODO: rlookup here
     outdir = args.outdir
     abs_outdir = outdir.absolute()
+    scope["outdir"] = abs_outdir
 
     archive_dir = outdir / create_name(args)
     abs_archive_dir = archive_dir.absolute()
@@ -48,6 +70,22 @@ if __name__ == "__main__":
     # Pretty print arguments as being parsed and processed
     pretty_log_args(args)
 
+    # Artifacts digests computed while they are written (see digests.py)
+    scope["digests"] = {}
+
+    # Dumps are written straight into the archive, the archive directory
+    # only stages small files (version, logs, saved files)
+    if args.stream:
+        open_stream(abs_archive_dir, args)
+
+    # Independent phases overlap with the dump (see tasks.py)
+    tasks = TaskGraph(meter=scope["progress"])
+    scope["tasks"] = tasks
+    tasks.submit("save files", save_files, args)
+    tasks.submit(
+        "catalog checksums", fill_checksums,
+        abs_outdir, args.name if args.name is not None else args.host)
+
     if scope["dbms"] == "psql":
         status, message = backup_postgresql(args)
     elif scope["dbms"] == "mysql":
@@ -55,12 +93,28 @@ if __name__ == "__main__":
     else:
         status, message = 100, "invalid dbms {scope['dbms']}"
 
+    # joined in a fixed order: the log and the failures don't depend on timing
+    tasks_status, tasks_message = tasks.close()
+    if status == 0:
+        status, message = tasks_status, tasks_message
+
     # exit immediately if something went wrong
+    meter = scope["progress"]
     if status != 0:
         logger.fatal(message)
+        meter.stop()
+        if args.stream:
+            abort_stream(args)
+        if args.timings:
+            write_timings(TIMINGS, meter.timings)
+            print(timings_table(meter.timings), file=sys.stderr)
+        write_metrics(args, status)
+        record_backup(args, abs_archive_dir, status)
         sys.exit(status)
 
-    save_files(args)
+    # archive and rotate timings are printed only
+    if args.timings:
+        write_timings(TIMINGS, meter.timings)
 
     # Detach file logger
     logger.removeHandler(file_logger)
@@ -68,13 +122,44 @@ if __name__ == "__main__":
 
     # No file logging from here
 
+    # The backup content is final: list it with its digests
+    write_artifacts(
+        abs_archive_dir, scope["digests"], scope["stream"].digests if args.stream else None)
+
     # From now on operate from backups diretory
     os.chdir(abs_outdir)
     # Archive, compress and move the backup to the final destination
-    archive_path = archive(abs_archive_dir, args)
+    # metered on the backup directory, never the whole output directory
+    meter.start("archive", disk_usage(abs_archive_dir), path=abs_archive_dir)
+    if args.stream:
+        status, archive_path = close_stream(abs_archive_dir, args)
+    else:
+        status, archive_path = archive(abs_archive_dir, args)
+    meter.stop()
+
+    record_backup(args, archive_path, status)
+
+    # a failed archive is no backup: older ones are not rotated
+    if status != 0:
+        logger.fatal("Could not create the archive (see logs)")
+        write_metrics(args, status)
+        if args.timings:
+            print(timings_table(meter.timings), file=sys.stderr)
+        sys.exit(status)
+
+    # The backup is archived: the next incremental one starts from it
+    commit_watermarks(args)
+    commit_checksums(args)
 
     # Rotate backups
     os.chdir(abs_outdir)
-    rotate(args)
+    meter.start("rotate", metered=False, path=abs_archive_dir)
+    scope["rotate"] = rotate(args)
+    meter.close()
+
+    write_metrics(args, 0)
+
+    if args.timings:
+        print(timings_table(meter.timings), file=sys.stderr)
 
     print(archive_path)
@@ -2,17 +2,31 @@
 Helper functions for saving configuration files
 and to create a compressed tar archive.
 """
+import os
+import json
+import time
 from os import environ
 from pathlib import Path
 from shutil import rmtree
+from subprocess import PIPE
 import logging
 
-from .utils import DPopen, run
+from .utils import DPopen
 from .utils import build_tar_command, process_repr
+from .stream import TarStream
+from .repository import store_backup
+from .progress import disk_usage, human_size, human_time
+from .copier import copy_trees
+from .digests import tee_file
+from .catalog import scan_backups
 
 logger = logging.getLogger()
 
 
+# index of the saved files, with the backup (see --link-files)
+FILES_INDEX = "saved_files.index"
+
+
 def parse_save_files(files):
     """
     Read a list of files and directories.
@@ -23,7 +37,7 @@ def parse_save_files(files):
     with open(files, "r", encoding="utf-8") as fh:
         for line in fh:
             line = line.strip()
-            if line.startswith("#"):
+            if not line or line.startswith("#"):
                 continue
             yield Path(line)
 
@@ -33,25 +47,76 @@ def save_files(args):
     Copy files and directories as per user arguments.
     
     Default file list: (module) zabbixbackup/assets/files.
+    With 'args.link_files' files unchanged since the previous backup are
+    linked from it (see `previous_saved_files`).
     """
     if args.save_files is True:
         files = args.files
         if files == "-":
             files = Path(__file__).parent / "assets" / "files"
 
-        copy_files(files, Path("host_root"))
+        previous = None
+        if args.link_files:
+            previous = previous_saved_files(args)
+
+        copy_files(files, Path("host_root"), args.link_files, previous)
+
+
+def read_files_index(path):
+    """Read the index of saved files as a dict {path: entry} (see `copier.index_entry`)."""
+    index = {}
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                entry = json.loads(line)
+                index[entry["path"]] = entry
+
+    return index
+
+
+def write_files_index(path, index):
+    """Write the index of saved files, one JSON object per line."""
+    with open(path, "w", encoding="utf-8") as fh:
+        for entry in index:
+            fh.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+def previous_saved_files(args):
+    """
+    Saved files of the newest previous backup folder of this host, as a
+    tuple (host_root, index) or None if there's no such backup.
+    """
+    outdir = args.scope["outdir"]
+    name = args.name if args.name is not None else args.host
+
+    backups = [
+        entry["file"] for entry in scan_backups(outdir)
+        if entry["host"] == name and entry["file"] == entry["name"]
+        and entry["file"] != Path.cwd().name
+    ]
 
+    for backup in reversed(backups):
+        index_path = Path(outdir) / backup / FILES_INDEX
+        if index_path.exists():
+            logger.info("Saved files: linking unchanged files from %s", backup)
+            return Path(outdir) / backup / "host_root", read_files_index(index_path)
 
-def copy_files(files_index, base_dir):
+    logger.info("Saved files: no previous backup folder to link from")
+    return None
+
+
+def copy_files(files_index, base_dir, index=False, previous=None):
     """
     Copy a list of files or directories in base_dir.
 
-    Directory structure is replicated.
+    Directory structure is replicated (see `copier.py`). With 'index' the
+    copied files are indexed (`FILES_INDEX` next to 'base_dir') and the ones
+    unchanged since 'previous' (see `previous_saved_files`) are linked.
     """
     base_dir = base_dir.absolute()
-    items = parse_save_files(files_index)
+    items = []
 
-    for item in items:
+    for item in parse_save_files(files_index):
         if not item.exists():
             logger.info("Filepath not found %s, ignoring...", item)
             continue
@@ -61,11 +126,17 @@ def copy_files(files_index, base_dir):
             dest.parent.mkdir(parents=True)
             # TODO: copy permission on entire directory tree?
 
-        # TODO: remove dependency on cp?
-        if run(["cp", "-a", str(item), str(dest)]) is None:
-            logger.warning("Cannot copy %s, ignoring...", item)
-        else:
-            logger.info("Copying %s", item)
+        items.append((item, dest))
+
+    started = time.monotonic()
+    files, size, linked, entries = copy_trees(
+        items, base=base_dir if index else None, previous=previous)
+    logger.info(
+        "Saved files: %d files (%d linked), %s copied in %s",
+        files, linked, human_size(size), human_time(time.monotonic() - started))
+
+    if index:
+        write_files_index(base_dir.parent / FILES_INDEX, entries)
 
 
 def archive(archive_dir, args):
@@ -73,27 +144,114 @@ def archive(archive_dir, args):
     Create the actual archive file.
 
     Based on user arguments it will be compressed accordingly.
+    Sizes before and after compression are set in 'scope["archive_size"]'.
+
+    Return a tuple (status, path): on failure (non-zero status) the
+    partial archive is removed and 'path' is the backup folder, left as is.
     """
     scope = args.scope
     profile = scope["archive"]
 
+    # deduplicated in the chunk store, compressed as per the archive profile
+    if args.repository:
+        return 0, store_backup(archive_dir, args)
+
+    size = disk_usage(archive_dir)
+
     if profile is not None:
-        env, ext, cmd = build_tar_command(profile)
+        try:
+            env, ext, cmd = build_tar_command(profile, threads=scope["threads"])
+        except NotImplementedError:
+            # no tar or compression binary: python's tarfile (see `stream.py`)
+            logger.info("Archive binaries not available, using in-process archiving")
+            return _archive_inprocess(archive_dir, args)
+
         name = archive_dir.name
         name_ext = name + ext
-        tar_cmd = cmd + (name_ext, name, )
+        # written to stdout, hashed on its way to the file (see `digests.py`)
+        tar_cmd = cmd + ("-", name, )
         tar_env = {**environ, **env}
 
-        logger.debug("Archive command: \n%s\n", process_repr(tar_cmd, env))
+        logger.debug("Archive command: \n%s\n> %s\n", process_repr(tar_cmd, env), name_ext)
 
-        archive_exec = DPopen(tar_cmd, env=tar_env)
-        archive_exec.communicate()
+        archive_exec = DPopen(tar_cmd, env=tar_env, stdout=PIPE)
+        scope["progress"].track(archive_exec, "rchar")
+        digests = {}
+        tee_file(archive_exec.stdout, name_ext, digests)
+        _, stderr = archive_exec.communicate()
 
-        if archive_exec.returncode == 0:
-            logger.debug("Delete plain folder archive: %s\n", archive_dir)
-            rmtree(archive_dir)
+        if archive_exec.returncode != 0:
+            logger.error("Archive failed (exit status %d): %s", archive_exec.returncode, name_ext)
+            if stderr:
+                logger.error("%s", stderr.decode(errors="replace").rstrip())
+            Path(name_ext).unlink(missing_ok=True)
+            return 6, Path(archive_dir).absolute()
 
-        return Path(name_ext).absolute()
+        logger.debug("Delete plain folder archive: %s\n", archive_dir)
+        rmtree(archive_dir)
+        archive_size, scope["archive_digest"] = digests[name_ext]
+        scope["archive_size"] = (size, archive_size)
+
+        return 0, Path(name_ext).absolute()
 
     # Leave as plain directory
-    return Path(archive_dir).absolute()
+    scope["archive_size"] = (size, size)
+    return 0, Path(archive_dir).absolute()
+
+
+def _archive_inprocess(archive_dir, args):
+    """Archive 'archive_dir' as a whole through a `TarStream`."""
+    open_stream(archive_dir, args)
+    return close_stream(archive_dir, args)
+
+
+def open_stream(archive_dir, args):
+    """
+    Start streaming the backup into its final archive (see `stream.py`).
+
+    The archive is written as '<name>.part' and renamed by `close_stream`.
+    """
+    profile = args.scope["archive"]
+    _, ext, _ = build_tar_command(profile, check=False)
+
+    path = archive_dir.parent / f"{archive_dir.name}{ext}.part"
+    logger.debug("Archive stream: %s", path)
+
+    args.scope["stream"] = TarStream(
+        path, profile, archive_dir.name, threads=args.scope["threads"])
+
+
+def abort_stream(args):
+    """Remove the partial streamed archive of a failed backup."""
+    stream = args.scope["stream"]
+    logger.debug("Delete partial archive: %s", stream.path)
+    stream.abort()
+
+
+def close_stream(archive_dir, args):
+    """
+    Add the files left in 'archive_dir' to the streamed archive and close it.
+
+    The (small) files are: version, logs and saved files. Return a tuple
+    (status, path) as `archive`.
+    """
+    stream = args.scope["stream"]
+
+    for item in sorted(Path(archive_dir).iterdir()):
+        stream.add_file(item)
+
+    path = stream.path
+    if not stream.close():
+        logger.error("Archive stream failed: %s", path)
+        path.unlink(missing_ok=True)
+        return 6, Path(archive_dir).absolute()
+
+    logger.debug("Delete plain folder archive: %s\n", archive_dir)
+    rmtree(archive_dir)
+
+    final_path = path.with_name(path.name[:-len(".part")])
+    os.replace(path, final_path)
+    args.scope["archive_size"] = (stream.size, final_path.stat().st_size)
+    args.scope["archive_digest"] = stream.digest
+
+    return 0, final_path.absolute()
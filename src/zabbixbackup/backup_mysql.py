@@ -6,13 +6,23 @@ from os import fdopen, environ
 import tempfile
 import shutil
 import atexit
+import io
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from subprocess import PIPE
 
 from .utils import (
-    DPopen, build_compress_command, check_binary, parse_zabbix_version,
-    preprocess_tables_lists, process_repr,
+    COMPRESS_EXTENSIONS, DPopen, auto_jobs, build_compress_command, check_binary, chunked_tables,
+    parse_table_stats, parse_zabbix_version, partition_tables, preprocess_tables_lists,
+    process_repr, write_table_stats,
 )
+from .compress import BLOCK_SIZES, CompressThread
+from .digests import HashingWriter, tee_file
+from .session import ClientSession, DriverSession
+from .chunks import dump_chunks, largest_first, plan_table_chunks, save_watermarks
+from .unchanged import checksum_candidates, save_checksums, select_unchanged
 
 # pylint: disable=duplicate-code
 
@@ -27,35 +37,49 @@ def backup_mysql(args):
         return 1, "Missing binaries: check 'mysql' and 'mysqldump' are available and in PATH"
 
     args.scope["env"] = {}
+    meter = args.scope["progress"]
 
     # Phase 0: setup authentication
+    meter.start("auth")
     _mysql_auth(args)
+    meter.stop()
 
-    # Phase 1: Fetch database version
+    # Phase 1: Fetch database version and tables (a single batch)
     select_db_version = "SELECT optional FROM dbversion;"
-    raw_version = _mysql_query(args, select_db_version, "zabbix version query")
-    if raw_version is None:
-        return 2, "Could not retrieve db version (see logs using --debug)"
+
+    # select and filter tables: done here and passed to _mysql_dump for simplicity
+    table_list_query = (
+        f"SELECT table_name FROM information_schema.tables "
+        f"WHERE table_schema='{args.dbname}';")
+
+    # estimated rows and sizes (bytes, data and indexes)
+    table_stats_query = (
+        f"SELECT table_name, table_rows, data_length + index_length "
+        f"FROM information_schema.tables "
+        f"WHERE table_schema='{args.dbname}';")
+
+    meter.start("metadata")
+    results = _mysql_queries(
+        args, [select_db_version, table_list_query, table_stats_query],
+        "zabbix version, tables list and sizes queries")
+    meter.stop()
+    if results is None:
+        return 2, "Could not retrieve db version and table list (see logs using --debug)"
+
+    raw_version, table_cmd, stats_cmd = results
 
     version, _ = parse_zabbix_version(raw_version)
+    args.scope["version"] = version
     with open("zabbix_dbversion", "w", encoding="utf-8") as fh:
         fh.writelines(["mysql\n", f"{version}\n"])
 
     logging.info("Zabbix version: %s", version)
 
     # Phase 2: Perform the actual backup
-
-    # select and filter tables: done here and passed to _mysql_dump for simplicity
-    table_list_query = (
-        f"SELECT table_name FROM information_schema.tables "
-        f"WHERE table_schema='{args.dbname}';")
-
-    table_cmd = _mysql_query(args, table_list_query, "zabbix tables list query")
-    if table_cmd is None:
-        return 3, "Could not retrieve table list (see logs)"
-
     table_list = sorted(table_cmd)
     ignore, nodata, fail = preprocess_tables_lists(args, table_list)
+    stats = parse_table_stats(stats_cmd, "\t")
+    sizes = dict((table, size) for table, (_, size) in stats.items())
 
     schema_ignores = []
     data_ignores = []
@@ -71,6 +95,46 @@ def backup_mysql(args):
             schema_ignores += ["--ignore-table", f"{args.dbname}.{table}"]
             data_ignores += ["--ignore-table", f"{args.dbname}.{table}"]
 
+    # history and trends data exported by time ranges, see below
+    chunked = chunked_tables(args, table_list, ignore, nodata)
+    for table in chunked:
+        data_ignores += ["--ignore-table", f"{args.dbname}.{table}"]
+
+    args.scope["tables"]["chunked"] = len(chunked)
+
+    # config tables unchanged since the previous backup: schema only
+    unchanged, references = [], {}
+    if args.skip_unchanged:
+        meter.start("checksums")
+        checksums = _mysql_checksums(
+            args, checksum_candidates(table_list, ignore + nodata + chunked))
+        meter.stop()
+        if checksums is None:
+            logger.warning("Could not checksum config tables, dumping them (see logs)")
+        else:
+            unchanged, references = select_unchanged(args, checksums, Path.cwd().name)
+
+    for table in unchanged:
+        data_ignores += ["--ignore-table", f"{args.dbname}.{table}"]
+
+    # saved for capacity tracking
+    write_table_stats(stats, ignore, nodata, chunked, unchanged=unchanged)
+
+    # tables sizes are needed to balance the workers, largest first
+    # (and to choose their number)
+    skip = set(ignore + nodata + chunked + unchanged)
+    data_sizes = dict(
+        (table, sizes.get(table, 0))
+        for table in table_list if table not in skip)
+
+    jobs = args.scope["jobs"]
+    if jobs != 1:
+        if jobs is None:
+            jobs = auto_jobs(
+                data_sizes.values(), split=[sizes.get(table, 0) for table in chunked])
+            args.scope["jobs"] = jobs
+            logger.info("Parallel dump jobs (auto): %d", jobs)
+
     # Phase 3: perform acqual dump
 
     # dump schemas
@@ -79,9 +143,11 @@ def backup_mysql(args):
         "--no-data", "--routines", ]
     schema_outpath = Path("schemas_dump.sql")
 
+    meter.start("schema dump")
     schema_status = _mysql_dump(
         args, schema_params, schema_ignores, schema_outpath,
         "Dump schema command", logging.info)
+    meter.stop()
 
     if not schema_status:
         return 5, "Could not execute schema dump (see logs)"
@@ -90,15 +156,58 @@ def backup_mysql(args):
     data_outpath = Path("data_dump.sql")
     data_params = [
         "--opt", "--single-transaction", "--skip-lock-tables",
-        "--no-create-info", "--skip-extended-insert", "--skip-triggers",
+        "--no-create-info", "--skip-triggers",
     ]
-    dump_status = _mysql_dump(
-        args, data_params, data_ignores, data_outpath,
-        "Dump data command", logging.info)
+
+    # multi-row INSERT statements up to 'insert_size' or one row per statement
+    insert_size = args.scope.get("insert_size", None)
+    if insert_size is None:
+        data_params += ["--skip-extended-insert"]
+    else:
+        data_params += ["--extended-insert", "--net-buffer-length", insert_size]
+
+    meter.start("data dump", sum(data_sizes.values()))
+    if jobs == 1:
+        dump_status = _mysql_dump(
+            args, data_params, data_ignores, data_outpath,
+            "Dump data command", logging.info)
+    else:
+        buckets = partition_tables(data_sizes, jobs)
+        dump_status = _mysql_parallel_dump(
+            args, data_params, buckets, data_outpath,
+            "Dump data command", logging.info)
+    meter.stop()
 
     if not dump_status:
         return 5, "Could not execute data dump (see logs)"
 
+    if chunked:
+        # chunks end at the server time, the client clock may drift
+        end = _mysql_clock(args)
+        if end is None:
+            return 3, "Could not retrieve the server time (see logs)"
+
+        chunks, watermarks = plan_table_chunks(
+            args, chunked, partial(_mysql_first_clocks, args), end)
+        if chunks is None:
+            return 3, "Could not retrieve chunked tables first clock (see logs)"
+
+        logger.info("Chunks to dump: %d", len(chunks))
+        chunks = largest_first(chunks, sizes)
+
+        dump_chunk = partial(_mysql_chunk_dump, args, data_params)
+        meter.start("chunks", sum(sizes.get(table, 0) for table in chunked), metered=False)
+        failed = dump_chunks(chunks, dump_chunk, jobs, stream=args.scope.get("stream"))
+        meter.stop()
+        if failed:
+            return 5, f"Could not dump chunks (see logs): {failed!r}"
+
+        if watermarks:
+            save_watermarks(args, watermarks)
+
+    if references:
+        save_checksums(args, references)
+
     return 0, "+OK"
 
 
@@ -130,12 +239,8 @@ def _mysql_auth(args):
         shutil.copy(args.loginfile, "./mylogin.cnf")
 
 
-def _mysql_query(args, query, description="query", log_func=logging.debug):
-    """Perform a query via `mysql`."""
-    dbname = args.dbname
-    env_extra = args.scope["env"]
-
-    # mysql command will be used to inspect the database
+def _mysql_client_cmd(args):
+    """Base `mysql` command: connection and authentication parameters."""
     query_cmd = [
         "mysql",
         "--login-path=client",
@@ -155,38 +260,315 @@ def _mysql_query(args, query, description="query", log_func=logging.debug):
     query_cmd += [
         "--user", args.user,
         "--port", args.port,
-        "--database", dbname,
+        "--database", args.dbname,
         "--skip-column-names",
-        "--execute",
-        query,
     ]
 
-    query_cmd = tuple(map(str, query_cmd))
-    query_env = {**environ, **env_extra}
+    return query_cmd
+
+
+def _mysql_native_session(args):
+    """Query session via PyMySQL if installed, None otherwise."""
+    # pylint: disable=import-outside-toplevel
+    try:
+        import pymysql as driver
+    except ImportError:
+        return None
+
+    params = {
+        "host": args.host if args.sock is None else None,
+        "unix_socket": args.sock,
+        "port": int(args.port),
+        "user": args.user,
+        "database": args.dbname,
+        "read_default_file": args.loginfile or (
+            args.mysql_config if args.read_mysql_config else None),
+    }
+
+    try:
+        connection = driver.connect(
+            **{key: value for key, value in params.items() if value}, autocommit=True)
+    except driver.Error as e:
+        logger.warning("Native driver connection failed, using mysql: %s", e)
+        return None
+
+    logger.debug("Query session: %s driver", driver.__name__)
+    return DriverSession(connection, driver.Error, "\t", "NULL")
+
 
-    log_func(f"{description}: \n{process_repr(query_cmd, env_extra)}")
+def _mysql_session(args):
+    """Persistent query session (see `session.py`), started on first use."""
+    session = args.scope.get("session")
+    if session is not None:
+        return session
 
-    exec_query = DPopen(query_cmd, env=query_env, stdout=PIPE, text=True)
-    stdout, stderr = exec_query.communicate()
+    session = _mysql_native_session(args)
+    if session is None:
+        session_cmd = _mysql_client_cmd(args) + ["--batch", "--unbuffered"]
+        session_env = {**environ, **args.scope["env"]}
+        session = ClientSession(
+            session_cmd, session_env, lambda marker: f"SELECT '{marker}';", "mysql query session")
+
+    atexit.register(session.close)
+    args.scope["session"] = session
+    return session
+
+
+def _mysql_queries(args, queries, description="queries", log_func=logging.debug):
+    """Perform a batch of queries, return a list of results or None on failure."""
+    log_func(f"{description}: \n" + "\n".join(queries))
+
+    return _mysql_session(args).query_many(queries, args.scope["env"])
+
+
+def _mysql_query(args, query, description="query", log_func=logging.debug):
+    """Perform a query, return the output lines or None on failure."""
+    results = _mysql_queries(args, [query], description, log_func)
+
+    return None if results is None else results[0]
+
+
+def _mysql_clock(args):
+    """Return the server time as a unix timestamp or None on failure."""
+    clock_cmd = _mysql_query(args, "SELECT UNIX_TIMESTAMP();", "server time query")
+    if not clock_cmd or not clock_cmd[0].isdecimal():
+        return None
+
+    return int(clock_cmd[0])
+
+
+def _mysql_first_clocks(args, tables):
+    """Return a dict of {table: lowest clock or None if empty}."""
+    clock_queries = [f"SELECT MIN(clock) FROM `{table}`;" for table in tables]
+    clock_cmds = _mysql_queries(args, clock_queries, "first clock queries")
+    if clock_cmds is None:
+        return None
+
+    begins = {}
+    for table, clock_cmd in zip(tables, clock_cmds):
+        clock = clock_cmd[0] if clock_cmd else "NULL"
+        begins[table] = int(clock) if clock.isdecimal() else None
+
+    return begins
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def _mysql_checksums(args, tables):
+    """Return a dict of {table: checksum} (see `unchanged.py`) or None on failure."""
+    if not tables:
+        return {}
+
+    checksum_query = "CHECKSUM TABLE " + ", ".join(f"`{table}`" for table in tables) + ";"
+    checksum_cmd = _mysql_query(args, checksum_query, "config tables checksum query")
+    if checksum_cmd is None:
+        return None
 
-    if exec_query.returncode != 0:
+    # 'dbname.table' and the checksum (NULL if the table can't be read)
+    checksums = {}
+    for line in checksum_cmd:
+        name, _, checksum = line.partition("\t")
+        table = name[len(args.dbname) + 1:]
+        if table in tables and checksum.isdecimal():
+            checksums[table] = checksum
+
+    return checksums
+
+
+def _mysql_chunk_dump(args, params, table, start, stop, outpath):
+    """
+    Dump the rows of 'table' in the clock range [start, stop).
+
+    Every chunk is a transaction on its own. The upper bound is fixed
+    at the backup time and history and trends rows are only appended,
+    which keeps chunks consistent with each other.
+    """
+    chunk_params = params + ["--where", f"clock >= {start} AND clock < {stop}"]
+    chunk_outpath = outpath.with_name(outpath.name + ".sql")
+
+    # a chunk may be retried: it reaches the archive stream once complete
+    procs = _mysql_dump_start(
+        args, chunk_params, [], chunk_outpath, "chunk command", logging.debug,
+        tables=[table], streaming=False)
+
+    # don't execute if dry run is enabled
+    if procs is None:
+        return True
+
+    return _mysql_dump_wait(procs)
+
+
+def _mysql_lock(args, description="global read lock", log_func=logging.debug):
+    """
+    Open a `mysql` session holding a global read lock.
+
+    The lock is held until `_mysql_unlock` is called, every transaction
+    started meanwhile sees the same snapshot of the database.
+    Return None if the lock could not be acquired.
+    """
+    env_extra = args.scope["env"]
+
+    lock_cmd = _mysql_client_cmd(args) + ["--unbuffered"]
+    lock_cmd = tuple(map(str, lock_cmd))
+    lock_env = {**environ, **env_extra}
+
+    log_func(f"{description}: \n{process_repr(lock_cmd, env_extra)}")
+
+    lock = DPopen(lock_cmd, env=lock_env, stdin=PIPE, stdout=PIPE, text=True)
+    lock.stdin.write("FLUSH TABLES WITH READ LOCK;\nSELECT 'locked';\n")
+    lock.stdin.flush()
+
+    if lock.stdout.readline().strip() != "locked":
+        _, stderr = lock.communicate()
         if stderr is not None:
             logging.fatal(stderr)
         return None
 
-    return stdout.splitlines()
+    return lock
+
+
+def _mysql_unlock(lock):
+    """Release the global read lock and close its session."""
+    lock.communicate("UNLOCK TABLES;\n")
+
+
+def _mysql_dump_progress(worker, stream, started):
+    """
+    Log a worker progress reading `mysqldump --verbose` output.
+
+    'started' is set as soon as the worker transaction is open (the first
+    table is being processed) or the worker has ended.
+    """
+    prefix = "-- Retrieving table structure for table "
+    for line in io.TextIOWrapper(stream, errors="replace"):
+        line = line.rstrip()
+        if line.startswith(prefix):
+            started.set()
+            table = line[len(prefix):].rstrip(".")
+            logger.info("Dump worker %d: table %s", worker, table)
+        else:
+            logger.debug("Dump worker %d: %s", worker, line)
+
+    started.set()
 
 
 # pylint: disable=too-many-arguments,too-many-positional-arguments
+def _mysql_parallel_dump(
+    args, params, buckets, outpath, description="dump cmd", log_func=logging.debug
+):
+    """
+    Dump tables with a worker (mysqldump) per bucket, one file each.
+
+    Workers are started while a global read lock is held and the lock is
+    released as soon as every worker transaction is open: the workers share
+    the same consistent snapshot (mydumper style).
+    """
+    if args.dry_run:
+        lock = None
+    else:
+        lock = _mysql_lock(args, "Dump data lock command", log_func)
+        if lock is None:
+            logger.error(
+                "Could not acquire a global read lock "
+                "(RELOAD privilege needed for parallel dumps)")
+            return False
+
+    workers = []
+    try:
+        for worker, tables in enumerate(buckets):
+            worker_outpath = outpath.with_name(f"{outpath.stem}_{worker:02d}{outpath.suffix}")
+            procs = _mysql_dump_start(
+                args, params, [], worker_outpath, f"{description} (worker {worker})",
+                log_func, tables=tables, progress=True)
+
+            if procs is None:
+                continue
+
+            started = threading.Event()
+            reader = threading.Thread(
+                target=_mysql_dump_progress,
+                args=(worker, procs[0].stderr, started),
+                daemon=True)
+            reader.start()
+            workers.append((procs, started, reader))
+
+        for _, started, _ in workers:
+            started.wait()
+
+    finally:
+        if lock is not None:
+            _mysql_unlock(lock)
+
+    # wait concurrently: when streaming, every worker output is read as it goes
+    with ThreadPoolExecutor(max_workers=max(1, len(workers))) as executor:
+        statuses = list(executor.map(
+            lambda worker: _mysql_dump_wait(worker[0], drain=False), workers))
+
+    for _, _, reader in workers:
+        reader.join()
+
+    return all(statuses)
+
+
 def _mysql_dump(
     args, params, ignoring, outpath, description="dump cmd", log_func=logging.debug
 ):
+    """Dump via `mysqldump` (compressed if requested) and wait for it."""
+    procs = _mysql_dump_start(args, params, ignoring, outpath, description, log_func)
+
+    # don't execute if dry run is enabled
+    if procs is None:
+        return True
+
+    return _mysql_dump_wait(procs)
+
+
+def _mysql_dump_wait(procs, drain=True):
+    """
+    Wait for a dump (and its compressor) to finish.
+
+    Unless 'drain' is False (the output is read elsewhere) the dump
+    stderr is consumed while waiting. When streaming, the output is moved
+    into the archive first.
+    """
+    dump, compress, pump = procs
+
+    if pump is not None:
+        pump()
+
+    # stdout, if piped, belongs to the compressor
+    if drain and dump.stderr is not None:
+        dump.communicate()
+    else:
+        dump.wait()
+
+    if compress is not None:
+        compress.communicate()
+        return dump.returncode == 0 and compress.returncode == 0
+
+    return dump.returncode == 0
+
+
+def _mysql_dump_start(
+    args, params, ignoring, outpath, description="dump cmd", log_func=logging.debug,
+    tables=(), progress=False, streaming=True,
+):
+    """
+    Start a `mysqldump` (piped into a compressor if requested).
+
+    Return a tuple (dump process, compress process or None, pump or None)
+    or None on a dry run. With 'progress' the verbose output is available
+    from the dump process stderr. When streaming, 'pump()' moves the
+    output into the archive and must be called before waiting.
+    """
     dbname = args.dbname
     env_extra = args.scope["env"]
 
     # do we have a compression flag for mysql?
     compressor_profile = args.scope.get("mysqlcompression", None)
 
+    # dump straight into the archive (see `stream.py`)
+    stream = args.scope.get("stream", None) if streaming else None
+
     # base command and pre-flags based on user selection
     dump_cmd = [
         "mysqldump",
@@ -212,18 +594,16 @@ def _mysql_dump(
     if args.columns:
         dump_cmd += ["--complete-insert", "--quote-names", ]
 
-    if args.verbosity in ("very", "debug"):
+    # verbose output is needed to follow the workers progress
+    if args.verbosity in ("very", "debug") or progress:
         dump_cmd += ["--verbose"]
 
     # parameters from outside (data or schema)
     dump_cmd += params
 
-    # if there's no compression let mysqldump save the file
-    if compressor_profile is None:
-        dump_cmd += ["--result-file", outpath]
-
-    # database to dump and tables exclusion
+    # database to dump, tables selection and exclusion
     dump_cmd += [dbname]
+    dump_cmd += tables
     dump_cmd += ignoring
 
 
@@ -234,24 +614,84 @@ def _mysql_dump(
 
     # setup a compress command if needed
     if compressor_profile:
-        env, ext, _, compressor = build_compress_command(compressor_profile)
+        threads = args.scope["threads"]
+        try:
+            env, ext, _, compressor = build_compress_command(compressor_profile, threads=threads)
+        except NotImplementedError:
+            # no binary at all: in-process compression (see `compress.py`)
+            if compressor_profile[0] not in BLOCK_SIZES:
+                raise
+            env, ext, compressor = {}, COMPRESS_EXTENSIONS[compressor_profile[0]], None
 
         compr_env = {**environ, **env_extra, **env}
-        compr_cmd = compressor + (outpath.name + ext, )
-        log_func(f"{description} compression: \n{process_repr(compr_cmd, env)}")
+        compr_path = f"{outpath}{ext}"
+
+        # 7z needs the archive name (even when streaming, the archive is
+        # added with the remaining files at the end), the others write to stdout
+        if compressor is None:
+            compr_cmd, compr_out = None, PIPE if stream is not None else compr_path
+            log_func(
+                f"{description} compression: \n"
+                f"in-process {compressor_profile[0]} ({threads or 'auto'} threads) "
+                f"{'| archive stream' if stream is not None else f'> {compr_out}'}")
+        elif compressor[0] == "7z":
+            compr_cmd, compr_out = compressor + (compr_path, ), None
+            log_func(f"{description} compression: \n{process_repr(compr_cmd, env)}")
+        elif stream is not None:
+            compr_cmd, compr_out = compressor, PIPE
+            log_func(
+                f"{description} compression: \n"
+                f"{process_repr(compr_cmd, env)} | archive stream")
+        else:
+            compr_cmd, compr_out = compressor, compr_path
+            log_func(
+                f"{description} compression: \n"
+                f"{process_repr(compr_cmd, env)} > {compr_out}")
 
     # don't execute if dry run is enabled
     if args.dry_run:
-        return True
+        return None
+
+    stderr = {"stderr": PIPE} if progress else {}
 
-    # either run a simple dump or a 'dump | compress'
-    dump = DPopen(dump_cmd, env=dump_env, stdout=PIPE, text=True)
+    meter = args.scope["progress"]
+    digests = args.scope["digests"]
 
-    # pylint: disable=possibly-used-before-assignment,no-else-return
+    # the output is hashed on its way to the file (see `digests.py`) or the archive
+    def _sink(path, output):
+        if stream is None:
+            return partial(tee_file, output, path, digests)
+        return partial(stream.add_stream, str(path), output)
+
+    # pylint: disable=possibly-used-before-assignment
     if not compressor_profile:
-        dump.communicate()
-        return dump.returncode == 0
-    else:
+        dump = DPopen(dump_cmd, env=dump_env, stdout=PIPE, **stderr)
+        meter.track(dump)
+        return dump, None, _sink(outpath, dump.stdout)
+
+    # 'dump | compress' (metered before compression)
+    dump = DPopen(dump_cmd, env=dump_env, stdout=PIPE, **stderr)
+    meter.track(dump)
+
+    pump = None
+    if compr_cmd is None:
+        # the compression thread reads (and closes) the dump output
+        if compr_out is PIPE:
+            compress = CompressThread(dump.stdout, None, compressor_profile, threads)
+            pump = _sink(compr_path, compress.stdout)
+        else:
+            # pylint: disable-next=consider-using-with
+            output = HashingWriter(open(compr_out, "wb"), digests, compr_out)
+            compress = CompressThread(dump.stdout, output, compressor_profile, threads)
+        return dump, compress, pump
+
+    if compr_out is None:
         compress = DPopen(compr_cmd, env=compr_env, stdin=dump.stdout)
-        compress.communicate()
-        return compress.returncode == 0
+    else:
+        compress = DPopen(compr_cmd, env=compr_env, stdin=dump.stdout, stdout=PIPE)
+        pump = _sink(compr_path, compress.stdout)
+
+    # let the compressor be the only reader of the dump output
+    dump.stdout.close()
+
+    return dump, compress, pump
@@ -6,13 +6,19 @@ from os import fdopen, environ
 import tempfile
 import shutil
 import atexit
+import time
+from functools import partial
 from pathlib import Path
 from subprocess import PIPE
 
 from .utils import (
-    DPopen, check_binary, parse_zabbix_version,
-    preprocess_tables_lists, process_repr, try_find_sockets,
+    DPopen, auto_jobs, check_binary, chunked_tables, parse_table_stats, parse_zabbix_version,
+    preprocess_tables_lists, process_repr, try_find_sockets, write_table_stats,
 )
+from .session import ClientSession, DriverSession
+from .digests import tee_file
+from .chunks import dump_chunks, largest_first, plan_table_chunks, save_watermarks
+from .unchanged import checksum_candidates, save_checksums, select_unchanged
 
 # pylint: disable=duplicate-code
 
@@ -27,30 +33,21 @@ def backup_postgresql(args):
         return 1, "Missing binaries: check 'psql' and 'pg_dump' are available and in PATH"
 
     args.scope["env"] = {}
+    meter = args.scope["progress"]
 
     # Phase 0: setup authentication
+    meter.start("auth")
     _psql_auth(args)
+    meter.stop()
 
     # Informational data about an eventual connection via socket
+    # (in background, see tasks.py)
     if args.host == "" or args.host == "localhost" or args.host.startswith("/"):
-        sockets = try_find_sockets("postgres", args.port)
-        logger.info("sockets (actual choice performed directly by postgresql): ")
-        logger.info("    %r", sockets)
+        args.scope["tasks"].submit("sockets", _psql_sockets, args.port)
 
 
-    # Phase 1: Fetch database version and assign a name
+    # Phase 1: Fetch database version and tables (a single batch)
     select_db_version = "SELECT optional FROM dbversion;"
-    raw_version = _psql_query(args, select_db_version, "zabbix version query")
-    if raw_version is None:
-        return 2, "Could not retrieve db version (see logs)"
-
-    version, _ = parse_zabbix_version(raw_version)
-    with open("zabbix_dbversion", "w", encoding="utf-8") as fh:
-        fh.writelines(["postgres\n", f"{version}\n"])
-
-    logger.info("Zabbix version: %s", version)
-
-    # Phase 2: Perform the actual backup
 
     # select and filter tables: done here and passed to _pg_dump for simplicity
     table_list_query = (
@@ -59,12 +56,34 @@ def backup_postgresql(args):
         f"table_catalog='{args.dbname}' AND "
         f"table_type='BASE TABLE';")
 
-    table_cmd = _psql_query(args, table_list_query, "zabbix tables list query")
-    if table_cmd is None:
-        return 3, "Could not retrieve table list (see logs)"
+    # estimated rows and sizes (bytes, including indexes and toast)
+    table_stats_query = (
+        f"SELECT c.relname, c.reltuples::bigint, pg_total_relation_size(c.oid) "
+        f"FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        f"WHERE n.nspname='{args.schema}' AND c.relkind='r';")
+
+    meter.start("metadata")
+    results = _psql_queries(
+        args, [select_db_version, table_list_query, table_stats_query],
+        "zabbix version, tables list and sizes queries")
+    meter.stop()
+    if results is None:
+        return 2, "Could not retrieve db version and table list (see logs)"
+
+    raw_version, table_cmd, stats_cmd = results
 
+    version, _ = parse_zabbix_version(raw_version)
+    args.scope["version"] = version
+    with open("zabbix_dbversion", "w", encoding="utf-8") as fh:
+        fh.writelines(["postgres\n", f"{version}\n"])
+
+    logger.info("Zabbix version: %s", version)
+
+    # Phase 2: Perform the actual backup
     table_list = sorted(table_cmd)
     ignore, nodata, fail = preprocess_tables_lists(args, table_list)
+    stats = parse_table_stats(stats_cmd, "|")
+    sizes = dict((table, size) for table, (_, size) in stats.items())
 
     dump_params = []
 
@@ -81,15 +100,105 @@ def backup_postgresql(args):
             ignore_pattern = f"({'|'.join(ignore)})"
             dump_params += ["--exclude-table", ignore_pattern]
 
-    # all other flags and arguments are set up by _pg_dump
-    outpath = Path("zabbix_dump")
-    dump_status = _pg_dump(args, dump_params, outpath, "pgdump command", logging.info)
-    if not dump_status:
-        return 5, "Could not execute dump (see logs)"
+    # history and trends data exported by time ranges, see below
+    chunked = chunked_tables(args, table_list, ignore, nodata)
+    for i in range(0, len(chunked), 4):
+        chunked_pattern = f"({'|'.join(chunked[i:i+4])})"
+        dump_params += ["--exclude-table-data", chunked_pattern]
+
+    args.scope["tables"]["chunked"] = len(chunked)
+
+    # config tables unchanged since the previous backup: schema only
+    unchanged, references = [], {}
+    if args.skip_unchanged:
+        meter.start("checksums")
+        checksums = _psql_checksums(
+            args, checksum_candidates(table_list, ignore + nodata + chunked))
+        meter.stop()
+        if checksums is None:
+            logger.warning("Could not checksum config tables, dumping them (see logs)")
+        else:
+            unchanged, references = select_unchanged(args, checksums, Path.cwd().name)
+
+    for i in range(0, len(unchanged), 4):
+        unchanged_pattern = f"({'|'.join(unchanged[i:i+4])})"
+        dump_params += ["--exclude-table-data", unchanged_pattern]
+
+    # saved for capacity tracking
+    write_table_stats(stats, ignore, nodata, chunked, unchanged=unchanged)
+
+    # choose the number of workers from tables sizes if requested
+    # (pg_dump itself schedules the largest tables first)
+    skip = set(ignore + nodata + chunked + unchanged)
+    if args.scope["jobs"] is None:
+        args.scope["jobs"] = auto_jobs(
+            (size for table, size in sizes.items() if table not in skip),
+            split=[sizes.get(table, 0) for table in chunked])
+        logger.info("Parallel dump jobs (auto): %d", args.scope["jobs"])
+
+    # pg_dump and the chunks workers must share the same snapshot
+    snapshot_session, snapshot, end = None, None, int(time.time())
+    if chunked and not args.dry_run:
+        snapshot_session, snapshot, end = _psql_snapshot(args)
+        if snapshot is None:
+            return 5, "Could not export a snapshot (see logs)"
+        dump_params += ["--snapshot", snapshot]
+
+    try:
+        # chunks end at the time of the snapshot: later rows are not in it,
+        # the next incremental backup exports them
+        if chunked:
+            chunks, watermarks = plan_table_chunks(
+                args, chunked, partial(_psql_first_clocks, args), end)
+            if chunks is None:
+                return 3, "Could not retrieve chunked tables first clock (see logs)"
+
+            logger.info("Chunks to dump: %d", len(chunks))
+            chunks = largest_first(chunks, sizes)
+
+        # all other flags and arguments are set up by _pg_dump
+        outpath = Path("zabbix_dump")
+        meter.start("dump", sum(
+            size for table, size in sizes.items() if table in table_list and table not in skip))
+        dump_status = _pg_dump(args, dump_params, outpath, "pgdump command", logging.info)
+        meter.stop()
+        if not dump_status:
+            return 5, "Could not execute dump (see logs)"
+
+        if chunked:
+            dump_chunk = partial(_psql_chunk_dump, args, snapshot=snapshot)
+            meter.start("chunks", sum(sizes.get(table, 0) for table in chunked), metered=False)
+            failed = dump_chunks(
+                chunks, dump_chunk, args.scope["jobs"], stream=args.scope.get("stream"))
+            meter.stop()
+            if failed:
+                return 5, f"Could not dump chunks (see logs): {failed!r}"
+
+            if watermarks:
+                save_watermarks(args, watermarks)
+
+    finally:
+        if snapshot_session is not None:
+            _psql_release_snapshot(snapshot_session)
+
+    if references:
+        save_checksums(args, references)
+
+    if args.pgformat == "directory":
+        logger.info(
+            "Restore in parallel with: pg_restore --jobs %d --dbname %s %s",
+            args.scope["jobs"], args.dbname, outpath)
 
     return 0, "+OK"
 
 
+def _psql_sockets(port):
+    """Log the available sockets."""
+    sockets = try_find_sockets("postgres", port)
+    logger.info("sockets (actual choice performed directly by postgresql): ")
+    logger.info("    %r", sockets)
+
+
 def _psql_auth(args):
     # Use provided loginfile and leave it untouched
     if args.loginfile is not None:
@@ -119,39 +228,222 @@ def _psql_auth(args):
         Path("./pgpass")
 
 
-def _psql_query(args, query, description="query", log_func=logging.debug):
-    dbname = args.dbname
-    env_extra = args.scope["env"]
-
-    # psql command will be used to inspect the database
-    query_cmd = [
+def _psql_client_cmd(args):
+    """Base `psql` command: connection and authentication parameters."""
+    return [
         "psql",
         "--host", args.host,
         "--username", args.user,
         "--port", args.port,
-        "--dbname", dbname,
+        "--dbname", args.dbname,
         "--no-password",
-        "--no-align",
-        "--tuples-only",
         "--no-psqlrc",
-        "--command",
-        query,
     ]
 
-    query_cmd = tuple(map(str, query_cmd))
-    query_env = {**environ, **env_extra}
 
-    log_func(f"{description}: \n{process_repr(query_cmd, env_extra)}")
+def _psql_native_session(args):
+    """Query session via psycopg (or psycopg2) if installed, None otherwise."""
+    # pylint: disable=import-outside-toplevel
+    try:
+        import psycopg as driver
+    except ImportError:
+        try:
+            import psycopg2 as driver
+        except ImportError:
+            return None
+
+    params = {
+        "host": args.host,
+        "port": args.port,
+        "user": args.user,
+        "dbname": args.dbname,
+        "passfile": args.scope["env"].get("PGPASSFILE"),
+    }
+
+    try:
+        connection = driver.connect(**{key: value for key, value in params.items() if value})
+        connection.autocommit = True
+    except driver.Error as e:
+        logger.warning("Native driver connection failed, using psql: %s", e)
+        return None
+
+    logger.debug("Query session: %s driver", driver.__name__)
+    return DriverSession(connection, driver.Error, "|", "")
+
+
+def _psql_session(args):
+    """Persistent query session (see `session.py`), started on first use."""
+    session = args.scope.get("session")
+    if session is not None:
+        return session
+
+    session = _psql_native_session(args)
+    if session is None:
+        session_cmd = _psql_client_cmd(args) + [
+            "--no-align",
+            "--tuples-only",
+            "--quiet",
+            "--set", "ON_ERROR_STOP=1",
+        ]
+        session_env = {**environ, **args.scope["env"]}
+        session = ClientSession(
+            session_cmd, session_env, lambda marker: f"\\echo {marker}", "psql query session")
+
+    atexit.register(session.close)
+    args.scope["session"] = session
+    return session
+
+
+def _psql_queries(args, queries, description="queries", log_func=logging.debug):
+    """Perform a batch of queries, return a list of results or None on failure."""
+    log_func(f"{description}: \n" + "\n".join(queries))
+
+    return _psql_session(args).query_many(queries, args.scope["env"])
+
+
+def _psql_query(args, query, description="query", log_func=logging.debug):
+    """Perform a query, return the output lines or None on failure."""
+    results = _psql_queries(args, [query], description, log_func)
+
+    return None if results is None else results[0]
+
+
+def _psql_first_clocks(args, tables):
+    """Return a dict of {table: lowest clock or None if empty}."""
+    clock_queries = [f'SELECT MIN(clock) FROM "{args.schema}"."{table}";' for table in tables]
+    clock_cmds = _psql_queries(args, clock_queries, "first clock queries")
+    if clock_cmds is None:
+        return None
+
+    begins = {}
+    for table, clock_cmd in zip(tables, clock_cmds):
+        begins[table] = int(clock_cmd[0]) if clock_cmd and clock_cmd[0] else None
+
+    return begins
+
+
+def _psql_checksums(args, tables):
+    """Return a dict of {table: checksum} (see `unchanged.py`) or None on failure."""
+    # rows count and the sum of the rows hashes: the order of the rows doesn't matter
+    checksum_queries = [
+        f"SELECT count(*) || ':' || coalesce(sum(hashtextextended(t::text, 0)), 0) "
+        f'FROM "{args.schema}"."{table}" AS t;'
+        for table in tables]
+    checksum_cmds = _psql_queries(args, checksum_queries, "config tables checksum queries")
+    if checksum_cmds is None:
+        return None
+
+    return dict(
+        (table, checksum_cmd[0])
+        for table, checksum_cmd in zip(tables, checksum_cmds) if checksum_cmd)
 
-    exec_query = DPopen(query_cmd, env=query_env, stdout=PIPE, text=True)
-    stdout, stderr = exec_query.communicate()
 
-    if exec_query.returncode != 0:
+def _psql_snapshot(args, description="snapshot session", log_func=logging.debug):
+    """
+    Open a `psql` session and export its snapshot.
+
+    The snapshot can be used by other sessions (and pg_dump --snapshot)
+    until `_psql_release_snapshot` is called.
+    Return a tuple (session, snapshot id, server time of the snapshot as a
+    unix timestamp) or (None, None, None) on error.
+    """
+    env_extra = args.scope["env"]
+
+    session_cmd = _psql_client_cmd(args) + ["--no-align", "--tuples-only", "--quiet"]
+    session_cmd = tuple(map(str, session_cmd))
+    session_env = {**environ, **env_extra}
+
+    log_func(f"{description}: \n{process_repr(session_cmd, env_extra)}")
+
+    session = DPopen(session_cmd, env=session_env, stdin=PIPE, stdout=PIPE, text=True)
+    session.stdin.write(
+        "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;\n"
+        "SELECT pg_export_snapshot();\n"
+        "SELECT extract(epoch from now())::bigint;\n")
+    session.stdin.flush()
+
+    snapshot = session.stdout.readline().strip()
+    clock = session.stdout.readline().strip()
+    if not snapshot or not clock.isdecimal():
+        _, stderr = session.communicate()
         if stderr is not None:
             logging.fatal(stderr)
-        return None
+        return None, None, None
+
+    logger.info("Exported snapshot: %s (clock %s)", snapshot, clock)
+    return session, snapshot, int(clock)
+
+
+def _psql_release_snapshot(session):
+    """End the transaction of a snapshot session and close it."""
+    session.communicate("COMMIT;\n")
+
 
-    return stdout.splitlines()
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def _psql_chunk_dump(args, table, start, stop, outpath, snapshot=None):
+    """Dump the rows of 'table' in the clock range [start, stop) via COPY."""
+    env_extra = args.scope["env"]
+
+    copy_query = (
+        f'COPY (SELECT * FROM "{args.schema}"."{table}" '
+        f'WHERE clock >= {start} AND clock < {stop}) TO STDOUT')
+
+    chunk_cmd = _psql_client_cmd(args) + ["--quiet", "--set", "ON_ERROR_STOP=1"]
+
+    # join the exported snapshot in a read only transaction
+    if snapshot is not None:
+        chunk_cmd += [
+            "--command", "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY",
+            "--command", f"SET TRANSACTION SNAPSHOT '{snapshot}'",
+        ]
+
+    chunk_cmd += ["--command", copy_query]
+
+    if snapshot is not None:
+        chunk_cmd += ["--command", "COMMIT"]
+
+    chunk_path = outpath.with_name(outpath.name + ".copy")
+    chunk_cmd = tuple(map(str, chunk_cmd))
+    chunk_env = {**environ, **env_extra}
+
+    logger.debug("chunk command: \n%s > %s", process_repr(chunk_cmd, env_extra), chunk_path)
+
+    if args.dry_run:
+        return True
+
+    chunk = DPopen(chunk_cmd, env=chunk_env, stdout=PIPE)
+    tee_file(chunk.stdout, chunk_path, args.scope["digests"])
+    chunk.communicate()
+
+    return chunk.returncode == 0
+
+
+def _pg_dump_progress(dump):
+    """
+    Log pg_dump verbose output (stderr of 'dump'), one line per completed
+    item, and wait for it.
+
+    Errors and warnings are logged as errors, so is the rest of the output
+    if pg_dump fails.
+    """
+    done = 0
+    output = []
+    for line in dump.stderr:
+        line = line.rstrip()
+        if "finished item" in line:
+            done += 1
+            logger.info("pg_dump progress [%d]: %s", done, line)
+        elif "error:" in line or "warning:" in line:
+            logger.error("%s", line)
+        else:
+            output.append(line)
+
+    dump.stderr.close()
+    dump.wait()
+
+    log_func = logger.error if dump.returncode != 0 else logger.debug
+    for line in output:
+        log_func("%s", line)
 
 
 def _pg_dump(
@@ -200,9 +492,19 @@ def _pg_dump(
 
     dump_path = f"{outpath}{ext}{compr_ext}"
 
-    dump_cmd += ["--file", str(dump_path)]
+    # streamed dumps are read from stdout (hashed on their way to the
+    # archive), otherwise pg_dump writes the file itself: custom dumps
+    # written to a pipe have no data offsets for a parallel pg_restore
+    stream = args.scope.get("stream", None)
+    if stream is None:
+        dump_cmd += ["--file", str(dump_path)]
+
+    jobs = args.scope.get("jobs", 1)
+    if jobs > 1:
+        dump_cmd += ["--jobs", jobs]
 
-    if args.verbosity in ("very", "debug"):
+    # verbose output is needed to follow the workers progress
+    if args.verbosity in ("very", "debug") or jobs > 1:
         dump_cmd += ["--verbose"]
 
     dump_cmd += params
@@ -216,7 +518,20 @@ def _pg_dump(
     if args.dry_run:
         return True
 
-    dump = DPopen(dump_cmd, env=dump_env)
-    dump.communicate()
+    # parallel workers are metered by the size of the dump directory
+    meter = args.scope["progress"]
+
+    if stream is not None:
+        dump = DPopen(dump_cmd, env=dump_env, stdout=PIPE)
+        meter.track(dump)
+        stream.add_stream(dump_path, dump.stdout)
+        dump.communicate()
+    elif jobs > 1:
+        dump = DPopen(dump_cmd, env=dump_env, stderr=PIPE, text=True)
+        _pg_dump_progress(dump)
+    else:
+        dump = DPopen(dump_cmd, env=dump_env)
+        meter.track(dump)
+        dump.communicate()
 
     return dump.returncode == 0
@@ -0,0 +1,305 @@
+"""
+Catalog of the backups of an output directory.
+
+Every run, failed ones included, is recorded in 'zabbix_catalog.jsonl',
+one JSON object per backup:
+
+    {"name": "zabbix_host_20240101-000000", "host": "host",
+     "file": "zabbix_host_20240101-000000.tar.xz", "timestamp": 1704067200,
+     "dbms": "mysql", "version": "6.4.10", "size": 262144,
+     "checksum": "sha256:...", "duration": 12.5, "status": 0,
+     "holders": ["zabbix_host_20231201-000000"]}
+
+'holders' are the older backups holding the data of its unchanged tables
+(see `unchanged.py`), the rotation keeps them.
+
+The catalog is rewritten aside and renamed under a lock: readers see
+either the previous or the next catalog, concurrent runs (other hosts)
+don't lose updates. Rotation, listing and verification read it instead
+of listing the output directory. It is built from the backups names the
+first time (see `scan_backups`), details unknown then are null.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+from datetime import datetime
+from contextlib import contextmanager
+from pathlib import Path
+
+from .digests import ARTIFACTS, verify_artifacts
+from .unchanged import holders
+from .progress import disk_usage, human_size, human_time, run_duration
+
+logger = logging.getLogger()
+
+
+CATALOG = "zabbix_catalog.jsonl"
+CATALOG_LOCK = ".zabbix_catalog.lock"
+
+# backups names and their extension
+re_cfg = re.compile(r"""
+    zabbix_                             # suffix
+    (?P<hostorname>[^_]+?)_             # host name
+    (?P<year>[0-9]{4})                  # yearmonthday-hourminutesecond
+    (?P<month>[0-9]{2})                 #
+    (?P<day>[0-9]{2})-                  #
+    (?P<hour>[0-9]{2})                  #
+    (?P<minute>[0-9]{2})                #
+    (?P<second>[0-9]{2})                #
+    #(?P<version>([0-9][.])+?[0-9]+?)    # zabbix version and eol
+    (?P<ext>([.]tar([.](gz|xz|bz2|zst|lz4))?|[.]manifest))? # extension (empty if plain folder)
+""", re.VERBOSE)
+
+
+def backup_datetime(match):
+    """Datetime (local time) of a backup name matched by 're_cfg'."""
+    return datetime(*(int(match[key]) for key in (
+        "year", "month", "day", "hour", "minute", "second")))
+
+
+def _entry(path):
+    """Catalog entry of the backup 'path' from its name, None if not a backup."""
+    match = re_cfg.fullmatch(path.name)
+    if match is None:
+        return None
+
+    return {
+        "name": path.name[:match.start("ext")] if match["ext"] else path.name,
+        "host": match["hostorname"],
+        "file": path.name,
+        "timestamp": int(time.mktime(backup_datetime(match).timetuple())),
+        "dbms": None,
+        "version": None,
+        "size": None,
+        "checksum": None,
+        "duration": None,
+        "status": None,
+        "holders": None,
+    }
+
+
+def file_checksum(path, block=1024 * 1024):
+    """SHA-256 of the file 'path' as 'sha256:<hex>'."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while data := fh.read(block):
+            digest.update(data)
+
+    return f"sha256:{digest.hexdigest()}"
+
+
+def scan_backups(outdir):
+    """Catalog entries of the backups found in 'outdir' by name, oldest first."""
+    entries = []
+    for path in Path(outdir).iterdir():
+        entry = _entry(path)
+        if entry is not None:
+            if path.is_file():
+                entry["size"] = path.stat().st_size
+            entries.append(entry)
+
+    return sorted(entries, key=lambda entry: (entry["timestamp"], entry["file"]))
+
+
+def read_catalog(outdir):
+    """Catalog entries of 'outdir', None if there's no catalog."""
+    path = Path(outdir) / CATALOG
+    if not path.exists():
+        return None
+
+    entries = []
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                entries.append(json.loads(line))
+
+    return entries
+
+
+def _write_catalog(path, entries):
+    """Write the catalog 'path' atomically."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        for entry in entries:
+            fh.write(json.dumps(entry, sort_keys=True) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _catalog_lock(outdir):
+    """Hold the catalog lock of 'outdir'."""
+    with open(Path(outdir) / CATALOG_LOCK, "a", encoding="ascii") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def update_catalog(outdir, add=(), remove=(), rebuild=False):
+    """
+    Add the entries 'add' (replacing the ones of the same file) and remove
+    the files 'remove' from the catalog of 'outdir'.
+
+    A missing catalog (or with 'rebuild') is built from the backups names first.
+    Return the updated entries.
+    """
+    path = Path(outdir) / CATALOG
+    with _catalog_lock(outdir):
+        entries = None if rebuild else read_catalog(outdir)
+        if entries is None:
+            logger.info("Backup catalog: building %s from the backups names", path)
+            entries = scan_backups(outdir)
+
+        drop = set(remove).union(entry["file"] for entry in add)
+        entries = [entry for entry in entries if entry["file"] not in drop] + list(add)
+        entries.sort(key=lambda entry: (entry["timestamp"], entry["file"]))
+
+        _write_catalog(path, entries)
+
+    return entries
+
+
+def record_backup(args, path, status):
+    """Record the run of the backup 'path' (archive, manifest or folder) in the catalog."""
+    scope = args.scope
+    path = Path(path)
+
+    entry = _entry(path)
+    entry.update(
+        dbms=scope["dbms"],
+        version=scope.get("version"),
+        duration=round(run_duration(scope["progress"].timings), 3),
+        status=status,
+        holders=holders(scope.get("checksums", {}), entry["name"]),
+    )
+
+    try:
+        if path.is_file():
+            entry["size"] = path.stat().st_size
+            # computed while the archive was written, if it was
+            entry["checksum"] = scope.get("archive_digest") or file_checksum(path)
+        elif "archive_size" in scope:
+            entry["size"] = scope["archive_size"][1]
+        elif path.is_dir():
+            entry["size"] = disk_usage(path)
+
+        update_catalog(path.parent, add=[entry])
+    except OSError as e:
+        logger.error("Cannot update the backup catalog: %s", e)
+        return
+
+    logger.info("Backup catalog: %s recorded", entry["file"])
+
+
+def fill_checksums(outdir, host):
+    """
+    Checksum the backups of 'host' cataloged without one (the catalog was
+    built from the backups names), in background during the dump.
+    """
+    entries = read_catalog(outdir)
+    if entries is None:
+        return
+
+    checksums = {}
+    try:
+        for entry in entries:
+            path = Path(outdir) / entry["file"]
+            if entry["host"] == host and entry["checksum"] is None and path.is_file():
+                checksums[entry["file"]] = (path.stat().st_size, file_checksum(path))
+
+        if not checksums:
+            return
+
+        # the catalog may have changed meanwhile (other runs, rotation)
+        with _catalog_lock(outdir):
+            entries = read_catalog(outdir) or []
+            for entry in entries:
+                if entry["file"] in checksums and entry["checksum"] is None:
+                    entry["size"], entry["checksum"] = checksums[entry["file"]]
+
+            _write_catalog(Path(outdir) / CATALOG, entries)
+    except OSError as e:
+        logger.warning("Cannot checksum older backups: %s", e)
+        return
+
+    logger.info("Backup catalog: %d older backup/s checksummed", len(checksums))
+
+
+def verify_entry(outdir, entry):
+    """Check a backup against its catalog entry, return a list of problems."""
+    path = Path(outdir) / entry["file"]
+    if not path.exists():
+        return ["missing"]
+
+    problems = []
+    if path.is_file():
+        if entry["size"] is not None and path.stat().st_size != entry["size"]:
+            problems.append(f"size {path.stat().st_size} (expected {entry['size']})")
+        elif entry["checksum"] is not None and file_checksum(path) != entry["checksum"]:
+            problems.append("checksum mismatch")
+    elif (path / ARTIFACTS).is_file():
+        problems.extend(verify_artifacts(path))
+
+    return problems
+
+
+def catalog_table(entries, problems=None):
+    """Format catalog entries as a text table (with verification results if given)."""
+    header = ("backup", "dbms", "version", "size", "duration", "status")
+    if problems is not None:
+        header += ("verify", )
+
+    def _value(value, fmt=str):
+        return "-" if value is None else fmt(value)
+
+    rows = [header]
+    for index, entry in enumerate(entries):
+        row = (
+            entry["file"],
+            _value(entry["dbms"]),
+            _value(entry["version"]),
+            _value(entry["size"], human_size),
+            _value(entry["duration"], human_time),
+            _value(entry["status"]),
+        )
+        if problems is not None:
+            row += (", ".join(problems[index]) or "ok", )
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        for row in rows)
+
+
+def catalog(args):
+    """List (and verify) the backups of 'args.outdir', return (status, message)."""
+    outdir = args.outdir
+    if args.rebuild:
+        entries = update_catalog(outdir, rebuild=True)
+    else:
+        entries = read_catalog(outdir)
+        if entries is None:
+            return 1, f"No backup catalog in {str(outdir)!r} (see --rebuild)"
+
+    if args.name is not None:
+        entries = [entry for entry in entries if entry["host"] == args.name]
+
+    problems = None
+    if args.verify:
+        problems = [verify_entry(outdir, entry) for entry in entries]
+
+    print(catalog_table(entries, problems))
+
+    if problems is not None and any(problems):
+        failed = [entry["file"] for entry, problem in zip(entries, problems) if problem]
+        return 2, f"Verification failed: {failed!r}"
+
+    return 0, "+OK"
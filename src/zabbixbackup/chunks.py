@@ -0,0 +1,240 @@
+"""
+Helper functions to export monitoring tables by 'clock' ranges.
+
+Every range (chunk) is dumped by its own process into its own file,
+chunks are dumped concurrently and a failed chunk is retried alone.
+
+In incremental mode, the upper bound of the exported ranges (watermark) is
+saved and the next backup starts from there, once the backup is archived
+(see `commit_watermarks`). The watermark lags behind the server time of the
+backup ('watermark_lag' seconds), rows committed late with an older clock
+are exported by the next backup.
+"""
+import os
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .tables import zabbix
+
+logger = logging.getLogger()
+
+
+PERIODS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+
+RETRIES = 2
+
+WATERMARKS = "watermarks"
+
+
+def clock_ranges(begin, end, period):
+    """
+    Split the interval [begin, end) in ranges of 'period' seconds.
+
+    Ranges are aligned to multiples of 'period' (UTC) so that the same
+    chunk has the same boundaries, and the same name, across backups.
+    The last range is cut at 'end'. A None period means a single range.
+    """
+    ranges = []
+    if begin >= end:
+        return ranges
+
+    if period is None:
+        return [(begin, end)]
+
+    start = begin - begin % period
+    while start < end:
+        stop = min(start + period, end)
+        ranges.append((start, stop))
+        start += period
+
+    return ranges
+
+
+def plan_chunks(begins, end, period):
+    """
+    List the chunks to dump as tuples (table, start, stop).
+
+    'begins' is a dict in the form of {"tablename": first clock, ...},
+    tables with no rows (None) are skipped.
+    """
+    return [
+        (table, start, stop)
+        for table, begin in sorted(begins.items())
+        if begin is not None
+        for start, stop in clock_ranges(begin, end, period)
+    ]
+
+
+def largest_first(chunks, sizes):
+    """
+    Order chunks by estimated size, largest first.
+
+    A chunk is estimated as its share of the table time span times the
+    table size ('sizes' is a dict in the form of {"tablename": size, ...}).
+    """
+    spans = {}
+    for table, start, stop in chunks:
+        spans[table] = spans.get(table, 0) + (stop - start)
+
+    def _estimate(chunk):
+        table, start, stop = chunk
+        return sizes.get(table, 0) * (stop - start) / spans[table]
+
+    return sorted(chunks, key=lambda chunk: (-_estimate(chunk), chunk))
+
+
+def plan_table_chunks(args, tables, first_clocks, end):
+    """
+    Plan the chunks of 'tables' up to 'end' (excluded), the server time.
+
+    Incremental tables start from the previous watermark, if any, and stop
+    'args.watermark_lag' seconds before 'end' (the new watermark). The others
+    start from their first row when split by period ('first_clocks(tables)'
+    returns a dict {table: clock} or None on error) or from 0.
+
+    Return a tuple (chunks, new watermarks) or (None, None) on error.
+    """
+    period = args.scope["chunk"]
+    watermark = end - args.watermark_lag
+
+    incremental = []
+    previous = {}
+    if args.monitoring == "incremental":
+        incremental = [table for table in tables if table in zabbix.incremental]
+        previous = read_watermarks(watermarks_path(args))
+
+    begins = dict(
+        (table, previous[table])
+        for table in incremental if table in previous)
+
+    for table, begin in begins.items():
+        logger.info("Incremental export of %s from clock %d", table, begin)
+
+    rest = [table for table in tables if table not in begins]
+    if period is None:
+        begins.update((table, 0) for table in rest)
+    else:
+        first = first_clocks(rest)
+        if first is None:
+            return None, None
+        begins.update(first)
+
+    # never move back (i.e. a longer lag), the rows are already exported
+    watermarks = dict(
+        (table, max(watermark, previous.get(table, watermark)))
+        for table in incremental)
+
+    stop = watermark if incremental else end
+
+    return plan_chunks(begins, stop, period), watermarks
+
+
+def watermarks_path(args):
+    """Path of the incremental state (last watermarks) in the output directory."""
+    name = args.name if args.name is not None else args.host
+    outdir = args.scope.get("outdir", args.outdir)
+
+    return Path(outdir) / f"zabbix_{name}.watermarks"
+
+
+def read_watermarks(path):
+    """Read watermarks as a dict {table: clock}, empty if 'path' doesn't exist."""
+    watermarks = {}
+    if not Path(path).exists():
+        return watermarks
+
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            table, _, clock = line.strip().partition(" ")
+            if table and clock.isdecimal():
+                watermarks[table] = int(clock)
+
+    return watermarks
+
+
+def write_watermarks(path, watermarks):
+    """Write watermarks atomically (one 'table clock' pair per line)."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.writelines(
+            f"{table} {clock}\n" for table, clock in sorted(watermarks.items()))
+
+    os.replace(tmp_path, path)
+
+
+def save_watermarks(args, watermarks):
+    """
+    Save watermarks with the backup, they are the state for the next backup
+    once committed (see `commit_watermarks`).
+    """
+    write_watermarks(WATERMARKS, watermarks)
+    args.scope["watermarks"] = watermarks
+
+
+def commit_watermarks(args):
+    """
+    Save the watermarks of the backup as the state for the next backup,
+    only once the backup is archived: a failed run doesn't move them.
+
+    The previous state is updated, tables not exported keep their watermark.
+    """
+    watermarks = args.scope.get("watermarks")
+    if not watermarks or args.dry_run:
+        return
+
+    state_path = watermarks_path(args)
+    state = read_watermarks(state_path)
+    state.update(watermarks)
+    write_watermarks(state_path, state)
+    logger.info("Watermarks saved: %s", state_path)
+
+
+def chunk_path(table, start, ext=""):
+    """Path of the artifact of the chunk of 'table' starting at 'start'."""
+    dt_str = datetime.fromtimestamp(start, tz=timezone.utc).strftime("%Y%m%d-%H%M%S")
+
+    return Path("chunks") / table / f"{table}_{dt_str}{ext}"
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def dump_chunks(chunks, dump_chunk, jobs, retries=RETRIES, stream=None):
+    """
+    Dump chunks concurrently with up to 'jobs' workers.
+
+    'chunks' is a list of tuples (table, start, stop) and
+    'dump_chunk(table, start, stop, outpath)' performs the actual dump
+    returning True on success. 'outpath' has no extension, the dump function
+    adds the one it needs.
+
+    Partial artifacts of a failed chunk are removed before retrying it.
+    With a 'stream' (see `stream.py`) every complete chunk is moved into the
+    archive right away.
+    Return the list of chunks that failed every attempt.
+    """
+    def _worker(chunk):
+        table, start, stop = chunk
+        outpath = chunk_path(table, start)
+        outpath.parent.mkdir(parents=True, exist_ok=True)
+
+        for attempt in range(1, retries + 2):
+            if dump_chunk(table, start, stop, outpath):
+                logger.info("Chunk %s: done", outpath.name)
+                if stream is not None:
+                    for artifact in outpath.parent.glob(f"{outpath.name}*"):
+                        stream.add_file(artifact, str(artifact))
+                        artifact.unlink()
+                return True
+
+            logger.warning("Chunk %s: failed (attempt %d)", outpath.name, attempt)
+            for partial in outpath.parent.glob(f"{outpath.name}*"):
+                partial.unlink()
+
+        return False
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(_worker, chunks))
+
+    return [chunk for chunk, success in zip(chunks, results) if not success]
@@ -0,0 +1,181 @@
+"""
+In-process parallel compression, used when no compression binary is available.
+
+The input is split in blocks compressed independently on a thread pool
+(`zlib`, `lzma` and `bz2` release the GIL while compressing) and written
+in order. Every block is a complete gzip, xz or bzip2 member: the result
+is a standard multi-member file, readable by the usual tools.
+"""
+import os
+import bz2
+import lzma
+import zlib
+import logging
+import threading
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+
+# Uncompressed size of a block, larger blocks for larger compression windows
+BLOCK_SIZES = {
+    "gzip": 1024 * 1024,
+    "bzip2": 900 * 1024,
+    "xz": 8 * 1024 * 1024,
+}
+
+
+def _compress_gzip(level, data):
+    # wbits 31: gzip header and trailer (mtime 0)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compress_bzip2(level, data):
+    return bz2.compress(data, level)
+
+
+def _compress_xz(preset, data):
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=preset)
+
+
+def compress_block_func(profile):
+    """Return a function compressing a block as a member of 'profile' format."""
+    algo, level, extra = profile
+
+    if algo == "gzip":
+        return partial(_compress_gzip, int(level))
+
+    if algo == "bzip2":
+        return partial(_compress_bzip2, int(level))
+
+    if algo == "xz":
+        preset = int(level)
+        if "--extreme" in extra:
+            preset |= lzma.PRESET_EXTREME
+        return partial(_compress_xz, preset)
+
+    raise NotImplementedError(f"In-process compression not available '{algo}'")
+
+
+class ParallelCompressor:
+    """
+    File-like (write only) object compressing into 'fileobj' with up to
+    'threads' threads (None for every core).
+
+    Memory usage is bounded to two blocks per thread.
+    """
+    def __init__(self, fileobj, profile, threads=None):
+        self.fileobj = fileobj
+        self.compress = compress_block_func(profile)
+        self.block_size = BLOCK_SIZES[profile[0]]
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.blocks = 0
+
+
+    def write(self, data):
+        """Buffer 'data' and compress every complete block."""
+        self.buffer += data
+
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self._submit(block)
+
+        return len(data)
+
+
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(self.compress, block))
+        self.blocks += 1
+
+        while len(self.pending) > 2 * self.threads:
+            self._write_next()
+
+
+    def _write_next(self):
+        self.fileobj.write(self.pending.popleft().result())
+
+
+    def close(self):
+        """Compress the last block and write everything left, 'fileobj' is left open."""
+        # an empty input is still a valid (empty) member
+        if self.buffer or self.blocks == 0:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+
+        try:
+            while self.pending:
+                self._write_next()
+        finally:
+            self.executor.shutdown()
+
+
+def compress_stream(src, dst, profile, threads=None):
+    """Compress 'src' into 'dst' (binary file objects) until the end of 'src'."""
+    compressor = ParallelCompressor(dst, profile, threads)
+
+    try:
+        while True:
+            data = src.read(compressor.block_size)
+            if not data:
+                break
+            compressor.write(data)
+    finally:
+        compressor.close()
+
+
+class CompressThread(threading.Thread):
+    """
+    Compress 'src' into 'dst' in background, both are closed at the end.
+
+    It mimics the subset of `subprocess.Popen` used for compress processes
+    (`wait`, `communicate` and `returncode`). With 'dst' None the output
+    is available from 'stdout'.
+    """
+    def __init__(self, src, dst, profile, threads=None):
+        super().__init__(daemon=True)
+        self.src = src
+        self.profile = profile
+        self.threads = threads
+        self.returncode = None
+        self.stdout = None
+
+        if dst is None:
+            read_fd, write_fd = os.pipe()
+            # pylint: disable-next=consider-using-with
+            self.stdout = open(read_fd, "rb")
+            # pylint: disable-next=consider-using-with
+            dst = open(write_fd, "wb")
+        self.dst = dst
+
+        self.start()
+
+
+    def run(self):
+        try:
+            compress_stream(self.src, self.dst, self.profile, self.threads)
+            self.returncode = 0
+        except (OSError, ValueError, lzma.LZMAError, zlib.error) as e:
+            logger.error("In-process compression failed: %s", e)
+            self.returncode = 1
+        finally:
+            self.src.close()
+            self.dst.close()
+
+
+    def wait(self):
+        """Wait for the compression to finish."""
+        self.join()
+        return self.returncode
+
+
+    def communicate(self):
+        """Wait for the compression to finish."""
+        self.join()
+        return None, None
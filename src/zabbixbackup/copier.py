@@ -0,0 +1,319 @@
+"""
+In-process copy of files and directories trees, as `cp -a` does.
+
+Trees are walked with `os.scandir`, directories and symbolic links are
+created as they are found and the data of regular files is copied by a
+small pool of threads with `os.copy_file_range` (in kernel, or reflinks
+where the file system supports them), `os.sendfile` or, last, read and
+write. Ownership (if allowed), modes, timestamps, extended attributes
+and hard links within the copy are kept. Directories get their metadata
+last, once their content is copied.
+
+Incremental copies (see `copy_trees`) hard link the files unchanged
+since a previous copy, described by its index: path, size, mtime, mode,
+ownership and SHA-256 of every regular file. Reflinks and, last, plain
+copies are used where hard links are not possible.
+"""
+import os
+import stat
+import errno
+import fcntl
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+
+COPY_THREADS = 4
+COPY_CHUNK = 8 * 1024 * 1024
+
+# ioctl cloning a file (reflink, Linux: btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# index fields telling a file unchanged
+INDEX_KEYS = ("size", "mtime_ns", "mode", "uid", "gid")
+
+# copy_file_range or sendfile not supported for these files or file systems
+_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+
+def _copy_data(src, dst):
+    """Copy the data of the regular file 'src' to 'dst', return the bytes copied."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+
+        # pseudo files (i.e. /proc) report no size but have content
+        if os.fstat(infd).st_size > 0:
+            for func in (
+                    getattr(os, "copy_file_range", None),
+                    lambda infd, outfd, count: os.sendfile(outfd, infd, None, count)):
+                if func is None:
+                    continue
+
+                copied = 0
+                try:
+                    while written := func(infd, outfd, COPY_CHUNK):
+                        copied += written
+                    return copied
+                except OSError as e:
+                    if copied or e.errno not in _UNSUPPORTED:
+                        raise
+
+        shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+        return fdst.tell()
+
+
+def _copy_xattrs(src, dst):
+    """Copy the extended attributes of 'src' (not followed if a link) to 'dst'."""
+    try:
+        names = os.listxattr(src, follow_symlinks=False)
+    except OSError:
+        return
+
+    for name in names:
+        try:
+            value = os.getxattr(src, name, follow_symlinks=False)
+            os.setxattr(dst, name, value, follow_symlinks=False)
+        except OSError as e:
+            # i.e. 'security.*' or 'trusted.*' attributes as a user
+            if e.errno not in (errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.ENODATA):
+                raise
+
+
+def _copy_metadata(src, dst, st):
+    """Copy ownership, mode, extended attributes and timestamps of 'src' ('st') to 'dst'."""
+    try:
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+    except PermissionError:
+        pass
+
+    if not stat.S_ISLNK(st.st_mode):
+        os.chmod(dst, stat.S_IMODE(st.st_mode))
+
+    _copy_xattrs(src, dst)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
+
+
+def _sha256(path):
+    """SHA-256 (hex) of the file 'path'."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while data := fh.read(COPY_CHUNK):
+            digest.update(data)
+
+    return digest.hexdigest()
+
+
+def index_entry(path, st, sha256):
+    """Index entry of the file 'path' ('st' its stat)."""
+    return {
+        "path": str(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "mode": st.st_mode,
+        "uid": st.st_uid,
+        "gid": st.st_gid,
+        "sha256": sha256,
+    }
+
+
+def _copy_file(src, dst, st, digest=False):
+    """
+    Copy a regular file with its metadata.
+
+    Return the bytes copied, its SHA-256 (if 'digest') and whether it was linked.
+    """
+    size = _copy_data(src, dst)
+    _copy_metadata(src, dst, st)
+    return size, _sha256(dst) if digest else None, False
+
+
+def _reflink(src, dst):
+    """Clone the file 'src' as 'dst' (reflink), False if not supported."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            pass
+
+    os.unlink(dst)
+    return False
+
+
+def _link_file(previous, src, dst, st, entry):
+    """
+    Hard link (or reflink) the unchanged file 'previous' as 'dst', copy
+    'src' if neither is possible or 'previous' changed.
+    """
+    try:
+        prev = os.lstat(previous)
+        if not all(getattr(prev, f"st_{key}") == entry[key] for key in INDEX_KEYS):
+            raise FileNotFoundError(previous)
+
+        try:
+            os.link(previous, dst)
+            return 0, entry["sha256"], True
+        except OSError:
+            # other file system, too many links, ...
+            if _reflink(previous, dst):
+                _copy_metadata(src, dst, st)
+                return 0, entry["sha256"], True
+    except FileNotFoundError:
+        pass
+
+    return _copy_file(src, dst, st, digest=True)
+
+
+class _Copy:
+    """State of a copy: pending file copies, hard links and directories."""
+    def __init__(self, executor, base=None, previous=None):
+        self.executor = executor
+        self.base = base
+        self.previous = previous
+        self.index = []
+        self.linked = 0
+        self.futures = []
+        self.inodes = {}
+        self.links = []
+        self.dirs = []
+        # overlapping entries of the files list are copied once
+        self.copied = set()
+
+
+    def copy(self, src, dst):
+        """Copy 'src' (not followed if a link) to 'dst', directories recursively."""
+        st = os.lstat(src)
+
+        if stat.S_ISDIR(st.st_mode):
+            os.makedirs(dst, exist_ok=True)
+            with os.scandir(src) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    self._item(Path(entry.path), Path(dst) / entry.name)
+            # metadata once the content is copied, innermost first
+            self.dirs.append((src, dst, st))
+            return
+
+        if dst in self.copied:
+            return
+        self.copied.add(dst)
+
+        if os.path.lexists(dst) and not os.path.isdir(dst):
+            os.unlink(dst)
+
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), dst)
+            _copy_metadata(src, dst, st)
+        elif stat.S_ISREG(st.st_mode):
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in self.inodes:
+                    self.links.append((self.inodes[key], dst))
+                    return
+                self.inodes[key] = dst
+            self._submit(src, dst, st)
+        else:
+            # fifos, devices (as root) and sockets
+            os.mknod(dst, st.st_mode, st.st_rdev)
+            _copy_metadata(src, dst, st)
+
+
+    def _submit(self, src, dst, st):
+        """Copy a regular file in background, linked if unchanged (incremental copy)."""
+        if self.base is None:
+            future = self.executor.submit(_copy_file, src, dst, st)
+            self.futures.append((src, None, st, future))
+            return
+
+        path = dst.relative_to(self.base)
+        entry = None
+        if self.previous is not None:
+            entry = self.previous[1].get(str(path))
+
+        if entry is not None and all(
+                getattr(st, f"st_{key}") == entry[key] for key in INDEX_KEYS):
+            future = self.executor.submit(
+                _link_file, self.previous[0] / path, src, dst, st, entry)
+        else:
+            future = self.executor.submit(_copy_file, src, dst, st, True)
+
+        self.futures.append((src, path, st, future))
+
+
+    def _item(self, src, dst):
+        """Copy an item of a directory, errors are logged."""
+        try:
+            self.copy(src, dst)
+        except OSError as e:
+            logger.warning("Cannot copy %s, ignoring: %s", src, e)
+
+
+    def finish(self):
+        """Wait for the file copies, then link and set the directories metadata."""
+        files, size = 0, 0
+        digests = {}
+        for src, path, st, future in self.futures:
+            try:
+                copied, sha256, linked = future.result()
+            except OSError as e:
+                logger.warning("Cannot copy %s, ignoring: %s", src, e)
+                continue
+
+            size += copied
+            files += 1
+            self.linked += linked
+            if path is not None:
+                digests[path] = sha256
+                self.index.append(index_entry(path, st, sha256))
+
+        for target, dst in self.links:
+            try:
+                os.link(target, dst)
+                files += 1
+                if self.base is not None:
+                    path, target = dst.relative_to(self.base), target.relative_to(self.base)
+                    if target in digests:
+                        self.index.append(index_entry(path, os.lstat(dst), digests[target]))
+            except OSError as e:
+                logger.warning("Cannot link %s to %s, ignoring: %s", dst, target, e)
+
+        for src, dst, st in self.dirs:
+            try:
+                _copy_metadata(src, dst, st)
+            except OSError as e:
+                logger.warning("Cannot copy the metadata of %s, ignoring: %s", src, e)
+
+        return files, size
+
+
+def copy_trees(items, threads=COPY_THREADS, base=None, previous=None):
+    """
+    Copy every '(src, dst)' of 'items' as `cp -a` would (an existing
+    directory 'dst' is merged). Files data is copied on up to 'threads'
+    threads.
+
+    Incremental copy: with 'base' (the root of every 'dst') the copy is
+    indexed (see `index_entry`), with 'previous' ('(root, index)', the
+    index as a dict by path) unchanged files are linked from 'root'.
+
+    Failures are logged and skipped. Return the number of files, bytes
+    copied and files linked, and the index (sorted by path, empty unless
+    'base').
+    """
+    with ThreadPoolExecutor(threads, thread_name_prefix="copy") as executor:
+        state = _Copy(executor, base, previous)
+        for src, dst in items:
+            try:
+                state.copy(Path(src), Path(dst))
+            except OSError as e:
+                logger.warning("Cannot copy %s, ignoring: %s", src, e)
+            else:
+                logger.info("Copying %s", src)
+
+        files, size = state.finish()
+
+    index = sorted(state.index, key=lambda entry: entry["path"])
+    return files, size, state.linked, index
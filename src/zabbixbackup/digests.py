@@ -0,0 +1,180 @@
+"""
+Checksums (SHA-256) of the backup artifacts, computed while they are written.
+
+Dumps are hashed on their way to the disk: the output of the compressor
+(or of the dump, uncompressed) is copied to its file through `tee_file`,
+dumps streamed into the archive are hashed by `TarStream` and so is the
+archive itself. Files written by other programs (i.e. `pg_dump --file`,
+7z) are hashed when the manifest is written, at the end of the backup.
+
+The manifest, 'artifacts.sha256', lists every file of the backup with
+its digest and size (tab separated), dumps streamed into the archive
+under the name of the rebuilt dump (see `stream.py`):
+
+    sha256:9f86d0...    1048576    data_dump.sql.gz
+
+Verify a backup folder (or an extracted archive) with `verify_artifacts`
+or `zabbixbackup catalog --verify`.
+"""
+import os
+import hashlib
+import logging
+from pathlib import Path
+
+logger = logging.getLogger()
+
+
+ARTIFACTS = "artifacts.sha256"
+
+BLOCK = 1024 * 1024
+
+
+class HashingWriter:
+    """
+    Write-only file object hashing the data written to 'fileobj'.
+
+    On close '(size, digest)' is recorded in 'digests' under 'name', if given.
+    """
+    def __init__(self, fileobj, digests=None, name=None):
+        self.fileobj = fileobj
+        self.digests = digests
+        self.name = name
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+
+    @property
+    def digest(self):
+        """Digest of the data written so far, as 'sha256:<hex>'."""
+        return f"sha256:{self.hash.hexdigest()}"
+
+
+    def write(self, data):
+        """Hash and write 'data'."""
+        self.hash.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+
+    def flush(self):
+        """Flush 'fileobj'."""
+        self.fileobj.flush()
+
+
+    def close(self):
+        """Close 'fileobj' and record the digest."""
+        self.fileobj.close()
+        if self.digests is not None:
+            self.digests[os.path.normpath(self.name)] = (self.size, self.digest)
+
+
+def tee_file(src, path, digests):
+    """
+    Copy the pipe 'src' into the file 'path' until its end, hashing it
+    (see `HashingWriter`). 'src' is left open. Return the number of bytes
+    written.
+    """
+    # pylint: disable-next=consider-using-with
+    writer = HashingWriter(open(path, "wb"), digests, str(path))
+    try:
+        while data := src.read(BLOCK):
+            writer.write(data)
+    finally:
+        writer.close()
+
+    return writer.size
+
+
+def files_digest(paths):
+    """Size and digest (as 'sha256:<hex>') of the files 'paths', one after another."""
+    digest = hashlib.sha256()
+    size = 0
+    for path in paths:
+        with open(path, "rb") as fh:
+            while data := fh.read(BLOCK):
+                digest.update(data)
+                size += len(data)
+
+    return size, f"sha256:{digest.hexdigest()}"
+
+
+def file_digest(path):
+    """Size and digest (as 'sha256:<hex>') of the file 'path'."""
+    return files_digest([path])
+
+
+def backup_files(backup_dir):
+    """Regular files of 'backup_dir' (paths relative to it), sorted."""
+    files = []
+    for root, _, names in os.walk(backup_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append(os.path.relpath(path, backup_dir))
+
+    return sorted(files)
+
+
+def write_artifacts(backup_dir, digests, streamed=None):
+    """
+    Write the manifest of 'backup_dir'. Digests computed inline ('digests',
+    by path) are used if the size still matches, other files are hashed.
+    'streamed' are the digests of the dumps streamed into the archive.
+    """
+    backup_dir = Path(backup_dir)
+    artifacts = dict(streamed or {})
+    hashed = 0
+
+    for path in backup_files(backup_dir):
+        if path == ARTIFACTS:
+            continue
+
+        size = os.lstat(backup_dir / path).st_size
+        if path in digests and digests[path][0] == size:
+            artifacts[path] = digests[path]
+        else:
+            artifacts[path] = file_digest(backup_dir / path)
+            hashed += 1
+
+    with open(backup_dir / ARTIFACTS, "w", encoding="utf-8") as fh:
+        for path, (size, digest) in sorted(artifacts.items()):
+            fh.write(f"{digest}\t{size}\t{path}\n")
+
+    logger.info(
+        "Artifacts manifest: %d files (%d hashed inline)", len(artifacts), len(artifacts) - hashed)
+
+
+def read_artifacts(path):
+    """Read a manifest as a dict {path: (size, digest)}."""
+    artifacts = {}
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t", 2)
+            if len(fields) == 3:
+                digest, size, name = fields
+                artifacts[name] = (int(size), digest)
+
+    return artifacts
+
+
+def verify_artifacts(backup_dir):
+    """Check the files of 'backup_dir' against its manifest, return a list of problems."""
+    backup_dir = Path(backup_dir)
+    problems = []
+
+    for path, expected in read_artifacts(backup_dir / ARTIFACTS).items():
+        target = backup_dir / path
+        if target.is_file():
+            actual = file_digest(target)
+        else:
+            # streamed dumps are stored in parts
+            parts = sorted(target.parent.glob(f"{target.name}.part[0-9][0-9][0-9][0-9]"))
+            if not parts:
+                problems.append(f"{path}: missing")
+                continue
+            actual = files_digest(parts)
+
+        if actual != expected:
+            problems.append(f"{path}: checksum mismatch")
+
+    return problems
@@ -0,0 +1,117 @@
+"""
+Backup metrics in Prometheus text format (node_exporter textfile collector).
+
+The file is written at the end of every run (failed ones included) and
+replaced atomically: the collector never reads a partial file.
+
+    zabbixbackup_phase_duration_seconds{phase="data_dump",...} 12.5
+    zabbixbackup_archive_bytes{stage="uncompressed",...} 1048576
+    zabbixbackup_archive_bytes{stage="compressed",...} 262144
+    zabbixbackup_archive_compression_ratio{...} 4.0
+    zabbixbackup_tables{kind="config",...} 120
+    zabbixbackup_rotate_backups{action="kept",...} 7
+    zabbixbackup_exit_status{...} 0
+"""
+import os
+import time
+import logging
+
+from .progress import run_duration
+
+logger = logging.getLogger()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def format_metrics(metrics, labels):
+    """
+    Format 'metrics' as a list of (name, help, [(extra labels, value)]).
+
+    'labels' are added to every sample.
+    """
+    lines = []
+    for name, description, samples in metrics:
+        if not samples:
+            continue
+
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for extra, value in samples:
+            lines.append(f"{name}{{{_labels({**labels, **extra})}}} {value}")
+
+    return "".join(f"{line}\n" for line in lines)
+
+
+def collect_metrics(args, status):
+    """Collect the metrics of this run from 'args.scope'."""
+    scope = args.scope
+
+    durations = dict(
+        (phase, timing["wall"]) for phase, timing in scope["progress"].timings.items())
+    phases = [
+        ({"phase": phase.replace(" ", "_")}, round(seconds, 3))
+        for phase, seconds in durations.items()
+    ]
+    # phases in background overlap with the others
+    total = [({}, round(run_duration(scope["progress"].timings), 3))]
+
+    sizes, ratio = [], []
+    if "archive_size" in scope:
+        before, after = scope["archive_size"]
+        sizes = [({"stage": "uncompressed"}, before), ({"stage": "compressed"}, after)]
+        if after:
+            ratio = [({}, round(before / after, 3))]
+
+    tables = [({"kind": kind}, count) for kind, count in scope.get("tables", {}).items()]
+
+    rotated = []
+    if scope.get("rotate") is not None:
+        kept, removed = scope["rotate"]
+        rotated = [({"action": "kept"}, kept), ({"action": "removed"}, removed)]
+
+    return [
+        ("zabbixbackup_phase_duration_seconds", "Duration of a backup phase.", phases),
+        ("zabbixbackup_duration_seconds", "Duration of the timed phases.", total),
+        ("zabbixbackup_archive_bytes", "Archive size before and after compression.", sizes),
+        ("zabbixbackup_archive_compression_ratio", "Archive compression ratio.", ratio),
+        ("zabbixbackup_tables", "Tables found by kind and by action.", tables),
+        ("zabbixbackup_rotate_backups", "Backups kept and removed by rotation.", rotated),
+        ("zabbixbackup_exit_status", "Exit status (0 on success).", [({}, status)]),
+        ("zabbixbackup_last_run_timestamp_seconds", "End of the run.", [({}, int(time.time()))]),
+    ]
+
+
+def write_metrics(args, status):
+    """Write the metrics file (if requested) atomically."""
+    path = args.scope.get("metrics")
+    if path is None:
+        return
+
+    # the running phase on failure
+    args.scope["progress"].stop()
+
+    labels = {
+        "dbms": args.scope["dbms"],
+        "name": args.name if args.name is not None else args.host,
+    }
+    text = format_metrics(collect_metrics(args, status), labels)
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.write(text)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error("Cannot write metrics file %s: %s", path, e)
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
@@ -1,12 +1,12 @@
 """
 Create a parser for zabbixbackup first level CLI
-and for the subparsers (PostgreSQL and MySQL).
+and for the subparsers (PostgreSQL, MySQL, restore and catalog).
 """
 import argparse
 from pathlib import Path
 
-from .parser_defaults import PSqlArgs, MySqlArgs
-from .parser_post import postprocess
+from .parser_defaults import PSqlArgs, MySqlArgs, RestoreArgs, CatalogArgs
+from .parser_post import postprocess, postprocess_restore, postprocess_catalog
 
 
 _DESCRIPTION = "zabbix dump for {dbms} inspired and directly translated from..."
@@ -34,6 +34,12 @@ def parse(argv):
     main_args, subargv = main_parser(argv)
     dbms = main_args.dbms
 
+    if dbms == "restore":
+        return parse_restore(subargv)
+
+    if dbms == "catalog":
+        return parse_catalog(subargv)
+
     if dbms in ("psql", "pgsql"):
         args = PSqlArgs()
         args.scope["dbms"] = "psql"
@@ -43,6 +49,8 @@ def parse(argv):
     else:
         raise NotImplementedError(f"DBMS {dbms} not supported")
 
+    args.scope["action"] = "backup"
+
     sub_parser = build_sub_parser(args)
     args.scope["parser"] = sub_parser
 
@@ -85,6 +93,14 @@ def build_parser():
         'mysql',
         help="(see zabbixbackup mysql --help)")
 
+    subparsers.add_parser(
+        'restore',
+        help="restore a backup (see zabbixbackup restore --help)")
+
+    subparsers.add_parser(
+        'catalog',
+        help="list and verify the backups (see zabbixbackup catalog --help)")
+
     def _parser(argv):
         subargv = argv[0:1]
 
@@ -236,11 +252,29 @@ def build_sub_parser(args):
 
     dump.add_argument(
         "-M", "--monitoring-action",
-        help="action for monitoring table",
+        help="action for monitoring table. 'incremental' exports history, trends, "
+            "events, alerts, acknowledges and auditlog rows newer than the previous "
+            "backup (other monitoring tables are dumped).",
         default=args.monitoring,
-        choices=("dump", "nodata"),
+        choices=("dump", "nodata", "incremental"),
         dest="monitoring")
 
+    dump.add_argument(
+        "--watermark-lag",
+        help="incremental exports stop this many seconds before the backup time, "
+            "rows written late with an older clock are exported by the next backup.",
+        default=args.watermark_lag,
+        type=int,
+        dest="watermark_lag")
+
+    dump.add_argument(
+        "--skip-unchanged",
+        help="don't dump the data of config tables unchanged since the previous "
+            "backup (server side checksums), refer to the backup holding it.",
+        default=args.skip_unchanged,
+        action="store_true",
+        dest="skip_unchanged")
+
     dump.add_argument(
         "-N", "--add-columns",
         help="add column names in INSERT clauses and quote them as needed.",
@@ -248,6 +282,34 @@ def build_sub_parser(args):
         action="store_true",
         dest="columns")
 
+    if dbms == "mysql":
+        dump.add_argument(
+            "--insert-size",
+            help="maximum size of a multi-row INSERT statement (K and M suffixes "
+                "allowed, between 4K and 16M). '-' to write one row per INSERT.",
+            default=args.insert_size)
+
+    _jobs_help = (
+        "number of parallel dump workers or 'auto' to pick it from the "
+        "number of cores and the tables sizes.")
+    if dbms == "psql":
+        _jobs_help += " More than one worker requires the 'directory' format."
+    if dbms == "mysql":
+        _jobs_help += " Workers share a consistent snapshot (requires the RELOAD privilege)."
+
+    dump.add_argument(
+        "-j", "--jobs",
+        help=_jobs_help,
+        default=args.jobs)
+
+    dump.add_argument(
+        "--chunk",
+        help="export history and trends tables in 'clock' ranges of this period, "
+            "one file per range, concurrently (see --jobs). "
+            "'-' to dump them as a whole.",
+        default=args.chunk,
+        choices=("-", "hour", "day", "week"))
+
     compression = parser.add_argument_group("dump level compression options")
 
     if dbms == "psql":
@@ -266,7 +328,7 @@ def build_sub_parser(args):
         compression.add_argument(
             "--mysqlcompression",
             help="dump level compression. "
-                "Available formats are xz, gzip and bzip2. Use ':<LEVEL>' to set a compression "
+                "Available formats are xz, gzip, bzip2, zstd and lz4. Use ':<LEVEL>' to set a compression "
                 "level. I.e. --archive xz:6. See documentation for the details.",
             default=args.mysqlcompression)
 
@@ -282,19 +344,55 @@ def build_sub_parser(args):
         "--files",
         help="save folders and other files as listed in this file. "
             "One line per folder or file, non existant will be ignored. "
-            "Directory structure is replicated (copied via 'cp').",
+            "Directory structure, ownership, modes, timestamps, extended attributes "
+            "and links are replicated (as 'cp -a').",
         default=args.files)
 
+    files.add_argument(
+        "--link-files",
+        help="hard link the files unchanged since the previous backup folder "
+            "instead of copying them (implies --save-files, requires --archive -).",
+        default=args.link_files,
+        action="store_true")
+
     output = parser.add_argument_group("output options")
 
     output.add_argument(
         "-a", "--archive",
         help="archive level compression. 'tar' to create a tar archive, "
             "'-' to leave the backup uncompressed as a folder. "
-            "Other available formats are xz, gzip and bzip2. "
+            "Other available formats are xz, gzip, bzip2, zstd and lz4. "
             "Use ':<LEVEL>' to set a compression level. I.e. --archive xz:6",
         default=args.archive)
 
+    _threads_help = "compression threads for the archive"
+    if dbms == "mysql":
+        _threads_help += " and the dump"
+    _threads_help += (
+        ", 'auto' for every core. Uses pigz, pbzip2 and multi-threaded xz when "
+        "available, the single-threaded tools otherwise.")
+
+    output.add_argument(
+        "--threads",
+        help=_threads_help,
+        default=args.threads)
+
+    output.add_argument(
+        "--stream",
+        help="write dumps straight into the archive, without staging them "
+            "on disk (requires --archive).",
+        default=args.stream,
+        action="store_true")
+
+    output.add_argument(
+        "--repository",
+        help="store the backup deduplicated in a content-addressed chunk store "
+            "shared by the backups in 'outdir' ('chunkstore'), the backup itself "
+            "is a manifest. Chunks are compressed as per --archive "
+            "(xz, gzip or bzip2, uncompressed otherwise).",
+        default=args.repository,
+        action="store_true")
+
     output.add_argument(
         "-o", "--outdir",
         help="save database dump to 'outdir'.",
@@ -308,12 +406,288 @@ def build_sub_parser(args):
         default=args.rotate,
         type=int)
 
+    for period, unit in (("daily", "day"), ("weekly", "week"), ("monthly", "month"),
+                         ("yearly", "year")):
+        output.add_argument(
+            f"--keep-{period}",
+            help=f"rotate backups keeping the last backup of each of the last "
+                f"'KEEP_{period.upper()}' {unit}s as well (see --rotate).",
+            default=getattr(args, f"keep_{period}"),
+            type=int)
+
+    output.add_argument(
+        "--background-delete",
+        help="move rotated backups to the trash of the output directory and delete "
+            "them in a detached process.",
+        default=args.background_delete,
+        action="store_true")
+
+    output.add_argument(
+        "--delete-rate",
+        help="files deleted per second at most by the background deletion, "
+            "0 for no limit.",
+        default=args.delete_rate,
+        type=int)
+
+    output.add_argument(
+        "--metrics",
+        help="write phase durations, sizes and tables counts of the run to "
+            "METRICS in Prometheus text format (node_exporter textfile collector).",
+        default=args.metrics,
+        type=Path)
+
     verbosity = parser.add_argument_group("verbosity")
     verbosity_group = verbosity.add_mutually_exclusive_group()
     # In case it is needed to change the default value for this group,
     # 'postprocess' must be modified accordingly (else clause is the default
     # during verbosity handling)
     # TODO: choose what to print and in which form
+    verbosity_group.add_argument(
+        "-q", "--quiet",
+        help="don't print anything except unrecoverable errors.",
+        action="store_true",
+        default=args.quiet)
+
+    verbosity_group.add_argument(
+        "-v", "--verbose",
+        help="print informations.",
+        action="store_true",
+        default=args.verbose)
+
+    verbosity_group.add_argument(
+        "-V", "--very-verbose",
+        help="print even more informations.",
+        action="store_true",
+        default=args.very_verbose)
+
+    verbosity_group.add_argument(
+        "--debug",
+        help="print everything.",
+        action="store_true",
+        default=args.debug)
+
+    verbosity.add_argument(
+        "--progress",
+        help="report dump and archive progress (throughput, elapsed time and ETA) "
+            "every PROGRESS seconds, 0 to disable (console output unless quiet).",
+        default=args.progress,
+        type=int)
+
+    verbosity.add_argument(
+        "--timings",
+        help="print wall time, CPU time and peak memory of every phase at the end "
+            "(saved in the backup as 'timings.json').",
+        default=args.timings,
+        action="store_true")
+
+    return parser
+
+
+def parse_restore(argv):
+    """
+    Restore CLI parser.
+
+    There are no configuration files involved: a single 'parse_args' is
+    enough (see @parse), values left to None are taken from the defaults.
+    """
+    args = RestoreArgs()
+    args.scope["action"] = "restore"
+
+    parser = build_restore_parser(args)
+    args.scope["parser"] = parser
+
+    user_args = parser.parse_args(argv)
+
+    return postprocess_restore(args, user_args)
+
+
+def build_restore_parser(args):
+    """
+    Create the parser for the restore of a backup.
+    """
+    parser = argparse.ArgumentParser(
+        "zabbixbackup restore",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="restore a zabbixbackup backup (archive or folder) into an "
+            "existing, empty, database. The DBMS is read from the backup.")
+
+    parser.add_argument(
+        "archive",
+        help="backup archive (tar, compressed or not), repository manifest "
+            "or backup folder.",
+        type=Path)
+
+    parser.add_argument(
+        "-c", "--read-mysql-config",
+        help="(MySQL) read database host and credentials from MySQL config file. "
+            "Implicit if `--mysql-config` is set.",
+        action="store_true",
+        default=args.read_mysql_config)
+
+    parser.add_argument(
+        "-C", "--mysql-config",
+        help="(MySQL) MySQL config file path. "
+            "Implicit if `--read-mysql-config` is set.",
+        default=None,
+        type=Path)
+
+    parser.add_argument(
+        "-D", "--dry-run",
+        help="Do not restore, only show restore commands. "
+            "Be aware that the backup will be unpacked and prepared.",
+        default=args.dry_run,
+        action="store_true")
+
+    connection = parser.add_argument_group("connection options")
+
+    connection.add_argument(
+        "-H", "--host",
+        help="hostname/IP of DBMS server, to specify a blank value pass '-'.",
+        default=args.host)
+
+    connection.add_argument(
+        "-P", "--port",
+        help="DBMS port, 5432 or 3306 (by the DBMS of the backup) if not set.",
+        default=args.port,
+        type=int)
+
+    connection.add_argument(
+        "-S", "--socket",
+        help="(MySQL) path to DBMS socket file. "
+            "Alternative to specifying host.",
+        dest="sock",
+        default=args.sock)
+
+    connection.add_argument(
+        "-u", "--username",
+        help="database login user.",
+        default=args.user,
+        dest="user")
+
+    connection.add_argument(
+        "-p", "--passwd",
+        help="database login password (specify '-' for an interactive prompt).",
+        default=args.passwd)
+
+    connection.add_argument(
+        "--login-file",
+        help="use this '.pgpass' or 'mylogin.cnf' file for the authentication.",
+        default=args.loginfile,
+        dest="loginfile")
+
+    connection.add_argument(
+        "-d", "--database",
+        help="database name.",
+        default=args.dbname,
+        dest="dbname")
+
+    connection.add_argument(
+        "-s", "--schema",
+        help="(Postgres) database schema.",
+        default=args.schema)
+
+    restore = parser.add_argument_group("restore options")
+
+    restore.add_argument(
+        "-j", "--jobs",
+        help="number of parallel restore workers or 'auto' for every core.",
+        default=args.jobs)
+
+    restore.add_argument(
+        "--workdir",
+        help="unpack the archive and prepare the dumps in a temporary "
+            "directory in WORKDIR, next to the archive if not set.",
+        default=args.workdir,
+        type=Path)
+
+    restore.add_argument(
+        "--keep",
+        help="do not delete the unpacked and prepared files on exit.",
+        default=args.keep,
+        action="store_true")
+
+    verbosity = parser.add_argument_group("verbosity")
+    verbosity_group = verbosity.add_mutually_exclusive_group()
+
+    verbosity_group.add_argument(
+        "-q", "--quiet",
+        help="don't print anything except unrecoverable errors.",
+        action="store_true",
+        default=args.quiet)
+
+    verbosity_group.add_argument(
+        "-v", "--verbose",
+        help="print informations.",
+        action="store_true",
+        default=args.verbose)
+
+    verbosity_group.add_argument(
+        "-V", "--very-verbose",
+        help="print even more informations.",
+        action="store_true",
+        default=args.very_verbose)
+
+    verbosity_group.add_argument(
+        "--debug",
+        help="print everything.",
+        action="store_true",
+        default=args.debug)
+
+    return parser
+
+
+def parse_catalog(argv):
+    """
+    Catalog CLI parser (a single 'parse_args', see @parse_restore).
+    """
+    args = CatalogArgs()
+    args.scope["action"] = "catalog"
+
+    parser = build_catalog_parser(args)
+    args.scope["parser"] = parser
+
+    user_args = parser.parse_args(argv)
+
+    return postprocess_catalog(args, user_args)
+
+
+def build_catalog_parser(args):
+    """
+    Create the parser for the backups catalog.
+    """
+    parser = argparse.ArgumentParser(
+        "zabbixbackup catalog",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="list the backups of an output directory from its catalog "
+            "(zabbix_catalog.jsonl) and verify them.")
+
+    parser.add_argument(
+        "-o", "--outdir",
+        help="output directory of the backups.",
+        default=args.outdir,
+        type=Path)
+
+    parser.add_argument(
+        "--name",
+        help="list only the backups of this host or name.",
+        default=args.name)
+
+    parser.add_argument(
+        "--verify",
+        help="check that every backup exists and matches its size and checksum "
+             "(backup folders: their artifacts manifest).",
+        default=args.verify,
+        action="store_true")
+
+    parser.add_argument(
+        "--rebuild",
+        help="rebuild the catalog from the backups names (details are lost).",
+        default=args.rebuild,
+        action="store_true")
+
+    verbosity = parser.add_argument_group("verbosity")
+    verbosity_group = verbosity.add_mutually_exclusive_group()
+
     verbosity_group.add_argument(
         "-q", "--quiet",
         help="don't print anything except unrecoverable errors.",
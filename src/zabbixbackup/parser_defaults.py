@@ -32,19 +32,36 @@ class PSqlArgs:
 
     save_files: bool            = False
     files: Path                 = "-"
+    link_files: bool            = False
 
     unknown: str                = "ignore"
     monitoring: str             = "nodata"
+    skip_unchanged: bool        = False
+    watermark_lag: int          = 300
     columns: bool               = False
     pgformat: str               = "custom"
     pgcompression: str          = None
+    jobs: str                   = "1"
+    chunk: str                  = "-"
     outdir: Path                = Path(".")
+    stream: bool                = False
+    repository: bool            = False
+    threads: str                = "auto"
     rotate: int                 = 0
+    keep_daily: int             = 0
+    keep_weekly: int            = 0
+    keep_monthly: int           = 0
+    keep_yearly: int            = 0
+    background_delete: bool     = False
+    delete_rate: int            = 1000
+    metrics: Optional[Path]     = None
 
     quiet: bool                 = False
     verbose: bool               = True
     very_verbose: bool          = False
     debug: bool                 = False
+    progress: int               = 0
+    timings: bool               = False
 
     verbosity: str              = None # automatically set during parser post process
     archive: str                = "-"
@@ -54,11 +71,13 @@ PSqlArgs._keys = [
     "read_zabbix_config", "zabbix_config",
     "host", "port", "user", "passwd", "keeploginfile", "loginfile",
     "dbname", "schema", "rlookup", "name",
-    "save_files", "files",
-    "unknown", "monitoring",
-    "columns", "pgformat", "pgcompression",
-    "rotate", "outdir", "archive",
-    "dry_run", "verbosity",
+    "save_files", "files", "link_files",
+    "unknown", "monitoring", "watermark_lag", "skip_unchanged",
+    "columns", "pgformat", "pgcompression", "jobs", "chunk",
+    "rotate", "keep_daily", "keep_weekly", "keep_monthly", "keep_yearly",
+    "background_delete", "delete_rate",
+    "outdir", "archive", "stream", "repository", "threads", "metrics",
+    "dry_run", "verbosity", "progress", "timings",
 ]
 
 
@@ -84,18 +103,36 @@ class MySqlArgs:
 
     save_files: bool            = False
     files: Path                 = "-"
+    link_files: bool            = False
 
     unknown: str                = "ignore"
     monitoring: str             = "nodata"
+    skip_unchanged: bool        = False
+    watermark_lag: int          = 300
     columns: bool               = False
     mysqlcompression: str       = "gzip:6"
+    insert_size: str            = "1M"
+    jobs: str                   = "1"
+    chunk: str                  = "-"
     outdir: Path                = Path(".")
+    stream: bool                = False
+    repository: bool            = False
+    threads: str                = "auto"
     rotate: int                 = 0
+    keep_daily: int             = 0
+    keep_weekly: int            = 0
+    keep_monthly: int           = 0
+    keep_yearly: int            = 0
+    background_delete: bool     = False
+    delete_rate: int            = 1000
+    metrics: Optional[Path]     = None
 
     quiet: bool                 = False
     verbose: bool               = True
     very_verbose: bool          = False
     debug: bool                 = False
+    progress: int               = 0
+    timings: bool               = False
 
     verbosity: str              = None # automatically set during parser post process
     archive: str                = "-"
@@ -105,9 +142,71 @@ MySqlArgs._keys = [
     "read_zabbix_config", "zabbix_config", "read_mysql_config", "mysql_config",
     "host", "port", "sock", "user", "passwd", "keeploginfile", "loginfile",
     "dbname", "rlookup", "name",
-    "save_files", "files",
-    "unknown", "monitoring",
-    "columns", "mysqlcompression",
-    "rotate", "outdir", "archive",
+    "save_files", "files", "link_files",
+    "unknown", "monitoring", "watermark_lag", "skip_unchanged",
+    "columns", "insert_size", "mysqlcompression", "jobs", "chunk",
+    "rotate", "keep_daily", "keep_weekly", "keep_monthly", "keep_yearly",
+    "background_delete", "delete_rate",
+    "outdir", "archive", "stream", "repository", "threads", "metrics",
+    "dry_run", "verbosity", "progress", "timings",
+]
+
+
+@dataclass
+class RestoreArgs:
+    """Zabbixbackup restore defaults configuration."""
+    archive: Path               = None
+    read_mysql_config: bool     = False
+    mysql_config: Path          = "/etc/mysql/my.cnf"
+
+    dry_run: bool               = False
+    host: str                   = "127.0.0.1"
+    port: int                   = None # 5432 or 3306, by DBMS of the backup
+    sock: Optional[Path]        = None
+    user: str                   = "zabbix"
+    passwd: str                 = None
+    keeploginfile: bool         = False
+    loginfile: Optional[Path]   = None
+    dbname: str                 = "zabbix"
+    schema: str                 = "public"
+
+    jobs: str                   = "auto"
+    workdir: Optional[Path]     = None
+    keep: bool                  = False
+
+    quiet: bool                 = False
+    verbose: bool               = True
+    very_verbose: bool          = False
+    debug: bool                 = False
+
+    verbosity: str              = None # automatically set during parser post process
+    scope: dict                 = field(default_factory=dict)
+
+RestoreArgs._keys = [
+    "archive", "read_mysql_config", "mysql_config",
+    "host", "port", "sock", "user", "passwd", "loginfile", "dbname", "schema",
+    "jobs", "workdir", "keep",
     "dry_run", "verbosity",
 ]
+
+
+@dataclass
+class CatalogArgs:
+    """Zabbixbackup catalog defaults configuration."""
+    outdir: Path                = Path(".")
+    name: Optional[str]         = None
+    verify: bool                = False
+    rebuild: bool               = False
+
+    quiet: bool                 = False
+    verbose: bool               = True
+    very_verbose: bool          = False
+    debug: bool                 = False
+
+    verbosity: str              = None # automatically set during parser post process
+    scope: dict                 = field(default_factory=dict)
+
+CatalogArgs._keys = [
+    "outdir", "name", "verify", "rebuild",
+    "verbosity",
+]
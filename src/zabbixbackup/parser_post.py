@@ -4,14 +4,20 @@ from pathlib import Path
 import logging
 from getpass import getpass
 from typing import Union
+import os
 import re
-from .parser_defaults import PSqlArgs, MySqlArgs
+from .parser_defaults import PSqlArgs, MySqlArgs, RestoreArgs, CatalogArgs
+from .utils import build_compress_command
+from .chunks import PERIODS
+from .compress import BLOCK_SIZES
+from .repository import COMPRESSIONS as REPOSITORY_COMPRESSIONS
+from .progress import Progress, logger as progress_logger
 from . import console_logger
 
 logger = logging.getLogger()
 
 
-__all__ = ["postprocess"]
+__all__ = ["postprocess", "postprocess_restore", "postprocess_catalog"]
 
 
 # pylint: disable-next=too-many-branches
@@ -64,6 +70,10 @@ def postprocess(args: Union[PSqlArgs, MySqlArgs], user_args):
         user_args.save_files = True
         user_args.files = Path(user_args.files)
 
+    # Implicit save_files if saved files are linked
+    if user_args.link_files:
+        user_args.save_files = True
+
 
     for key, value in vars(user_args).items():
         if value is not None:
@@ -75,11 +85,28 @@ def postprocess(args: Union[PSqlArgs, MySqlArgs], user_args):
     if args.rotate < 0:
         raise parser.error(f"Rotate must be 0 or positive: {args.rotate!r}")
 
+    for period in ("daily", "weekly", "monthly", "yearly"):
+        count = getattr(args, f"keep_{period}")
+        if count < 0:
+            raise parser.error(f"Keep {period} must be 0 or positive: {count!r}")
+
+    if args.delete_rate < 0:
+        raise parser.error(f"Delete rate must be 0 or positive: {args.delete_rate!r}")
+
+    if args.watermark_lag < 0:
+        raise parser.error(f"Watermark lag must be 0 or positive: {args.watermark_lag!r}")
+
     # Collapse verbosity to a single variable ('verbosity')
     _handle_verbosity(args)
+    _handle_progress(args)
 
     if dbms == "mysql":
         _handle_mysqlcompression(args)
+        _handle_insert_size(args)
+
+    _handle_jobs(args, user_args)
+    _handle_chunk(args)
+    _handle_skip_unchanged(args)
 
     # Check if name is valid
     if args.name is not None:
@@ -93,10 +120,57 @@ def postprocess(args: Union[PSqlArgs, MySqlArgs], user_args):
 
     # Handle archiving and compression, set archive type and compression level
     _handle_archiving(args)
+    _handle_threads(args)
+    _handle_stream(args, user_args)
+    _handle_compressors(args)
+    _handle_repository(args, user_args)
+    _handle_link_files(args)
 
     # Checks whether the output directory is a directory or
     # that it can be created (parent exists and is a directory)
     _handle_output(args)
+    _handle_metrics(args)
+
+    # Prompt for password if necessary (do it last to fail early on other arguments)
+    if args.loginfile is None and args.passwd == "-":
+        print("(echo disabled for password input)", file=sys.stderr)
+        args.passwd = getpass("password: ")
+
+    return args
+
+
+def postprocess_restore(args: RestoreArgs, user_args):
+    """
+    Adjust the restore arguments according to user selection.
+
+    Port and DBMS specific values are checked when the backup is read
+    (see `restore.py`).
+    """
+    parser = args.scope["parser"]
+
+    if user_args.host == "-":
+        user_args.host = ""
+
+    # pylint: disable=C0325:superfluous-parens
+    if user_args.port is not None and not (1 <= user_args.port <= 65535):
+        raise parser.error(f"Port must be between 1 and 65535: {user_args.port!r}")
+
+    # Implicit read from mysql config if a file is provided
+    if user_args.mysql_config:
+        user_args.read_mysql_config = True
+
+    for key, value in vars(user_args).items():
+        if value is not None:
+            setattr(args, key, value)
+
+    _handle_verbosity(args)
+    _handle_restore_jobs(args)
+
+    if not args.archive.exists():
+        raise parser.error(f"Backup not found: {str(args.archive)!r}")
+
+    if args.workdir is not None and not args.workdir.is_dir():
+        raise parser.error(f"Work directory: not a directory {str(args.workdir)!r}")
 
     # Prompt for password if necessary (do it last to fail early on other arguments)
     if args.loginfile is None and args.passwd == "-":
@@ -106,14 +180,53 @@ def postprocess(args: Union[PSqlArgs, MySqlArgs], user_args):
     return args
 
 
+def postprocess_catalog(args: CatalogArgs, user_args):
+    """Adjust the catalog arguments according to user selection."""
+    parser = args.scope["parser"]
+
+    for key, value in vars(user_args).items():
+        if value is not None:
+            setattr(args, key, value)
+
+    _handle_verbosity(args)
+
+    if not args.outdir.is_dir():
+        raise parser.error(f"Output directory: not a directory {str(args.outdir)!r}")
+
+    return args
+
+
+def _handle_restore_jobs(args):
+    """Handle parallel restore parameters."""
+    parser = args.scope["parser"]
+    jobs = str(args.jobs)
+
+    if jobs == "auto":
+        args.scope["jobs"] = os.cpu_count() or 1
+    elif jobs.isdecimal() and int(jobs) > 0:
+        args.scope["jobs"] = int(jobs)
+    else:
+        raise parser.error(f"Invalid number of jobs (positive integer or 'auto'): {jobs!r}")
+
+
+# compression algorithms with their default and maximum levels
+COMPRESSION_LEVELS = {
+    "xz": ("6", 9),
+    "gzip": ("6", 9),
+    "bzip2": ("6", 9),
+    "zstd": ("3", 19),
+    "lz4": ("1", 12),
+}
+
+
 def _parse_compression(parser, compr):
     """Parse compression parameters."""
-    # either a number (level), an algo (with default level 6)
+    # either a number (level), an algo (with its default level)
     # or a combination of algo and number
 
-    if compr in ("xz", "gzip", "bzip2"):
+    if compr in COMPRESSION_LEVELS:
         algo = compr
-        level = "6"
+        level = COMPRESSION_LEVELS[algo][0]
     elif ":" in compr:
         algo, level = compr.split(":")
     else: # assume level format (checked below)
@@ -127,13 +240,18 @@ def _parse_compression(parser, compr):
         level = level[:-1]
         extra += ("--extreme", )
 
+    # long distance matching for zstd
+    if algo == "zstd" and level.endswith("l"):
+        level = level[:-1]
+        extra += ("--long", )
+
     # check algorithm and level
-    if algo not in ("xz", "gzip", "bzip2"):
+    if algo not in COMPRESSION_LEVELS:
         raise parser.error(f"Invalid compression algorithm: {compr!r}")
 
     if (not level.isdecimal() or
-        len(level) != 1 or          # level is not a single decimal
-        level == "0"                # 0 not allowed (only supported by xz)
+        level.startswith("0") or    # 0 not allowed (only supported by xz)
+        int(level) > COMPRESSION_LEVELS[algo][1]
     ):
         raise parser.error(f"Invalid/unsupported compression level: {compr!r}")
 
@@ -152,6 +270,117 @@ def _handle_mysqlcompression(args):
     args.scope["mysqlcompression"] = profile
 
 
+def _parse_size(parser, size):
+    """Parse a size in bytes with an optional K or M (binary) suffix."""
+    multipliers = {"K": 1024, "M": 1024 * 1024}
+
+    value, multiplier = size, 1
+    if size[-1:].upper() in multipliers:
+        value, multiplier = size[:-1], multipliers[size[-1:].upper()]
+
+    if not value.isdecimal():
+        raise parser.error(f"Invalid size: {size!r}")
+
+    return int(value) * multiplier
+
+
+def _handle_insert_size(args):
+    """Handle mysql INSERT statements size."""
+    parser = args.scope["parser"]
+
+    # One row per INSERT statement
+    if args.insert_size == "-":
+        args.scope["insert_size"] = None
+        return
+
+    # mysqldump limits for --net-buffer-length
+    size = _parse_size(parser, args.insert_size)
+    if not 4096 <= size <= 16 * 1024 * 1024:
+        raise parser.error(f"Insert size must be between 4K and 16M: {args.insert_size!r}")
+
+    args.scope["insert_size"] = size
+
+
+def _handle_jobs(args, user_args):
+    """Handle parallel dump parameters."""
+    parser = args.scope["parser"]
+    jobs = str(args.jobs)
+
+    # None stands for 'auto', the actual value is chosen just before the dump
+    if jobs == "auto":
+        args.scope["jobs"] = None
+    elif jobs.isdecimal() and int(jobs) > 0:
+        args.scope["jobs"] = int(jobs)
+    else:
+        raise parser.error(f"Invalid number of jobs (positive integer or 'auto'): {jobs!r}")
+
+    if args.scope["dbms"] != "psql":
+        return
+
+    if args.scope["jobs"] == 1 or args.pgformat == "directory":
+        return
+
+    # Parallel dumps are only supported by pg_dump for the directory format
+    if user_args.pgformat is not None:
+        raise parser.error(
+            f"Parallel dump requires 'directory' format: {args.pgformat!r}")
+
+    logger.info("Parallel dump: switching dump format to 'directory'")
+    args.pgformat = "directory"
+
+
+def _handle_threads(args):
+    """Handle compression threads."""
+    parser = args.scope["parser"]
+    threads = str(args.threads)
+
+    # None stands for every available core
+    if threads == "auto":
+        args.scope["threads"] = None
+    elif threads.isdecimal() and int(threads) > 0:
+        args.scope["threads"] = int(threads)
+    else:
+        raise parser.error(f"Invalid number of threads (positive integer or 'auto'): {threads!r}")
+
+
+def _handle_chunk(args):
+    """Handle history and trends time ranges export."""
+    if args.chunk == "-":
+        args.scope["chunk"] = None
+        return
+
+    if args.monitoring == "nodata":
+        logger.warning("Ignoring chunk (monitoring tables data is not dumped)")
+
+    args.scope["chunk"] = PERIODS[args.chunk]
+
+
+def _handle_skip_unchanged(args):
+    """Handle unchanged config tables (see `unchanged.py`)."""
+    parser = args.scope["parser"]
+
+    if not args.skip_unchanged:
+        return
+
+    # referenced tables are restored from their backup by name
+    if args.scope["dbms"] == "psql" and args.pgformat == "plain":
+        raise parser.error(
+            "Skipping unchanged tables is not available with 'plain' format")
+
+
+def _handle_link_files(args):
+    """Handle linking unchanged saved files (see `copier.py`)."""
+    parser = args.scope["parser"]
+
+    if not args.link_files:
+        return
+
+    # files are linked from the previous backup folder
+    if args.scope["archive"] is not None or args.repository:
+        raise parser.error(
+            "Linking saved files requires backup folders (--archive -, no --repository)")
+
+
 def _handle_archiving(args):
     """Handle archiving parameters."""
     parser = args.scope["parser"]
@@ -169,6 +398,91 @@ def _handle_archiving(args):
     args.scope["archive"] = profile
 
 
+def _handle_stream(args, user_args):
+    """Handle streaming into the archive."""
+    parser = args.scope["parser"]
+    dbms = args.scope["dbms"]
+
+    if not args.stream:
+        return
+
+    if args.scope["archive"] is None:
+        raise parser.error("Streaming requires an archive (see --archive)")
+
+    if dbms == "psql" and args.pgformat == "directory":
+        raise parser.error(
+            "Streaming is not available with 'directory' format (implied by --jobs)")
+
+    # compressed while the dumps are written: zstd and lz4 need their binary
+    _check_compressor(parser, args.scope["archive"], args.scope["threads"], "--stream")
+
+    # Don't compress twice unless explicitly requested
+    if (dbms == "mysql" and args.scope["archive"][0] != "tar"
+        and user_args.mysqlcompression is None
+    ):
+        args.scope["mysqlcompression"] = None
+
+
+def _check_compressor(parser, profile, threads, option):
+    """Fail if 'profile' has neither a compression binary nor an in-process fallback."""
+    if profile is None or profile[0] == "tar" or profile[0] in BLOCK_SIZES:
+        return
+
+    try:
+        build_compress_command(profile, strategy=("parallel", "standard"), threads=threads)
+    except NotImplementedError:
+        raise parser.error(
+            f"Compression binary not available for {option}: {profile[0]!r} "
+            "(in-process compression supports gzip, bzip2 and xz only)") from None
+
+
+def _handle_compressors(args):
+    """Check that the selected compressions can run (zstd and lz4 need their binary)."""
+    parser = args.scope["parser"]
+    dbms = args.scope["dbms"]
+    threads = args.scope["threads"]
+
+    # streamed archives are checked by _handle_stream
+    if not args.stream:
+        _check_compressor(parser, args.scope["archive"], threads, "--archive")
+
+    if dbms == "mysql":
+        _check_compressor(
+            parser, args.scope["mysqlcompression"], threads, "--mysqlcompression")
+
+
+def _handle_repository(args, user_args):
+    """Handle the deduplicated chunk store (see `repository.py`)."""
+    parser = args.scope["parser"]
+    dbms = args.scope["dbms"]
+
+    if not args.repository:
+        args.scope["repository"] = None
+        return
+
+    if args.stream:
+        raise parser.error("Streaming is not available with a repository")
+
+    # chunks are compressed in-process
+    profile = args.scope["archive"]
+    if profile is not None and profile[0] == "tar":
+        profile = None
+    if profile is not None and profile[0] not in REPOSITORY_COMPRESSIONS:
+        raise parser.error(
+            f"Repository compression must be xz, gzip or bzip2: {args.archive!r}")
+
+    args.scope["repository"] = profile
+
+    # compressed dumps don't deduplicate, unless explicitly requested
+    if dbms == "mysql" and user_args.mysqlcompression is None:
+        args.scope["mysqlcompression"] = None
+
+    if (dbms == "psql" and user_args.pgcompression is None
+        and args.pgformat in ("custom", "directory")
+    ):
+        args.pgcompression = "0"
+
+
 def _handle_verbosity(args):
     """Handle verbosity level."""
     if args.quiet:
@@ -185,6 +499,22 @@ def _handle_verbosity(args):
         console_logger.setLevel(logging.WARNING)
 
 
+def _handle_progress(args):
+    """Handle progress reports (see `progress.py`)."""
+    parser = args.scope["parser"]
+
+    if args.progress < 0:
+        raise parser.error(f"Progress interval must be 0 or positive: {args.progress!r}")
+
+    # reports are info messages: on the console unless quiet, once enabled
+    if args.progress > 0 and args.verbosity in ("normal", ) and not progress_logger.handlers:
+        progress_handler = logging.StreamHandler()
+        progress_handler.setLevel(logging.INFO)
+        progress_logger.addHandler(progress_handler)
+
+    args.scope["progress"] = Progress(args.progress)
+
+
 def _handle_output(args):
     """Checks whether the output directory is useable."""
     parser = args.scope["parser"]
@@ -195,6 +525,25 @@ def _handle_output(args):
         raise parser.error(f"Output directory: cannot create or use {args.outdir!r}")
 
 
+def _handle_metrics(args):
+    """Check the metrics file can be written (see `metrics.py`)."""
+    parser = args.scope["parser"]
+
+    if args.metrics is None:
+        args.scope["metrics"] = None
+        return
+
+    # the backup runs from other directories
+    path = args.metrics.absolute()
+    if path.is_dir() or not path.parent.is_dir():
+        raise parser.error(f"Metrics file: cannot create or use {args.metrics!r}")
+
+    if path.suffix != ".prom":
+        logger.warning("Metrics file: the textfile collector only reads '*.prom' files")
+
+    args.scope["metrics"] = path
+
+
 def _handle_zabbix_conf(args, user_args):
     """Handle zabbix configuration file."""
     # args is a mix of user provided arguments and defaults
@@ -0,0 +1,302 @@
+"""
+Periodic progress report of the running phase (dumps, chunks and archive).
+
+Bytes are metered from the processes doing the work: written bytes of the
+dump processes and read bytes of tar (see `/proc/<pid>/io`, Linux only),
+and from the size on disk of the backup directory. Given the expected
+amount of data (pre-scanned tables sizes) an ETA is reported as well.
+
+Reports go through the 'zabbixbackup.progress' logger: they are in
+'dump.log' and, once enabled by --progress and unless --quiet, on the
+console.
+
+Every phase is timed: wall time, CPU time of zabbixbackup itself (i.e.
+in-process compression) and of its child processes, and the peak RSS of
+the child processes (see `getrusage(2)`).
+"""
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+from pathlib import Path
+
+logger = logging.getLogger("zabbixbackup.progress")
+
+TIMINGS = "timings.json"
+
+
+def _proc_io(pid, key):
+    """Return the 'key' counter of `/proc/<pid>/io` or None if not available."""
+    try:
+        with open(f"/proc/{pid}/io", "r", encoding="ascii") as fh:
+            for line in fh:
+                name, _, value = line.partition(":")
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def disk_usage(path):
+    """Total size of the files in 'path' (recursively)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+
+    return total
+
+
+def human_size(size):
+    """Format a size in bytes, i.e. '1.2 GiB'."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TiB"
+
+
+def _rusage():
+    """CPU time (seconds) and peak RSS (bytes) of this process and of its waited children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # kilobytes on Linux, bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (
+        own.ru_utime + own.ru_stime,
+        children.ru_utime + children.ru_stime,
+        children.ru_maxrss * unit,
+    )
+
+
+def human_time(seconds):
+    """Format a duration, i.e. '1:02:03'."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class Progress:
+    """
+    Report the progress of the running phase every 'interval' seconds
+    (0 disables periodic reports, phases are still timed).
+
+    Use `start` to begin a phase, `track` to meter its processes and
+    `stop` to end it.
+    """
+    def __init__(self, interval, path="."):
+        self.interval = interval
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.timings = {}
+        self.rusage = (0, 0, 0)
+
+        self.phase = None
+        self.phase_path = self.path
+        self.metered = True
+        self.total = None
+        self.started = None
+        self.procs = {}
+        self.disk = 0
+        self.last = (0, 0)
+
+
+    def start(self, phase, total=None, metered=True, path=None):
+        """
+        Start metering 'phase', 'total' is the expected amount of bytes if known.
+
+        Unless 'metered', only the size on disk is reported (i.e. for many
+        short lived processes). The size on disk is the one of 'path',
+        'self.path' (the backup directory) by default.
+        """
+        with self.lock:
+            self.phase = phase
+            self.phase_path = self.path if path is None else Path(path)
+            self.metered = metered
+            self.total = total or None
+            self.started = time.monotonic()
+            self.rusage = _rusage()
+            self.procs = {}
+            self.disk = disk_usage(self.phase_path)
+            self.last = (self.started, 0)
+
+        if self.interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+
+    def track(self, proc, key="wchar"):
+        """Meter the 'key' counter (see `/proc/<pid>/io`) of 'proc'."""
+        with self.lock:
+            if self.metered:
+                self.procs[proc.pid] = [key, 0]
+
+
+    def _metered(self):
+        """Bytes metered from processes (None if not available) and on disk."""
+        metered = None
+        for pid, entry in self.procs.items():
+            value = _proc_io(pid, entry[0])
+            if value is not None:
+                entry[1] = value
+            if entry[1] or value is not None:
+                metered = (metered or 0) + entry[1]
+
+        return metered, max(disk_usage(self.phase_path) - self.disk, 0)
+
+
+    def report(self):
+        """Log the progress of the current phase."""
+        with self.lock:
+            if self.phase is None:
+                return
+
+            now = time.monotonic()
+            metered, disk = self._metered()
+            done = disk if metered is None else metered
+
+            elapsed = now - self.started
+            last_time, last_done = self.last
+            rate = (done - last_done) / (now - last_time) if now > last_time else 0
+            self.last = (now, done)
+
+            parts = [f"{human_size(done)} ({human_size(rate)}/s)"]
+            if metered is not None:
+                parts.append(f"{human_size(disk)} on disk")
+            parts.append(f"elapsed {human_time(elapsed)}")
+
+            if self.total is not None and done > 0:
+                average = done / elapsed
+                left = max(self.total - done, 0) / average if average else 0
+                percent = min(100 * done / self.total, 100)
+                parts.append(f"ETA {human_time(left)} ({percent:.0f}%, approx)")
+
+            if rate == 0 and elapsed >= self.interval:
+                parts.append("no progress since last report")
+
+            logger.info("Progress %s: %s", self.phase, ", ".join(parts))
+
+
+    def stop(self):
+        """
+        End the current phase, return its duration in seconds.
+
+        Timings are summed up by phase in 'timings' (see `timings_table`).
+        """
+        with self.lock:
+            if self.phase is None:
+                return 0
+
+            elapsed = time.monotonic() - self.started
+            metered, disk = self._metered()
+            done = disk if metered is None else metered
+
+            if done > 0:
+                logger.info(
+                    "Progress %s: done, %s in %s (%s/s)",
+                    self.phase, human_size(done), human_time(elapsed),
+                    human_size(done / elapsed if elapsed else 0))
+            else:
+                logger.info("Progress %s: done in %s", self.phase, human_time(elapsed))
+
+            self._time_phase(elapsed)
+            self.phase = None
+            return elapsed
+
+
+    def _time_phase(self, elapsed):
+        cpu, children_cpu, children_rss = _rusage()
+        prev_cpu, prev_children_cpu, prev_children_rss = self.rusage
+
+        timing = self.timings.setdefault(self.phase, {
+            "wall": 0, "cpu": 0, "children_cpu": 0, "children_peak_rss": None})
+        timing["wall"] += elapsed
+        timing["cpu"] += cpu - prev_cpu
+        timing["children_cpu"] += children_cpu - prev_children_cpu
+
+        # the peak is over every child so far: known only if it grew in this phase
+        if children_rss > prev_children_rss:
+            timing["children_peak_rss"] = max(timing["children_peak_rss"] or 0, children_rss)
+
+
+    def time_background(self, phase, elapsed):
+        """
+        Time 'phase', run concurrently with the others (see `tasks.py`):
+        the wall time only, CPU times can't be told apart.
+        """
+        with self.lock:
+            timing = self.timings.setdefault(phase, {
+                "wall": 0, "cpu": None, "children_cpu": None, "children_peak_rss": None,
+                "background": True})
+            timing["wall"] += elapsed
+
+
+    def close(self):
+        """End the current phase and the reporting thread."""
+        self.stop()
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+
+def run_duration(timings):
+    """Duration of a run from its phases timings, phases run in background excluded."""
+    return sum(
+        timing["wall"] for timing in timings.values() if not timing.get("background"))
+
+
+def timings_table(timings):
+    """Format phases timings (see `Progress.timings`) as a text table."""
+    def _seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    rows = [("phase", "wall", "cpu", "children cpu", "children peak rss")]
+    for phase, timing in timings.items():
+        rss = timing["children_peak_rss"]
+        rows.append((
+            phase + (" (background)" if timing.get("background") else ""),
+            _seconds(timing["wall"]),
+            _seconds(timing["cpu"]),
+            _seconds(timing["children_cpu"]),
+            "-" if rss is None else human_size(rss),
+        ))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(
+            value.ljust(width) if i == 0 else value.rjust(width)
+            for i, (value, width) in enumerate(zip(row, widths)))
+        for row in rows)
+
+
+def write_timings(path, timings):
+    """Write phases timings (see `Progress.timings`) as JSON to 'path'."""
+    summary = [
+        {
+            "phase": phase,
+            **dict(
+                (key, round(value, 3) if isinstance(value, float) else value)
+                for key, value in timing.items())
+        }
+        for phase, timing in timings.items()
+    ]
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(summary, fh, indent=2)
+        fh.write("\n")
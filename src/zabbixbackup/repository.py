@@ -0,0 +1,415 @@
+"""
+Content-addressed chunk store: deduplicated backups (see --repository).
+
+Every file of the backup is split in chunks with a content defined
+boundary (a rolling hash on line ends: an insertion only changes the
+chunks around it) and every chunk is stored once, by the SHA-256 of its
+content, in the shared store of the output directory:
+
+    OUTDIR/chunkstore/ab/ab12...ef.xz
+
+The backup itself is a small manifest, 'zabbix_<name>_<date>.manifest',
+listing its files and their chunks. Unchanged tables and saved files cost
+nothing after the first backup.
+
+Chunks no manifest refers to are removed by `collect_garbage` (after
+the rotation). Backups hold a shared lock on the store while writing
+chunks and their manifest, the garbage collection an exclusive one.
+"""
+import os
+import bz2
+import gzip
+import json
+import lzma
+import stat
+import time
+import zlib
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import COMPRESS_EXTENSIONS
+from .compress import compress_block_func
+from .progress import disk_usage, human_size
+
+logger = logging.getLogger()
+
+
+STORE = "chunkstore"
+MANIFEST = ".manifest"
+MANIFEST_VERSION = 1
+
+# average chunk size, chunks are between a quarter and eight times as large
+CHUNK_SIZE = 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+
+# algorithms available in-process for the chunks
+COMPRESSIONS = ("gzip", "bzip2", "xz")
+DECOMPRESS = {".gz": gzip.decompress, ".bz2": bz2.decompress, ".xz": lzma.decompress}
+
+
+def _find_boundary(buffer, start, end, average):
+    """
+    Find a chunk boundary in 'buffer' between 'start' and 'end'.
+
+    Boundaries are after a line end: a line of 'length' bytes ends a chunk
+    if its hash modulo 'average' is less than 'length',
+    i.e. with a probability proportional to its size. The boundary depends
+    on the content only, the chunk size is 'average' in the mean.
+    Return None if there's no boundary.
+    """
+    view = memoryview(buffer)
+    prev = buffer.rfind(b"\n", 0, start)
+    index = buffer.find(b"\n", start, end)
+    while index != -1:
+        length = index - prev
+        if zlib.crc32(view[prev + 1:index]) % average < length:
+            return index + 1
+
+        prev = index
+        index = buffer.find(b"\n", index + 1, end)
+
+    return None
+
+
+def split_chunks(fh, average=CHUNK_SIZE, read_size=READ_SIZE):
+    """Split the content of 'fh' (binary file object) in chunks, yield them as bytes."""
+    minimum, maximum = average // 4, average * 8
+    read_size = max(read_size, maximum)
+
+    buffer, pos, eof = b"", 0, False
+    while True:
+        if len(buffer) - pos < maximum and not eof:
+            data = fh.read(read_size)
+            eof = not data
+            buffer = buffer[pos:] + data
+            pos = 0
+
+        if pos >= len(buffer):
+            return
+
+        end = min(pos + maximum, len(buffer))
+        cut = _find_boundary(buffer, pos + minimum, end, average)
+        if cut is None:
+            cut = end
+
+        yield buffer[pos:cut]
+        pos = cut
+
+
+class ChunkStore:
+    """
+    Chunks by the SHA-256 of their content, compressed according to
+    'profile' (see `compress.py`, None for no compression).
+
+    Chunks written with other compressions are found (and reused) as well.
+    """
+    def __init__(self, path, profile=None):
+        self.path = Path(path)
+        self.compress = None
+        self.ext = ""
+        if profile is not None:
+            self.compress = compress_block_func(profile)
+            self.ext = COMPRESS_EXTENSIONS[profile[0]]
+
+
+    def _chunk_path(self, digest, ext):
+        return self.path / digest[:2] / f"{digest}{ext}"
+
+
+    def find(self, digest):
+        """Path of the chunk 'digest', None if not in the store."""
+        for ext in (self.ext, "", *DECOMPRESS):
+            path = self._chunk_path(digest, ext)
+            if path.exists():
+                return path
+
+        return None
+
+
+    def put(self, data):
+        """Store 'data' if not already stored, return its digest and the bytes written."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.find(digest) is not None:
+            return digest, 0
+
+        if self.compress is not None:
+            data = self.compress(data)
+
+        path = self._chunk_path(digest, self.ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # complete chunks only: written aside and renamed
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+        return digest, len(data)
+
+
+    def get(self, digest):
+        """Content of the chunk 'digest', its integrity is checked."""
+        path = self.find(digest)
+        if path is None:
+            raise ValueError(f"Chunk not found: {digest}")
+
+        data = path.read_bytes()
+        if path.suffix in DECOMPRESS:
+            data = DECOMPRESS[path.suffix](data)
+
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Corrupted chunk: {path}")
+
+        return data
+
+
+    def chunks(self):
+        """Yield (digest, path) of every chunk in the store."""
+        for path in sorted(self.path.glob("[0-9a-f][0-9a-f]/*")):
+            if not path.name.startswith("."):
+                yield path.name.partition(".")[0], path
+
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        """Hold the store lock: shared to write chunks, exclusive to remove them."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / "lock", "a", encoding="ascii") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _walk(root):
+    """Yield every path under 'root' (not following symlinks) in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            yield Path(dirpath) / name
+
+
+def _write_json(path, data):
+    """Write 'data' as JSON to 'path' atomically."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=1)
+        fh.write("\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path):
+    """Read a manifest, check its version."""
+    with open(path, "r", encoding="utf-8") as fh:
+        manifest = json.load(fh)
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version: {manifest.get('version')!r}")
+
+    return manifest
+
+
+def read_manifest_file(path, name):
+    """Content of the file 'name' of the backup of the manifest 'path', None if missing."""
+    path = Path(path)
+    for entry in read_manifest(path)["files"]:
+        if entry["path"] == name and entry["type"] == "file":
+            store = ChunkStore(path.parent / STORE)
+            return b"".join(store.get(digest) for digest, _ in entry["chunks"])
+
+    return None
+
+
+def _store_result(pending, stats):
+    """Wait for the oldest pending chunk, fill its manifest slot."""
+    slot, future = pending.popleft()
+    digest, written = future.result()
+    slot[0] = digest
+
+    stats["chunks"] += 1
+    if written:
+        stats["new"] += 1
+        stats["written"] += written
+
+
+def _entry(path, archive_dir):
+    """Manifest entry of 'path' (without chunks), None for special files."""
+    info = path.lstat()
+    entry = {
+        "path": path.relative_to(archive_dir).as_posix(),
+        "type": None,
+        "mode": stat.S_IMODE(info.st_mode),
+        "uid": info.st_uid,
+        "gid": info.st_gid,
+        "mtime": info.st_mtime_ns,
+    }
+
+    if stat.S_ISLNK(info.st_mode):
+        entry["type"] = "symlink"
+        entry["target"] = os.readlink(path)
+    elif stat.S_ISDIR(info.st_mode):
+        entry["type"] = "dir"
+    elif stat.S_ISREG(info.st_mode):
+        entry["type"] = "file"
+        entry["size"] = info.st_size
+        entry["chunks"] = []
+    else:
+        return None
+
+    return entry
+
+
+def store_backup(archive_dir, args):
+    """
+    Store the backup 'archive_dir' in the chunk store of its parent folder.
+
+    Return the manifest path. Sizes before and after deduplication (bytes
+    actually written) are set in 'scope["archive_size"]'.
+    """
+    scope = args.scope
+    archive_dir = Path(archive_dir)
+    outdir = archive_dir.parent
+    store = ChunkStore(outdir / STORE, scope["repository"])
+    threads = scope["threads"] or os.cpu_count() or 1
+
+    stats = {"chunks": 0, "new": 0, "written": 0}
+    size = disk_usage(archive_dir)
+    entries = []
+
+    with store.lock(), ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+
+        for path in _walk(archive_dir):
+            entry = _entry(path, archive_dir)
+            if entry is None:
+                logger.warning("Repository: ignoring special file %s", path)
+                continue
+
+            entries.append(entry)
+            if entry["type"] != "file":
+                continue
+
+            with open(path, "rb") as fh:
+                for data in split_chunks(fh):
+                    # [digest, size], the digest is set once stored
+                    slot = [None, len(data)]
+                    entry["chunks"].append(slot)
+                    pending.append((slot, executor.submit(store.put, data)))
+
+                    # bounded memory: two chunks per thread
+                    while len(pending) > 2 * threads:
+                        _store_result(pending, stats)
+
+        while pending:
+            _store_result(pending, stats)
+
+        manifest_path = outdir / f"{archive_dir.name}{MANIFEST}"
+        _write_json(manifest_path, {
+            "version": MANIFEST_VERSION,
+            "name": archive_dir.name,
+            "created": int(time.time()),
+            "size": size,
+            "files": entries,
+        })
+
+    logger.info(
+        "Repository: %d chunks, %d new, %s written for %s",
+        stats["chunks"], stats["new"], human_size(stats["written"]), human_size(size))
+
+    logger.debug("Delete plain folder archive: %s\n", archive_dir)
+    shutil.rmtree(archive_dir)
+    scope["archive_size"] = (size, stats["written"])
+
+    return manifest_path.absolute()
+
+
+def extract_manifest(path, dest):
+    """
+    Rebuild the backup of the manifest 'path' in 'dest'.
+
+    Return the backup directory.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    store = ChunkStore(path.parent / STORE)
+
+    root = Path(dest) / manifest["name"]
+    root.mkdir()
+
+    for entry in manifest["files"]:
+        target = root / entry["path"]
+        if entry["type"] == "dir":
+            target.mkdir()
+        elif entry["type"] == "symlink":
+            os.symlink(entry["target"], target)
+        else:
+            with open(target, "wb") as fh:
+                for digest, _ in entry["chunks"]:
+                    fh.write(store.get(digest))
+
+    # metadata last (and directories bottom up): writing changes mtimes
+    for entry in reversed(manifest["files"]):
+        target = root / entry["path"]
+        if entry["type"] != "symlink":
+            os.chmod(target, entry["mode"])
+        try:
+            os.chown(target, entry["uid"], entry["gid"], follow_symlinks=False)
+        except OSError:
+            pass
+        os.utime(target, ns=(entry["mtime"], entry["mtime"]), follow_symlinks=False)
+
+    return root
+
+
+def collect_garbage(outdir, dry_run=False):
+    """
+    Remove the chunks no manifest in 'outdir' refers to.
+
+    Return the number of chunks removed (None if there's no store or a
+    manifest can't be read).
+    """
+    outdir = Path(outdir)
+    store = ChunkStore(outdir / STORE)
+    if not store.path.is_dir():
+        return None
+
+    with store.lock(exclusive=True):
+        referenced = set()
+        for manifest_path in outdir.glob(f"*{MANIFEST}"):
+            try:
+                manifest = read_manifest(manifest_path)
+            except (OSError, ValueError) as e:
+                logger.error("Chunk store: cannot read %s, nothing removed: %s", manifest_path, e)
+                return None
+
+            for entry in manifest["files"]:
+                referenced.update(digest for digest, _ in entry.get("chunks", ()))
+
+        # nobody is writing: temporary files are left by interrupted backups
+        for tmp_path in store.path.glob("[0-9a-f][0-9a-f]/.*.tmp"):
+            if not dry_run:
+                tmp_path.unlink()
+
+        unreferenced = [
+            chunk_path for digest, chunk_path in store.chunks() if digest not in referenced]
+        size = sum(chunk_path.stat().st_size for chunk_path in unreferenced)
+
+        logger.info(
+            "Chunk store: %d chunks referenced, deleting %d unreferenced (%s)",
+            len(referenced), len(unreferenced), human_size(size))
+
+        if not dry_run:
+            for chunk_path in unreferenced:
+                chunk_path.unlink()
+
+    return len(unreferenced)
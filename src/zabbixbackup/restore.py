@@ -0,0 +1,714 @@
+"""
+Restore a backup into an existing (empty) database.
+
+The backup is unpacked (or rebuilt from the chunk store, see
+`repository.py`), streamed dumps (see `stream.py`) are joined back
+and the DBMS is read from 'zabbix_dbversion'. Data is loaded in parallel
+and indexes and constraints are built once, after the data is loaded,
+instead of being updated row by row.
+
+    Postgres: `pg_restore` section by section: pre-data (tables), data
+        (with --jobs), history and trends chunks (concurrent `COPY`) and
+        post-data (indexes, constraints and triggers, with --jobs).
+
+    MySQL: the schema dump is split in tables without secondary indexes
+        and foreign keys, the data dumps are split by table. Tables and
+        chunks are loaded by concurrent `mysql` clients (largest first),
+        then indexes and foreign keys are added table by table and, last,
+        routines and triggers are created.
+
+The data of unchanged config tables (see `unchanged.py`) is loaded from
+the backups holding it, found next to the restored one.
+"""
+import re
+import bz2
+import gzip
+import lzma
+import time
+import shutil
+import atexit
+import logging
+import tarfile
+import tempfile
+from os import environ
+from pathlib import Path
+from subprocess import PIPE
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import COMPRESS_EXTENSIONS, DPopen, check_binary, process_repr
+from .backup_mysql import _mysql_auth, _mysql_client_cmd
+from .backup_postgre import _psql_auth, _psql_client_cmd
+from .progress import human_time
+from .repository import MANIFEST, extract_manifest
+from .unchanged import find_backup, read_references
+
+logger = logging.getLogger()
+
+
+# decompression binaries, by preference
+DECOMPRESS_COMMANDS = {
+    "gzip": (("pigz", "-dc"), ("gzip", "-dc")),
+    "bzip2": (("pbzip2", "-dc"), ("bzip2", "-dc")),
+    "xz": (("xz", "-dc", "-T0"), ),
+    "zstd": (("zstd", "-dc", "-q"), ),
+    "lz4": (("lz4", "-dc", "-q"), ),
+}
+
+# in-process decompression, used when no binary is available
+DECOMPRESS_MODULES = {"gzip": gzip, "bzip2": bz2, "xz": lzma}
+
+# compression by file extension ('.lz' is pg_dump lz4 plain format)
+EXTENSIONS = dict((ext, algo) for algo, ext in COMPRESS_EXTENSIONS.items())
+EXTENSIONS[".lz"] = "lz4"
+
+PART = re.compile(r"^(?P<name>.+)\.part(?P<index>\d{4})$")
+
+# Postgres dumps by format (see `_pg_dump`): custom, directory, tar
+PG_DUMPS = ("zabbix_dump.pgdump", "zabbix_dump", "zabbix_dump.tar")
+
+# MySQL schema dump, index and foreign keys lines in CREATE TABLE
+CREATE_TABLE = re.compile(r"^CREATE TABLE `(?P<table>(?:[^`]|``)+)` \(")
+INDEX_PREFIXES = ("KEY ", "UNIQUE KEY ", "FULLTEXT KEY ", "SPATIAL KEY ")
+LOCK_TABLES = re.compile(rb"^LOCK TABLES `(?P<table>(?:[^`]|``)+)` WRITE;")
+
+
+def compression_of(path):
+    """Compression algorithm of 'path' by its extension (None if not compressed)."""
+    return EXTENSIONS.get(Path(path).suffix)
+
+
+def decompress_command(algo):
+    """Decompression command (to stdout) for 'algo', None if not available."""
+    for cmd in DECOMPRESS_COMMANDS[algo]:
+        if check_binary(cmd[0]):
+            return cmd
+
+    return None
+
+
+def unpack(archive, workdir):
+    """
+    Extract 'archive' (tar, compressed or not) into 'workdir'.
+
+    Return the backup directory.
+    """
+    name = archive.name
+    algo = None
+    if not name.endswith(".tar"):
+        algo = compression_of(name)
+        if algo is None or not name[:-len(archive.suffix)].endswith(".tar"):
+            raise ValueError(f"Unknown archive format: {name!r}")
+
+    cmd = decompress_command(algo) if algo is not None else None
+
+    if check_binary("tar") and (algo is None or cmd is not None):
+        tar_cmd = ("tar", "-xf", "-", "-C", str(workdir))
+        pipeline = f"{process_repr(tar_cmd, {})} < {archive}"
+        if cmd is not None:
+            pipeline = f"{process_repr(cmd, {})} < {archive} | {process_repr(tar_cmd, {})}"
+        logger.info("Unpack command: \n%s", pipeline)
+
+        with open(archive, "rb") as fh:
+            if cmd is None:
+                tar = DPopen(tar_cmd, stdin=fh)
+                tar.communicate()
+                success = tar.returncode == 0
+            else:
+                decompress = DPopen(cmd, stdin=fh, stdout=PIPE)
+                tar = DPopen(tar_cmd, stdin=decompress.stdout)
+                decompress.stdout.close()
+                tar.communicate()
+                decompress.wait()
+                success = tar.returncode == 0 and decompress.returncode == 0
+
+        if not success:
+            raise ValueError(f"Could not unpack the archive {name!r} (see logs)")
+
+    elif algo is None or algo in DECOMPRESS_MODULES:
+        logger.info("Unpack in-process: %s", archive)
+        with tarfile.open(archive, "r:*") as tar:
+            # refuse absolute paths, links outside the archive and devices
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(workdir, filter="data")
+            else:
+                tar.extractall(workdir) # nosec: trusted archive
+
+    else:
+        raise NotImplementedError(f"Decompression binary not available '{algo}'")
+
+    dirs = [path for path in Path(workdir).iterdir() if path.is_dir()]
+    if len(dirs) != 1:
+        raise ValueError(f"Not a backup archive (a single folder expected): {name!r}")
+
+    return dirs[0]
+
+
+def join_parts(backup_dir):
+    """
+    Join the parts of the streamed dumps (see `stream.py`) in place.
+
+    Return the list of joined files.
+    """
+    parts = {}
+    for path in Path(backup_dir).rglob("*.part[0-9][0-9][0-9][0-9]"):
+        match = PART.match(path.name)
+        parts.setdefault(path.with_name(match["name"]), []).append((int(match["index"]), path))
+
+    for target, members in parts.items():
+        logger.debug("Join %d parts: %s", len(members), target)
+        with open(target, "wb") as out:
+            for _, path in sorted(members):
+                with open(path, "rb") as fh:
+                    shutil.copyfileobj(fh, out, 1024 * 1024)
+                path.unlink()
+
+    return sorted(parts)
+
+
+def read_dbversion(backup_dir):
+    """Return the DBMS ('postgres' or 'mysql') and zabbix version of a backup."""
+    with open(Path(backup_dir) / "zabbix_dbversion", "r", encoding="utf-8") as fh:
+        lines = fh.read().split()
+
+    if len(lines) != 2:
+        raise ValueError("Invalid 'zabbix_dbversion'")
+
+    return lines[0], lines[1]
+
+
+@contextmanager
+def open_dump(path):
+    """Open 'path' for reading (binary), decompressed according to its extension."""
+    algo = compression_of(path)
+    if algo is None:
+        with open(path, "rb") as fh:
+            yield fh
+        return
+
+    cmd = decompress_command(algo)
+    if cmd is None:
+        if algo not in DECOMPRESS_MODULES:
+            raise NotImplementedError(f"Decompression binary not available '{algo}'")
+
+        with DECOMPRESS_MODULES[algo].open(path, "rb") as fh:
+            yield fh
+        return
+
+    decompress = DPopen(cmd + (str(path), ), stdout=PIPE)
+    try:
+        yield decompress.stdout
+    finally:
+        decompress.stdout.close()
+        decompress.wait()
+
+
+def _execute(args, cmd, description, stdin=None, log_func=logger.debug):
+    """
+    Run a database client 'cmd', 'stdin' is a file path to feed it
+    (decompressed if needed). Return True on success.
+    """
+    env_extra = args.scope["env"]
+    cmd = tuple(map(str, cmd))
+
+    redirect = "" if stdin is None else f" < {stdin}"
+    log_func("%s: \n%s%s", description, process_repr(cmd, env_extra), redirect)
+
+    # don't execute if dry run is enabled
+    if args.dry_run:
+        return True
+
+    env = {**environ, **env_extra}
+    algo = None if stdin is None else compression_of(stdin)
+    decompress = decompress_command(algo) if algo is not None else None
+
+    if stdin is None:
+        proc = DPopen(cmd, env=env, stdin=PIPE)
+        _, stderr = proc.communicate()
+    elif algo is None:
+        with open(stdin, "rb") as fh:
+            proc = DPopen(cmd, env=env, stdin=fh)
+            _, stderr = proc.communicate()
+    elif decompress is not None:
+        source = DPopen(decompress + (str(stdin), ), stdout=PIPE)
+        proc = DPopen(cmd, env=env, stdin=source.stdout)
+        source.stdout.close()
+        _, stderr = proc.communicate()
+        source.wait()
+        if source.returncode != 0 and proc.returncode == 0:
+            logger.error("%s: could not decompress %s", description, stdin)
+            return False
+    else:
+        proc = DPopen(cmd, env=env, stdin=PIPE)
+        try:
+            with open_dump(stdin) as fh:
+                shutil.copyfileobj(fh, proc.stdin, 1024 * 1024)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        _, stderr = proc.communicate()
+
+    if proc.returncode != 0:
+        detail = stderr.decode(errors="replace").strip() if stderr else "see logs"
+        logger.error("%s: failed (%d): %s", description, proc.returncode, detail)
+        return False
+
+    return True
+
+
+def unpack_backup(path, workdir):
+    """Unpack the backup 'path' (folder, archive or manifest), return its directory."""
+    if path.is_dir():
+        return path
+    if path.suffix == MANIFEST:
+        return extract_manifest(path, workdir)
+    return unpack(path, workdir)
+
+
+def unpack_references(backup_dir, directory, workdir):
+    """
+    Unpack the backups holding the data of the unchanged tables of
+    'backup_dir', searched in 'directory'.
+
+    Return a list of (backup directory, tables, joined files).
+    """
+    references = []
+    for index, (name, tables) in enumerate(sorted(read_references(backup_dir).items())):
+        path = find_backup(directory, name)
+        if path is None:
+            raise ValueError(f"Backup holding unchanged tables not found: {name!r}")
+
+        logger.info("Unchanged tables from %s: %r", path, tables)
+        reference_workdir = Path(workdir) / f"reference_{index:02d}"
+        reference_workdir.mkdir()
+        reference_dir = unpack_backup(path, reference_workdir)
+        references.append((reference_dir, tables, join_parts(reference_dir)))
+
+    return references
+
+
+def _run_parallel(tasks, jobs):
+    """
+    Run 'tasks', a list of (name, callable returning True on success),
+    with up to 'jobs' workers. Return the names of the failed tasks.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(lambda task: task[1](), tasks))
+
+    return [name for (name, _), success in zip(tasks, results) if not success]
+
+
+class _Phase:
+    """Log the duration of a restore phase."""
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        logger.info("Restore %s", self.name)
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.monotonic() - self.started
+        logger.info("Restore %s: done in %s", self.name, human_time(elapsed))
+
+
+def _largest_first(paths):
+    return sorted(paths, key=lambda path: (-path.stat().st_size, str(path)))
+
+
+def restore(args):
+    """Restore the backup 'args.archive', return (status, message)."""
+    archive = args.archive.absolute()
+
+    # unpacked archive and prepared files
+    base_dir = args.workdir if args.workdir is not None else archive.parent
+    workdir = Path(tempfile.mkdtemp(prefix="zabbixbackup_restore_", dir=base_dir))
+    if args.keep:
+        logger.info("Restore files are kept in: %s", workdir)
+    else:
+        atexit.register(shutil.rmtree, workdir, True)
+
+    try:
+        with _Phase("unpack"):
+            backup_dir = unpack_backup(archive, workdir)
+            joined = join_parts(backup_dir)
+            references = unpack_references(backup_dir, archive.parent, workdir)
+    except (NotImplementedError, ValueError, OSError) as e:
+        return 1, f"Could not unpack the backup: {e}"
+
+    try:
+        dbms, version = read_dbversion(backup_dir)
+    except (ValueError, OSError) as e:
+        return 2, f"Not a zabbixbackup backup ({e})"
+
+    logger.info("Backup: %s, zabbix version %s", dbms, version)
+    args.scope["dbms"] = dbms
+
+    if dbms == "postgres":
+        return restore_postgresql(args, backup_dir, joined, references)
+    if dbms == "mysql":
+        return restore_mysql(args, backup_dir, workdir, references)
+
+    return 2, f"Unknown DBMS in 'zabbix_dbversion': {dbms!r}"
+
+
+# pylint: disable-next=too-many-locals,too-many-return-statements,too-many-branches
+def restore_postgresql(args, backup_dir, joined=(), references=()):
+    """
+    Restore a Postgres backup, return (status, message).
+
+    'references' lists the backups holding unchanged tables data
+    (see `unpack_references`).
+    """
+    if not check_binary("psql", "pg_restore"):
+        return 1, "Missing binaries: check 'psql' and 'pg_restore' are available and in PATH"
+
+    if args.port is None:
+        args.port = 5432
+
+    args.scope["env"] = {}
+    _psql_auth(args)
+
+    jobs = args.scope["jobs"]
+    chunks = _largest_first(backup_dir.glob("chunks/*/*.copy"))
+
+    dumps = [backup_dir / name for name in PG_DUMPS if (backup_dir / name).exists()]
+    plain = sorted(backup_dir.glob("zabbix_dump.sql*"))
+
+    if dumps:
+        dump = dumps[0]
+        restore_cmd = [
+            "pg_restore",
+            "--host", args.host,
+            "--username", args.user,
+            "--port", args.port,
+            "--dbname", args.dbname,
+            "--no-password",
+            "--no-owner",
+            "--exit-on-error",
+        ]
+
+        # tar archives and streamed custom dumps (no data offsets)
+        # can't be restored in parallel
+        data_jobs = jobs
+        if dump.suffix == ".tar" or dump in joined:
+            logger.info("Parallel restore not supported by the dump: single job")
+            data_jobs = 1
+
+        def _section(section, section_jobs, source=dump, tables=()):
+            params = ["--section", section]
+            if section_jobs > 1:
+                params += ["--jobs", section_jobs]
+            for table in tables:
+                params += ["--table", table]
+            return _execute(
+                args, restore_cmd + params + [source],
+                f"Restore {section} command", log_func=logger.info)
+
+        with _Phase("schema"):
+            if not _section("pre-data", 1):
+                return 5, "Could not restore the schema (see logs)"
+
+        with _Phase("data"):
+            if not _section("data", data_jobs):
+                return 5, "Could not restore the data (see logs)"
+
+        for reference_dir, tables, reference_joined in references:
+            reference = [
+                reference_dir / name for name in PG_DUMPS if (reference_dir / name).exists()]
+            if not reference:
+                return 3, f"No Postgres dump (but plain) found in {reference_dir.name}"
+
+            reference_jobs = jobs
+            if reference[0].suffix == ".tar" or reference[0] in reference_joined:
+                reference_jobs = 1
+
+            with _Phase(f"unchanged tables data from {reference_dir.name}"):
+                if not _section("data", reference_jobs, reference[0], tables):
+                    return 5, "Could not restore unchanged tables data (see logs)"
+
+    elif plain:
+        # indexes and constraints are created along with the data
+        plain_cmd = _psql_client_cmd(args) + ["--quiet", "--set", "ON_ERROR_STOP=1"]
+        with _Phase("dump"):
+            if not _execute(
+                args, plain_cmd, "Restore command", stdin=plain[0], log_func=logger.info
+            ):
+                return 5, "Could not restore the dump (see logs)"
+
+    else:
+        return 3, "No Postgres dump found in the backup"
+
+    if chunks:
+        def _chunk_task(path):
+            copy_query = f'COPY "{args.schema}"."{path.parent.name}" FROM STDIN'
+            chunk_cmd = _psql_client_cmd(args) + [
+                "--quiet", "--set", "ON_ERROR_STOP=1", "--command", copy_query]
+            return path.name, lambda: _execute(args, chunk_cmd, "Chunk command", stdin=path)
+
+        logger.info("Chunks to restore: %d", len(chunks))
+        with _Phase("chunks"):
+            failed = _run_parallel(list(map(_chunk_task, chunks)), jobs)
+        if failed:
+            return 5, f"Could not restore chunks (see logs): {failed!r}"
+
+    if dumps:
+        with _Phase("indexes and constraints"):
+            if not _section("post-data", jobs):
+                return 5, "Could not restore indexes and constraints (see logs)"
+
+    return 0, "+OK"
+
+
+def _split_create_table(statement):
+    """
+    Split a CREATE TABLE statement (as formatted by mysqldump).
+
+    Return the table name, the statement without secondary indexes and
+    foreign keys, the indexes and the foreign keys definitions.
+    """
+    lines = statement.splitlines(keepends=True)
+    table = CREATE_TABLE.match(lines[0])["table"].replace("``", "`")
+
+    end = next(
+        index for index, line in enumerate(lines)
+        if index > 0 and line.startswith(")"))
+    body = [line.strip().rstrip(",") for line in lines[1:end]]
+
+    # an auto increment column must be the first column of an index
+    if any(line.startswith("`") and " AUTO_INCREMENT" in line for line in body):
+        return table, statement, [], []
+
+    keep, indexes, foreign_keys = [], [], []
+    for line in body:
+        if line.startswith(INDEX_PREFIXES):
+            indexes.append(line)
+        elif line.startswith("CONSTRAINT ") and " FOREIGN KEY " in line:
+            foreign_keys.append(line)
+        else:
+            keep.append(line)
+
+    create = lines[0] + ",\n".join(f"  {line}" for line in keep) + "\n" + "".join(lines[end:])
+
+    return table, create, indexes, foreign_keys
+
+
+def split_schema(lines):
+    """
+    Split a `mysqldump --no-data --routines` output (lines of text).
+
+    Return the statements creating the tables without their secondary
+    indexes and foreign keys, {table: indexes}, {table: foreign keys} and
+    the statements creating routines and triggers (DELIMITER included).
+    The leading session settings are in both lists of statements.
+    """
+    header, tables, post = [], [], []
+    indexes, foreign_keys = {}, {}
+
+    delimiter = ";"
+    statement = []
+    for line in lines:
+        stripped = line.strip()
+        if not statement:
+            if stripped == "" or stripped.startswith("--"):
+                continue
+
+            if stripped.upper().startswith("DELIMITER "):
+                delimiter = stripped.split()[1]
+                post.append(line)
+                continue
+
+        statement.append(line)
+        if not stripped.endswith(delimiter):
+            continue
+
+        text = "".join(statement)
+        statement = []
+
+        # routines and triggers and their session settings
+        if delimiter != ";" or text.startswith("/*!50003 "):
+            post.append(text)
+        elif text.startswith("CREATE TABLE "):
+            table, create, table_indexes, table_foreign_keys = _split_create_table(text)
+            tables.append(create)
+            if table_indexes:
+                indexes[table] = table_indexes
+            if table_foreign_keys:
+                foreign_keys[table] = table_foreign_keys
+        elif not tables and not post and text.startswith("/*!40"):
+            header.append(text)
+        else:
+            tables.append(text)
+
+    return header + tables, indexes, foreign_keys, (header + post) if post else []
+
+
+def split_data(fh, outdir, prefix):
+    """
+    Split a mysqldump data dump (binary file object) by table, every file
+    starts with the session settings of the dump.
+
+    Return a list of (table, path) or None if the dump can't be split
+    (data outside of 'LOCK TABLES' blocks, see `--add-locks`).
+    """
+    header = []
+    files = []
+    out = None
+    for line in fh:
+        match = LOCK_TABLES.match(line)
+        if match is not None:
+            table = match["table"].decode(errors="replace").replace("``", "`")
+            path = Path(outdir) / f"{prefix}_{len(files):04d}_{table}.sql"
+            files.append((table, path))
+            # pylint: disable-next=consider-using-with
+            out = open(path, "wb")
+            out.writelines(header)
+
+        if out is not None:
+            out.write(line)
+            if line.startswith(b"UNLOCK TABLES;"):
+                out.close()
+                out = None
+        elif line.startswith(b"INSERT "):
+            for _, path in files:
+                path.unlink()
+            return None
+        elif not files and not line.startswith(b"--"):
+            header.append(line)
+
+    if out is not None:
+        out.close()
+
+    return files
+
+
+def _quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
+
+# pylint: disable-next=too-many-locals,too-many-return-statements,too-many-branches,too-many-statements
+def restore_mysql(args, backup_dir, workdir, references=()):
+    """
+    Restore a MySQL backup, return (status, message).
+
+    'references' lists the backups holding unchanged tables data
+    (see `unpack_references`).
+    """
+    if not check_binary("mysql"):
+        return 1, "Missing binaries: check 'mysql' is available and in PATH"
+
+    if args.port is None:
+        args.port = 3306
+
+    args.scope["env"] = {}
+    _mysql_auth(args)
+
+    jobs = args.scope["jobs"]
+    client_cmd = _mysql_client_cmd(args) + ["--max-allowed-packet=1G"]
+
+    prepare_dir = Path(workdir) / "prepared"
+    prepare_dir.mkdir(exist_ok=True)
+
+    schemas = sorted(backup_dir.glob("schemas_dump.sql*"))
+    if not schemas:
+        return 3, "No MySQL schema dump found in the backup"
+
+    with _Phase("prepare"):
+        with open_dump(schemas[0]) as fh:
+            lines = (line.decode("utf-8") for line in fh)
+            tables_sql, indexes, foreign_keys, post_sql = split_schema(lines)
+
+        tables_path = prepare_dir / "schema_tables.sql"
+        tables_path.write_text("".join(tables_sql), encoding="utf-8")
+
+        post_path = prepare_dir / "schema_post.sql"
+        post_path.write_text("".join(post_sql), encoding="utf-8")
+
+        # the data dump(s) are split by table, unpacked dumps are not needed anymore
+        data_files = []
+        for index, path in enumerate(sorted(backup_dir.glob("data_dump*.sql*"))):
+            with open_dump(path) as fh:
+                split = split_data(fh, prepare_dir, f"data{index:02d}")
+
+            if split is None:
+                logger.warning("Data dump not split by table, loaded as a whole: %s", path)
+                data_files.append((None, path))
+                continue
+
+            data_files += split
+            if Path(workdir) in path.parents:
+                path.unlink()
+
+        # only the unchanged tables are loaded from the referenced backups
+        for number, (reference_dir, tables, _) in enumerate(references):
+            for index, path in enumerate(sorted(reference_dir.glob("data_dump*.sql*"))):
+                with open_dump(path) as fh:
+                    split = split_data(fh, prepare_dir, f"reference{number:02d}_{index:02d}")
+
+                if split is None:
+                    return 3, f"Data dump not split by table: {path}"
+
+                for table, split_path in split:
+                    if table in tables:
+                        data_files.append((table, split_path))
+                    else:
+                        split_path.unlink()
+
+    logger.info(
+        "Deferred indexes: %d (%d tables), deferred foreign keys: %d (%d tables)",
+        sum(map(len, indexes.values())), len(indexes),
+        sum(map(len, foreign_keys.values())), len(foreign_keys))
+
+    with _Phase("schema"):
+        if not _execute(
+            args, client_cmd, "Restore schema command", stdin=tables_path,
+            log_func=logger.info
+        ):
+            return 5, "Could not restore the schema (see logs)"
+
+    chunks = list(backup_dir.glob("chunks/*/*.sql*"))
+    loads = _largest_first([path for _, path in data_files] + chunks)
+    logger.info("Data files to load: %d (chunks: %d)", len(loads), len(chunks))
+
+    def _load_task(path):
+        return path.name, lambda: _execute(args, client_cmd, "Load command", stdin=path)
+
+    with _Phase("data"):
+        failed = _run_parallel(list(map(_load_task, loads)), jobs)
+    if failed:
+        return 5, f"Could not load data (see logs): {failed!r}"
+
+    def _alter_task(name, table, clauses, settings=""):
+        path = prepare_dir / f"{name}_{table}.sql"
+        adds = ",\n".join(f"  ADD {clause}" for clause in clauses)
+        path.write_text(f"{settings}ALTER TABLE {_quote(table)}\n{adds};\n", encoding="utf-8")
+        return table, lambda: _execute(args, client_cmd, "Alter command", stdin=path)
+
+    with _Phase("indexes"):
+        tasks = [
+            _alter_task(f"index_{index:04d}", table, clauses)
+            for index, (table, clauses) in enumerate(indexes.items())]
+        failed = _run_parallel(tasks, jobs)
+    if failed:
+        return 5, f"Could not create indexes (see logs): {failed!r}"
+
+    # the data is consistent: constraints are not checked again
+    with _Phase("foreign keys"):
+        tasks = [
+            _alter_task(f"fk_{index:04d}", table, clauses, "SET foreign_key_checks=0;\n")
+            for index, (table, clauses) in enumerate(foreign_keys.items())]
+        failed = _run_parallel(tasks, jobs)
+    if failed:
+        return 5, f"Could not create foreign keys (see logs): {failed!r}"
+
+    if post_sql:
+        with _Phase("routines and triggers"):
+            if not _execute(
+                args, client_cmd, "Restore routines and triggers command", stdin=post_path,
+                log_func=logger.info
+            ):
+                return 5, "Could not restore routines and triggers (see logs)"
+
+    return 0, "+OK"
@@ -3,66 +3,212 @@ Helper functions for archives rotation.
 """
 from pathlib import Path
 from shutil import rmtree
-import re
 import logging
 from typing import Union
 from .parser_defaults import PSqlArgs, MySqlArgs
+from .catalog import backup_datetime, re_cfg, read_catalog, update_catalog
+from .repository import collect_garbage
+from .unchanged import backup_holders, referenced_backups
+from .trash import move_to_trash, start_reaper, trash_items
 
 logger = logging.getLogger()
 
 
-re_cfg = re.compile(r"""
-    zabbix_                             # suffix
-    (?P<hostorname>[^_]+?)_             # host name
-    (?P<year>[0-9]{4})                  # yearmonthday-hourminutesecond
-    (?P<month>[0-9]{2})                 #
-    (?P<day>[0-9]{2})-                  #
-    (?P<hour>[0-9]{2})                  #
-    (?P<minute>[0-9]{2})                #
-    (?P<second>[0-9]{2})                #
-    #(?P<version>([0-9][.])+?[0-9]+?)    # zabbix version and eol
-    (?P<ext>([.]tar([.](gz|xz|bz2))?))? # extension (empty if plain folder)
-""", re.VERBOSE)
+# retention periods, the key of the period of a backup by its datetime
+PERIODS = {
+    "daily": lambda dt: dt.strftime("%Y-%m-%d"),
+    "weekly": lambda dt: "{}-W{:02d}".format(*dt.isocalendar()[:2]),
+    "monthly": lambda dt: dt.strftime("%Y-%m"),
+    "yearly": lambda dt: dt.strftime("%Y"),
+}
+
+
+def plan_retention(timestamps, last, periods):
+    """
+    Grandfather-father-son retention of backups by their 'timestamps'
+    (datetimes, oldest first).
+
+    The 'last' backups are kept and, for every period in 'periods'
+    ({"daily": count, ...}, see `PERIODS`), the newest backup of each of
+    the 'count' newest periods having backups.
+
+    Return a list, in the same order, of tuples (keep, reasons).
+    """
+    # reasons to keep and to remove every backup
+    kept = [[] for _ in timestamps]
+    removed = [[] for _ in timestamps]
+    newest_first = list(range(len(timestamps)))[::-1]
+
+    for rank, index in enumerate(newest_first):
+        if rank < last:
+            kept[index].append(f"last {rank + 1}/{last}")
+        elif last > 0:
+            removed[index].append(f"not in the last {last}")
+
+    for period, count in periods.items():
+        if count <= 0:
+            continue
+
+        seen = set()
+        for index in newest_first:
+            key = PERIODS[period](timestamps[index])
+            if key in seen:
+                removed[index].append(f"{period}: {key} has a newer backup")
+            elif len(seen) < count:
+                seen.add(key)
+                kept[index].append(f"{period} {len(seen)}/{count} ({key})")
+            else:
+                removed[index].append(f"{period}: {key} older than the last {count}")
+
+    # kept if any rule keeps it
+    return [
+        (True, keep_reasons) if keep_reasons else (False, remove_reasons)
+        for keep_reasons, remove_reasons in zip(kept, removed)
+    ]
+
+
+def _delete(item):
+    """Delete a backup (file or folder)."""
+    if item.is_file():
+        item.unlink()
+    else:
+        rmtree(item, ignore_errors=True)
 
 
 def rotate(args: Union[PSqlArgs, MySqlArgs]):
     """
-    Perform an archive rotation keeping the last 'args.n' archives.
+    Perform an archive rotation keeping the last 'args.rotate' archives and
+    the ones selected by the grandfather-father-son policy (see
+    `plan_retention` and 'args.keep_daily', 'keep_weekly', 'keep_monthly'
+    and 'keep_yearly').
+
+    Return the number of backups kept and removed (None if disabled).
+    Backups are read from the catalog (see `catalog.py`), if any, and removed
+    from it: failed runs don't count as backups and are removed, unless only
+    their archive failed (status 6, the folder holds the dump). Older backups
+    holding the data of unchanged tables (see `unchanged.py`) are kept as
+    well. With a repository, chunks left unreferenced are removed.
+
+    With 'args.background_delete' backups are moved to the trash and
+    deleted by a detached process (see `trash.py`), set in 'scope["reaper"]'.
     """
     n = args.rotate
+    periods = {
+        "daily": args.keep_daily,
+        "weekly": args.keep_weekly,
+        "monthly": args.keep_monthly,
+        "yearly": args.keep_yearly,
+    }
 
-    if n <= 0:
-        return
+    if n <= 0 and not any(count > 0 for count in periods.values()):
+        return None
 
     name = args.name if args.name is not None else args.host
 
-    # create a list of tuples in the form of [(datetime as int, folder)]
+    # backups from the catalog if any, from the directory listing otherwise
+    entries = read_catalog(".")
+    failed = {}
+    if entries is None:
+        candidates = list(Path(".").iterdir())
+    else:
+        candidates = [Path(entry["file"]) for entry in entries if entry["host"] == name]
+        # failed runs take no retention slot and are deleted
+        failed = dict(
+            (entry["file"], entry["status"]) for entry in entries
+            if entry["host"] == name and entry["status"] not in (0, None))
+
+    # create a list of tuples in the form of [(datetime, folder)]
     # in order to being able to sort it naturally
     backups = []
-    for archive in Path(".").iterdir():
+    names = {}
+    for archive in candidates:
         if match := re_cfg.fullmatch(archive.name):
-            d = match.groupdict()
-            if d["hostorname"] == name:
-                int_dt = int(
-                    f"{d['year']}{d['month']}{d['day']}"
-                    f"{d['hour']}{d['minute']}{d['second']}"
-                )
-                backups.append((int_dt, archive))
+            if match["hostorname"] == name:
+                backups.append((backup_datetime(match), archive))
+                names[archive] = archive.name[:match.start("ext")] if match["ext"] else archive.name
 
     backups = sorted(backups)
-    remove, keep = backups[:-n], backups[-n:]
+    good = [index for index, (_, item) in enumerate(backups) if item.name not in failed]
+    # a failed archive (status 6) leaves the complete dump in the folder
+    plan = [
+        (True, ["archive failed, holds the dump"]) if failed.get(item.name) == 6
+        else (False, [f"failed run (status {failed.get(item.name)})"])
+        for _, item in backups]
+    for index, decision in zip(
+            good, plan_retention([backups[index][0] for index in good], max(n, 0), periods)):
+        plan[index] = decision
+
+    # backups holding the data of unchanged tables are kept: the ones of the
+    # next backup (state) and the ones every kept backup refers to
+    cataloged = dict((entry["file"], entry) for entry in entries or ())
+    referenced = referenced_backups(Path(f"zabbix_{name}.checksums"))
+    expanded = set()
+    found = []
+    held = 0
+    while True:
+        for index, (_, item) in enumerate(backups):
+            if not plan[index][0] and item.name not in failed and names[item] in referenced:
+                plan[index] = (True, ["holds unchanged tables data"])
+                held += 1
+
+        new = set()
+        for index, (_, item) in enumerate(backups):
+            if not plan[index][0] or index in expanded:
+                continue
+            expanded.add(index)
+
+            entry = cataloged.get(item.name)
+            holders = None if entry is None else entry.get("holders")
+            if holders is None:
+                holders = backup_holders(item, names[item])
+                if entry is not None:
+                    found.append({**entry, "holders": holders})
+            new.update(set(holders) - referenced)
+
+        if not new:
+            break
+        referenced |= new
+
+    remove = [backup for backup, (keep, _) in zip(backups, plan) if not keep]
+    keep = [backup for backup, (keep, _) in zip(backups, plan) if keep]
 
     logger.info("Rotate backups")
     logger.info("Found %d backup/s", len(backups))
     logger.info("Deleting %d and keeping %d backup/s", len(remove), len(keep))
+    if held:
+        logger.info("Keeping %d older backup/s holding unchanged tables data", held)
 
-    for _, item in remove:
-        logger.info("    deleting backup '%s'", item)
-        if not args.dry_run:
-            if item.is_file():
-                item.unlink()
-            else:
-                rmtree(item, ignore_errors=True)
+    # reasons of every decision, in the log or at least in dry run
+    keep_log = logger.info if args.dry_run else logger.debug
+    for (_, item), (kept, reasons) in zip(backups, plan):
+        if kept:
+            keep_log("    keeping backup '%s': %s", item, ", ".join(reasons))
+        else:
+            logger.info("    deleting backup '%s': %s", item, ", ".join(reasons))
+            if args.dry_run:
+                continue
+
+            if args.background_delete:
+                try:
+                    move_to_trash(item)
+                    continue
+                except OSError as e:
+                    logger.warning("Cannot move '%s' to the trash, deleting it: %s", item, e)
+
+            _delete(item)
+
+    # holders read from the backups (older catalog entries) are cataloged
+    removed = set(item.name for _, item in remove)
+    found = [entry for entry in found if entry["file"] not in removed]
+    if entries is not None and (remove or found) and not args.dry_run:
+        update_catalog(".", add=found, remove=removed)
+
+    # leftovers of an interrupted reaper are deleted as well; the reaper
+    # outlives this run, its process is in 'scope["reaper"]'
+    if args.background_delete and not args.dry_run and trash_items("."):
+        args.scope["reaper"] = start_reaper(".", args.delete_rate)
+
+    if args.repository:
+        collect_garbage(Path("."), args.dry_run)
 
-    for _, item in keep:
-        logger.debug("    keeping backup '%s'", item)
+    return len(keep), len(remove)
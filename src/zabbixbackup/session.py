@@ -0,0 +1,159 @@
+"""
+Persistent query sessions: a single connection for every metadata query.
+
+A native driver is used if installed, otherwise a long-lived client
+process (`psql` or `mysql`) reading the queries from stdin. Batches of
+queries are sent at once (a single round trip with the client process)
+and results are split on a marker printed after each query.
+
+Results are lists of lines formatted as the client would print them.
+The client stderr is kept (last lines) and logged if the session dies.
+"""
+import uuid
+import logging
+import threading
+from collections import deque
+from subprocess import PIPE
+
+from .utils import DPopen, process_repr
+
+logger = logging.getLogger()
+
+
+# client stderr lines kept for the log
+STDERR_LINES = 100
+
+
+class ClientSession:
+    """
+    A long-lived client process started on the first query.
+
+    'marker_input(marker)' returns the client input printing 'marker' on a
+    line by itself. The client must stop on the first error (the session
+    is restarted on the next query).
+    """
+    def __init__(self, cmd, env, marker_input, description="query session"):
+        self.cmd = tuple(map(str, cmd))
+        self.env = env
+        self.marker_input = marker_input
+        self.description = description
+        self.proc = None
+        self.stderr = deque(maxlen=STDERR_LINES)
+        self.reader = None
+
+
+    def _start(self, env_extra):
+        logger.debug("%s: \n%s", self.description, process_repr(self.cmd, env_extra))
+        self.proc = DPopen(
+            self.cmd, env=self.env, stdin=PIPE, stdout=PIPE, stderr=PIPE, text=True)
+
+        # drained while the session lives: the client never blocks on it
+        self.stderr.clear()
+        self.reader = threading.Thread(
+            target=self.stderr.extend, args=(self.proc.stderr, ), daemon=True)
+        self.reader.start()
+
+
+    def query_many(self, queries, env_extra=None):
+        """Run 'queries', return a list of results or None if any failed."""
+        if self.proc is None:
+            self._start(env_extra or {})
+
+        marker = f"__zabbixbackup_{uuid.uuid4().hex}__"
+        batch = "".join(
+            f"{query.strip().rstrip(';')};\n{self.marker_input(marker)}\n"
+            for query in queries)
+
+        try:
+            self.proc.stdin.write(batch)
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self._stop(failed=True)
+            return None
+
+        results = []
+        for _ in queries:
+            lines = []
+            for line in self.proc.stdout:
+                line = line.rstrip("\n")
+                if line == marker:
+                    break
+                lines.append(line)
+            else:
+                # the client exited (error)
+                self._stop(failed=True)
+                return None
+
+            results.append(lines)
+
+        return results
+
+
+    def _stop(self, failed=False):
+        """End the client process, log its stderr as errors if 'failed'."""
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+
+        try:
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        proc.wait()
+        proc.stdout.close()
+        self.reader.join()
+        proc.stderr.close()
+
+        log_func = logger.error if failed else logger.debug
+        if failed:
+            logger.error("%s failed (exit status %s)", self.description, proc.returncode)
+        for line in self.stderr:
+            log_func("%s", line.rstrip("\n"))
+
+
+    def close(self):
+        """End the client process."""
+        self._stop()
+
+
+class DriverSession:
+    """
+    A session on top of a native (DB-API) connection.
+
+    Values are joined with 'separator' and NULLs printed as 'null'.
+    """
+    def __init__(self, connection, errors, separator, null):
+        self.connection = connection
+        self.errors = errors
+        self.separator = separator
+        self.null = null
+
+
+    def query_many(self, queries, env_extra=None):
+        """Run 'queries', return a list of results or None if any failed."""
+        # pylint: disable=unused-argument
+        results = []
+        try:
+            for query in queries:
+                cursor = self.connection.cursor()
+                try:
+                    cursor.execute(query)
+                    rows = cursor.fetchall() if cursor.description else []
+                finally:
+                    cursor.close()
+
+                results.append([
+                    self.separator.join(
+                        self.null if value is None else str(value) for value in row)
+                    for row in rows
+                ])
+        except self.errors as e:
+            logger.fatal("%s", e)
+            return None
+
+        return results
+
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
@@ -0,0 +1,209 @@
+"""
+Helper class to stream the backup straight into its final tar archive.
+
+Dumps are written to the archive as they are produced, without staging
+them on disk. Since a tar member must declare its size upfront, a dump is
+split in parts of at most `PART_SIZE` bytes, each part is a member named
+'<name>.partNNNN'. Parts of the same dump are in order in the archive so
+that extracting them to stdout rebuilds the dump, i.e.:
+
+    tar -xOf archive.tar.gz --wildcards '*/zabbix_dump.pgdump.part*'
+
+Streamed dumps and files, and the archive itself, are hashed as they are
+written (see `digests.py`).
+"""
+import io
+import os
+import time
+import hashlib
+import logging
+import tarfile
+import threading
+from os import environ
+from pathlib import Path
+from subprocess import PIPE
+
+from .utils import DPopen, build_compress_command, process_repr
+from .compress import ParallelCompressor
+from .digests import BLOCK, HashingWriter
+
+logger = logging.getLogger()
+
+
+PART_SIZE = 16 * 1024 * 1024
+
+
+class TarStream:
+    """
+    A tar archive written as a stream, compressed according to 'profile'
+    with up to 'threads' compression threads (None for every core).
+
+    Members are added under a lock: concurrent dumps can be streamed at the
+    same time (one part at a time). Memory usage is bounded by a part for
+    each dump being streamed.
+
+    'digests' holds the size and digest of every streamed dump and file
+    (by name), 'digest' the one of the archive once closed.
+    """
+    def __init__(self, path, profile, prefix, threads=1):
+        self.path = Path(path)
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.compress = None
+        self.size = 0
+        self.digests = {}
+        self.digest = None
+        self.tee = None
+
+        # pylint: disable-next=consider-using-with
+        self.fh = HashingWriter(open(self.path, "wb"))
+        algo = profile[0]
+        out = self.fh
+
+        if algo != "tar":
+            try:
+                env, _, _, pipe = build_compress_command(
+                    profile, strategy=("parallel", "standard", ), threads=threads)
+            except NotImplementedError:
+                # no compression binary: in-process compression (see `compress.py`)
+                logger.warning("Compression binary not available, using in-process %s", algo)
+                self.compress = ParallelCompressor(self.fh, profile, threads)
+                out = self.compress
+            else:
+                logger.debug("Archive stream compression: \n%s\n", process_repr(pipe, env))
+                self.compress = DPopen(
+                    pipe, env={**environ, **env}, stdin=PIPE, stdout=PIPE)
+                out = self.compress.stdin
+
+                # the compressed output is hashed on its way to the file
+                self.tee = threading.Thread(target=self._tee, daemon=True)
+                self.tee.start()
+
+        self.tar = tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT)
+
+
+    def _tee(self):
+        while data := self.compress.stdout.read(BLOCK):
+            self.fh.write(data)
+
+
+    def _arcname(self, name):
+        return f"{self.prefix}/{name}"
+
+
+    def add_file(self, path, name=None):
+        """Add a file or a directory (recursively) as 'name', regular files are hashed."""
+        name = Path(path).name if name is None else name
+        if not os.path.isfile(path) or os.path.islink(path):
+            with self.lock:
+                self.tar.add(str(path), arcname=self._arcname(name))
+            return
+
+        with open(path, "rb") as fh:
+            reader = _HashingReader(fh)
+            with self.lock:
+                info = self.tar.gettarinfo(str(path), arcname=self._arcname(name))
+                self.tar.addfile(info, reader)
+        self.digests[os.path.normpath(name)] = (reader.size, reader.digest)
+
+
+    def add_stream(self, name, stream):
+        """
+        Read 'stream' until its end and add it as parts of 'name'.
+
+        Return the number of bytes read.
+        """
+        total = 0
+        index = 0
+        digest = hashlib.sha256()
+        while True:
+            data = _read_part(stream, PART_SIZE)
+            digest.update(data)
+            if not data and index > 0:
+                break
+
+            info = tarfile.TarInfo(self._arcname(f"{name}.part{index:04d}"))
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+
+            with self.lock:
+                self.tar.addfile(info, io.BytesIO(data))
+
+            total += len(data)
+            index += 1
+
+            if len(data) < PART_SIZE:
+                break
+
+        self.digests[os.path.normpath(name)] = (total, f"sha256:{digest.hexdigest()}")
+        return total
+
+
+    def close(self):
+        """Finalize the archive, return True on success."""
+        self.tar.close()
+        # uncompressed size of the archive
+        self.size = self.tar.offset
+
+        status = True
+        if isinstance(self.compress, ParallelCompressor):
+            self.compress.close()
+        elif self.compress is not None:
+            self.compress.stdin.close()
+            self.tee.join()
+            self.compress.stdout.close()
+            if self.compress.stderr is not None:
+                self.compress.stderr.close()
+            self.compress.wait()
+            status = self.compress.returncode == 0
+
+        self.fh.close()
+        self.digest = self.fh.digest
+        return status
+
+
+    def abort(self):
+        """Stop writing the archive and remove it."""
+        try:
+            self.close()
+        except (OSError, ValueError, tarfile.TarError) as e:
+            logger.debug("Archive stream aborted: %s", e)
+
+        self.path.unlink(missing_ok=True)
+
+
+class _HashingReader:
+    """Read-only file object hashing the data read from 'fileobj'."""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+
+    @property
+    def digest(self):
+        """Digest of the data read so far, as 'sha256:<hex>'."""
+        return f"sha256:{self.hash.hexdigest()}"
+
+
+    def read(self, size=-1):
+        """Read and hash up to 'size' bytes."""
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+
+def _read_part(stream, size):
+    """Read up to 'size' bytes, less only at the end of 'stream'."""
+    chunks = []
+    missing = size
+    while missing > 0:
+        data = stream.read(missing)
+        if not data:
+            break
+        chunks.append(data)
+        missing -= len(data)
+
+    return b"".join(chunks)
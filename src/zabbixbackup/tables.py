@@ -33,4 +33,22 @@ monitoring = set(
     if spec.data == MONITORING
 )
 
-zabbix = NS(config=config, monitoring=monitoring, tables=all_tables)
+# Monitoring tables with a 'clock' column that can be exported by time ranges
+chunked = set(
+    name
+    for name in monitoring
+    if name.startswith(("history", "trends"))
+)
+
+# Monitoring tables whose rows are only appended by 'clock':
+# they can be exported incrementally from the previous backup
+incremental = chunked.union(
+    name
+    for name in ("events", "alerts", "acknowledges", "auditlog")
+    if name in monitoring
+)
+
+zabbix = NS(
+    config=config, monitoring=monitoring,
+    chunked=chunked, incremental=incremental,
+    tables=all_tables)
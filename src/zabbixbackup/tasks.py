@@ -0,0 +1,142 @@
+"""
+Phases running concurrently with the dump.
+
+The backup runs in the main thread, phase after phase. Independent work
+(saving files, sockets discovery, checksums of older backups) is
+submitted as tasks to a small pool of threads and overlaps with the
+dump. A task starts once the tasks it depends on succeeded and returns
+'(status, message)' like the backups (None is success).
+
+Log records of a task are held back and emitted when it is joined: the
+order of the log ('dump.log') depends on the order of the joins only,
+not on the scheduling of the threads. Failures are reported in the same
+order, the first submitted failed task wins.
+"""
+import time
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+
+TASK_WORKERS = 2
+
+_local = threading.local()
+
+
+class _Capture(logging.Filter):
+    """Hold back the records of the running task (handlers filter)."""
+    def filter(self, record):
+        records = getattr(_local, "records", None)
+        if records is None:
+            return True
+
+        # the same record goes through every handler, captured once
+        if not getattr(record, "task_captured", False):
+            record.task_captured = True
+            records.append(record)
+
+        return False
+
+
+class Task:
+    """A function to run in background after the tasks 'after'."""
+    def __init__(self, name, func, after):
+        self.name = name
+        self.func = func
+        self.after = after
+        self.records = []
+        self.elapsed = 0
+        self.future = None
+        self.joined = False
+
+
+class TaskGraph:
+    """
+    Run tasks on up to 'workers' threads, see `submit` and `join`.
+
+    Phases run in background are timed in 'meter' (see `Progress`), if any.
+    """
+    def __init__(self, workers=TASK_WORKERS, meter=None):
+        self.tasks = {}
+        self.meter = meter
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="task")
+
+        self.capture = _Capture()
+        self.handlers = list(logging.getLogger().handlers)
+        for handler in self.handlers:
+            handler.addFilter(self.capture)
+
+
+    def submit(self, name, func, *args, after=()):
+        """
+        Run 'func(*args)' in background once the tasks 'after' (names)
+        succeeded, return the task.
+
+        Dependencies are submitted first: tasks wait for tasks started
+        before them only, the pool can't deadlock.
+        """
+        task = Task(name, partial(func, *args), [self.tasks[dep] for dep in after])
+        self.tasks[name] = task
+        task.future = self.executor.submit(self._run, task)
+
+        return task
+
+
+    def _run(self, task):
+        for dep in task.after:
+            status, _ = dep.future.result()
+            if status != 0:
+                return status, f"Task {task.name!r} skipped: {dep.name!r} failed"
+
+        _local.records = task.records
+        started = time.monotonic()
+        try:
+            result = task.func()
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.debug("Task %s", task.name, exc_info=True)
+            result = 1, f"Task {task.name!r} failed: {e}"
+        finally:
+            task.elapsed = time.monotonic() - started
+            _local.records = None
+
+        return (0, "+OK") if result is None else result
+
+
+    def join(self, name):
+        """Wait for the task 'name', emit its log records, return its '(status, message)'."""
+        task = self.tasks[name]
+        status, message = task.future.result()
+
+        if not task.joined:
+            task.joined = True
+            for record in task.records:
+                logging.getLogger(record.name).handle(record)
+
+            if status != 0:
+                logger.error(message)
+            if self.meter is not None:
+                self.meter.time_background(task.name, task.elapsed)
+
+        return status, message
+
+
+    def close(self):
+        """
+        Join every task (submission order) and stop the threads.
+
+        Return the '(status, message)' of the first failed task, if any.
+        """
+        result = 0, "+OK"
+        for name in self.tasks:
+            status, message = self.join(name)
+            if status != 0 and result[0] == 0:
+                result = status, message
+
+        self.executor.shutdown()
+        for handler in self.handlers:
+            handler.removeFilter(self.capture)
+
+        return result
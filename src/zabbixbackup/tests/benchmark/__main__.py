@@ -0,0 +1,280 @@
+"""
+End-to-end benchmark of zabbixbackup, offline.
+
+Fake `psql`, `pg_dump`, `mysql` and `mysqldump` (see `fakedb.py`) are put
+first in PATH and every scenario runs the whole command line tool: dump,
+compression, archiving and rotation. For every scenario it reports the
+throughput (MB/s of table data), the peak memory (RSS of the largest
+process: zabbixbackup, dumps or compressors) and the slowest phases.
+
+Results are compared with the baselines in 'baselines.json', regressions
+beyond the tolerance make the benchmark fail. Baselines depend on the
+machine: save them on the reference machine with --save.
+
+    cd src
+    python -m zabbixbackup.tests.benchmark
+    python -m zabbixbackup.tests.benchmark --size 256 --scenario mysql-gzip
+    python -m zabbixbackup.tests.benchmark --save
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+
+from . import fakedb
+
+HERE = Path(__file__).absolute().parent
+SRC = HERE.parents[2]
+BASELINES = HERE / "baselines.json"
+
+ROTATE_ARCHIVES = 2000
+
+# slowdowns shorter than this are noise, whatever the tolerance
+MIN_DELTA = 0.5
+
+# name: (description, command line arguments)
+SCENARIOS = {
+    "mysql-gzip": (
+        "mysqldump, gzip archive",
+        ("mysql", "-M", "dump", "--archive", "gzip")),
+    "mysql-dumpgzip-jobs": (
+        "4 mysqldump workers compressed with gzip, tar archive",
+        ("mysql", "-M", "dump", "--jobs", "4", "--mysqlcompression", "gzip",
+         "--archive", "tar")),
+    "mysql-stream-zstd": (
+        "mysqldump streamed into a zstd archive",
+        ("mysql", "-M", "dump", "--archive", "zstd", "--stream")),
+    "mysql-chunks-xz": (
+        "weekly chunks by 2 workers, xz:1 archive",
+        ("mysql", "-M", "dump", "--chunk", "week", "--jobs", "2", "--archive", "xz:1")),
+    "psql-custom-xz": (
+        "pg_dump custom format, xz:1 archive",
+        ("psql", "-M", "dump", "--archive", "xz:1")),
+    "psql-plain-stream-lz4": (
+        "pg_dump plain format streamed into a lz4 archive",
+        ("psql", "-M", "dump", "--pgformat", "plain", "--archive", "lz4", "--stream")),
+    "psql-directory-jobs": (
+        "pg_dump directory format (compressed by pg_dump) by 4 jobs, tar archive",
+        ("psql", "-M", "dump", "--pgformat", "directory", "--jobs", "4",
+         "--archive", "tar")),
+    "rotate": (
+        f"small dump, rotation of {ROTATE_ARCHIVES} old archives",
+        ("mysql", "--archive", "gzip", "--rotate", "10")),
+}
+
+
+def parse_args(argv):
+    """Benchmark command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m zabbixbackup.tests.benchmark",
+        description="End-to-end benchmark of zabbixbackup with fake database tools.")
+
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS),
+        help="scenario to run (repeatable, default all).")
+    parser.add_argument(
+        "--size", type=int, default=64,
+        help="table data in the fake database, MiB (default 64).")
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="runs per scenario, the best one is reported (default 3).")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="allowed slowdown or memory increase over the baselines (default 0.2).")
+    parser.add_argument(
+        "--save", action="store_true",
+        help=f"save the results as the new baselines ({BASELINES.name}).")
+    parser.add_argument(
+        "--baselines", type=Path, default=BASELINES,
+        help="baselines file.")
+
+    return parser.parse_args(argv)
+
+
+def _prometheus(path):
+    """Samples of a metrics file (see `metrics.py`) as {(name, label): value}."""
+    samples = {}
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if line.startswith("#"):
+            continue
+
+        name_labels, value = line.rsplit(" ", 1)
+        name, _, labels = name_labels.partition("{")
+        # the last label is the specific one (phase, stage...)
+        label = labels.rstrip("}").rsplit(",", 1)[-1].partition("=")[2].strip('"')
+        samples[(name, label)] = float(value)
+
+    return samples
+
+
+def _old_archives(outdir, count):
+    """Create 'count' archives (empty files) of past days in 'outdir'."""
+    now = time.time()
+    for index in range(count):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now - (index + 1) * 3600))
+        (outdir / f"zabbix_bench_{stamp}.tar.gz").touch()
+
+
+def run_scenario(name, env):
+    """Run 'name' once, return its results."""
+    _, cli = SCENARIOS[name]
+
+    workdir = Path(tempfile.mkdtemp(prefix=f"zbxbench-{name}-"))
+    try:
+        outdir = workdir / "out"
+        outdir.mkdir()
+        if name == "rotate":
+            _old_archives(outdir, ROTATE_ARCHIVES)
+
+        metrics = workdir / "bench.prom"
+        cmd = (
+            sys.executable, "-m", "zabbixbackup", *cli,
+            # no server: the native drivers, if installed, must fail
+            "--host", "zbxbench.invalid", "--name", "bench",
+            "--outdir", str(outdir), "--metrics", str(metrics),
+            "--progress", "0", "--quiet",
+        )
+
+        started = time.monotonic()
+        # pylint: disable-next=consider-using-with
+        proc = subprocess.Popen(
+            cmd, env=env, cwd=SRC, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = proc.stderr.read()
+        # resources of the process and of every process it waited for
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = (
+            os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status))
+        proc.stderr.close()
+        wall = time.monotonic() - started
+
+        if proc.returncode != 0:
+            raise RuntimeError(
+                f"{name}: exit status {proc.returncode}\n{stderr.decode(errors='replace')}")
+
+        samples = _prometheus(metrics)
+    finally:
+        shutil.rmtree(workdir)
+
+    phases = dict(
+        (label, seconds) for (metric, label), seconds in samples.items()
+        if metric == "zabbixbackup_phase_duration_seconds")
+    # every table is dumped with '-M dump'
+    data = fakedb.total_size() if "-M" in cli else 0
+
+    return {
+        "wall": round(wall, 3),
+        "mb_s": round(data / wall / 1e6, 2) if data else None,
+        "peak_rss_mib": round(usage.ru_maxrss / 1024, 1),
+        "cpu": round(usage.ru_utime + usage.ru_stime, 3),
+        "archive_mib": round(
+            samples.get(("zabbixbackup_archive_bytes", "compressed"), 0) / 1024 / 1024, 2),
+        "phases": dict((phase, round(seconds, 3)) for phase, seconds in phases.items()),
+    }
+
+
+def compare(name, result, baselines, tolerance):
+    """Return a list of regressions of 'result' against the baseline of 'name'."""
+    baseline = baselines.get(name)
+    if baseline is None:
+        return []
+
+    regressions = []
+    if result["wall"] > max(baseline["wall"] * (1 + tolerance), baseline["wall"] + MIN_DELTA):
+        regressions.append(f"wall {baseline['wall']}s -> {result['wall']}s")
+    if result["peak_rss_mib"] > baseline["peak_rss_mib"] * (1 + tolerance):
+        regressions.append(
+            f"peak rss {baseline['peak_rss_mib']} MiB -> {result['peak_rss_mib']} MiB")
+
+    return regressions
+
+
+def _delta(value, base):
+    if not base or value is None:
+        return ""
+    return f"{100 * (value - base) / base:+.0f}%"
+
+
+def main(argv):
+    """Run the benchmark, return the exit status."""
+    args = parse_args(argv)
+    names = args.scenario or list(SCENARIOS)
+
+    env = {
+        **os.environ,
+        "PATH": f"{HERE / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}",
+        "PYTHONPATH": str(SRC),
+        "ZBXBENCH_SIZE": str(args.size * 1024 * 1024),
+        "ZBXBENCH_CACHE": str(Path(tempfile.gettempdir()) / "zbxbench"),
+    }
+    os.environ.update(env)
+
+    print(f"Generating {args.size} MiB of table data (cached in {env['ZBXBENCH_CACHE']})")
+    # in a process of its own: children peak RSS includes the parent's at fork (Linux)
+    subprocess.run(
+        (sys.executable, "-c", "from zabbixbackup.tests.benchmark import fakedb; "
+         "fakedb.build_cache()"),
+        env=env, cwd=SRC, check=True)
+
+    baselines = {}
+    if args.baselines.exists():
+        saved = json.loads(args.baselines.read_text(encoding="utf-8"))
+        if saved.get("size_mib") == args.size:
+            baselines = saved["scenarios"]
+        else:
+            print(f"Baselines ignored: measured with {saved.get('size_mib')} MiB")
+
+    header = ("scenario", "wall", "MB/s", "peak rss", "archive", "vs baseline", "slowest phase")
+    rows, results, failed = [header], {}, []
+    for name in names:
+        runs = [run_scenario(name, env) for _ in range(max(args.repeat, 1))]
+        result = min(runs, key=lambda run: run["wall"])
+        results[name] = result
+
+        base = baselines.get(name, {})
+        slowest = max(result["phases"].items(), key=lambda item: item[1], default=("-", 0))
+        rows.append((
+            name,
+            f"{result['wall']:.2f}s",
+            "-" if result["mb_s"] is None else f"{result['mb_s']:.1f}",
+            f"{result['peak_rss_mib']:.1f} MiB",
+            f"{result['archive_mib']:.1f} MiB",
+            _delta(result["wall"], base.get("wall")),
+            f"{slowest[0]} {slowest[1]:.2f}s",
+        ))
+        phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in result["phases"].items())
+        print(f"  {name}: {SCENARIOS[name][0]}: {result['wall']:.2f}s ({phases})")
+
+        regressions = compare(name, result, baselines, args.tolerance)
+        if regressions:
+            failed.append((name, regressions))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    print()
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+    for name, regressions in failed:
+        print(f"REGRESSION {name}: {', '.join(regressions)}")
+
+    if args.save:
+        saved = {
+            "size_mib": args.size,
+            "machine": f"{platform.machine()}, {os.cpu_count()} cpu, "
+                       f"python {platform.python_version()}",
+            "scenarios": {**baselines, **results},
+        }
+        args.baselines.write_text(json.dumps(saved, indent=2) + "\n", encoding="utf-8")
+        print(f"Baselines saved: {args.baselines}")
+        return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
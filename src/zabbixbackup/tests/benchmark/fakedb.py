@@ -0,0 +1,474 @@
+"""
+Stand-ins for `psql`, `pg_dump`, `mysql` and `mysqldump` (see `bin/`).
+
+They answer the metadata queries of zabbixbackup and emit Zabbix shaped
+data (history, trends, events and configuration rows) as the real tools
+would: SQL inserts, COPY text, pg_dump custom or directory format.
+
+The volume is set by the environment:
+
+    ZBXBENCH_SIZE   bytes of table data in the whole database (default 16 MiB)
+    ZBXBENCH_SEED   random seed (default 0)
+
+Monitoring rows span the last `SPAN` seconds: time range exports (chunks)
+get their share of the volume.
+"""
+import os
+import re
+import sys
+import gzip
+import time
+import zlib
+import random
+import struct
+import tempfile
+from pathlib import Path
+
+SPAN = 30 * 86400
+
+# table: (share of the volume, columns, row factory (rng, clock) -> values)
+TABLES = {
+    "history": (0.35, ("itemid", "clock", "value", "ns"), lambda rng, clock: (
+        rng.randint(23000, 28000), clock,
+        round(rng.lognormvariate(2, 1.5), 4), rng.randrange(1000000000))),
+    "history_uint": (0.30, ("itemid", "clock", "value", "ns"), lambda rng, clock: (
+        rng.randint(23000, 28000), clock,
+        rng.choice((0, 1, rng.randrange(1 << 32))), rng.randrange(1000000000))),
+    "history_str": (0.05, ("itemid", "clock", "value", "ns"), lambda rng, clock: (
+        rng.randint(23000, 28000), clock,
+        rng.choice(("up", "down", "OK", f"v{rng.randrange(100)}.{rng.randrange(10)}")),
+        rng.randrange(1000000000))),
+    "trends": (0.10, (
+        "itemid", "clock", "num", "value_min", "value_avg", "value_max"),
+        lambda rng, clock: (
+            rng.randint(23000, 28000), clock - clock % 3600, 60,
+            round(rng.uniform(0, 10), 4), round(rng.uniform(10, 20), 4),
+            round(rng.uniform(20, 99), 4))),
+    "trends_uint": (0.08, (
+        "itemid", "clock", "num", "value_min", "value_avg", "value_max"),
+        lambda rng, clock: (
+            rng.randint(23000, 28000), clock - clock % 3600, 60,
+            rng.randrange(100), rng.randrange(100, 1000), rng.randrange(1000, 1 << 20))),
+    "events": (0.04, (
+        "eventid", "source", "object", "objectid", "clock", "value", "acknowledged",
+        "ns", "name", "severity"), lambda rng, clock: (
+            rng.randrange(1 << 40), 0, 0, rng.randint(10000, 30000), clock,
+            rng.randrange(2), 0, rng.randrange(1000000000),
+            f"Load average is too high (per CPU load over {rng.randrange(1, 10)} for 5m)",
+            rng.randrange(6))),
+    "hosts": (0.02, ("hostid", "host", "status", "name", "description"), lambda rng, clock: (
+        rng.randint(10000, 20000), f"srv-{rng.randrange(10000):04d}.example.com",
+        rng.randrange(2), f"Server {rng.randrange(10000):04d}", "")),
+    "items": (0.04, (
+        "itemid", "type", "hostid", "name", "key_", "delay", "history", "trends",
+        "value_type"), lambda rng, clock: (
+            rng.randint(23000, 28000), rng.choice((0, 7, 18)), rng.randint(10000, 20000),
+            "CPU utilization", rng.choice((
+                "system.cpu.util", "vm.memory.size[available]",
+                f"net.if.in[\"eth{rng.randrange(4)}\"]", "system.uptime")),
+            rng.choice(("1m", "5m", "1h")), "31d", "365d", rng.randrange(5))),
+    "triggers": (0.01, ("triggerid", "expression", "description", "priority"),
+        lambda rng, clock: (
+            rng.randint(10000, 30000), f"{{{rng.randrange(100000)}}}>5",
+            "High CPU utilization", rng.randrange(6))),
+    "functions": (0.01, ("functionid", "itemid", "triggerid", "name", "parameter"),
+        lambda rng, clock: (
+            rng.randrange(100000), rng.randint(23000, 28000), rng.randint(10000, 30000),
+            "avg", "$,5m")),
+}
+
+# monitoring tables with a 'clock' column (exported by time ranges)
+CLOCK_TABLES = ("history", "history_uint", "history_str", "trends", "trends_uint", "events")
+
+DBVERSION = "06040010"
+SNAPSHOT = "00000003-0000001B-1"
+
+BATCH = 2048
+
+
+def total_size():
+    """Bytes of table data in the whole database."""
+    return int(os.environ.get("ZBXBENCH_SIZE", 16 * 1024 * 1024))
+
+
+def _seed():
+    return int(os.environ.get("ZBXBENCH_SEED", 0))
+
+
+def table_size(table, start=None, stop=None):
+    """Bytes of 'table' data, only rows with clock in [start, stop) if given."""
+    size = TABLES[table][0] * total_size()
+    fraction = _clock_fraction(start, stop)
+    return int(size * (fraction[1] - fraction[0]))
+
+
+def _clock_fraction(start, stop):
+    """Clock range [start, stop) as a fraction of the data time span."""
+    if start is None:
+        return 0.0, 1.0
+
+    now = int(time.time())
+    lower = min(max((start - now + SPAN) / SPAN, 0.0), 1.0)
+    upper = min(max((stop - now + SPAN) / SPAN, 0.0), 1.0)
+    return lower, max(lower, upper)
+
+
+def table_rows(table, size):
+    """Yield batches of rows of 'table' (by increasing clock) up to about 'size' bytes."""
+    _, _, factory = TABLES[table]
+    rng = random.Random(f"{_seed()}:{table}")
+    begin = int(time.time()) - SPAN
+
+    done = 0
+    while done < size:
+        clock = begin + int(SPAN * done / size)
+        rows = [factory(rng, clock + rng.randrange(60)) for _ in range(BATCH)]
+        # about the text size of the rows
+        done += sum(len(str(row)) for row in rows[:16]) * BATCH // 16
+        yield rows
+
+
+def _sql_value(value):
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    return str(value)
+
+
+def _copy_value(value):
+    if isinstance(value, str):
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+    return str(value)
+
+
+# Generating rows is slow: the data is generated once and cached, one
+# file per table and format, the stand-ins copy it.
+#   copy    COPY text, a row per line
+#   values  SQL values '(...)', a row per line
+#   custom  pg_dump custom format data blocks
+#   gz      gzip compressed COPY text (pg_dump directory format)
+FORMATS = ("copy", "values", "custom", "gz")
+
+
+def cache_dir():
+    """Directory of the generated data ($ZBXBENCH_CACHE)."""
+    return Path(os.environ.get("ZBXBENCH_CACHE", Path(tempfile.gettempdir()) / "zbxbench"))
+
+
+def cache_path(table, fmt):
+    """Path of the generated data of 'table' in 'fmt' format."""
+    return cache_dir() / f"{_seed()}-{total_size()}-{table}.{fmt}"
+
+
+def _pg_custom_member(data):
+    """A compressed data block (length prefixed) as in pg_dump custom format."""
+    block = zlib.compress(data, 6)
+    return struct.pack("<I", len(block)) + block
+
+
+def build_cache(tables=TABLES):
+    """Generate the data of 'tables' in every format (if not cached already)."""
+    cache_dir().mkdir(parents=True, exist_ok=True)
+    for table in tables:
+        if all(cache_path(table, fmt).exists() for fmt in FORMATS):
+            continue
+
+        tmp = dict(
+            (fmt, cache_path(table, fmt).with_name(f"{cache_path(table, fmt).name}.{os.getpid()}.tmp"))
+            for fmt in FORMATS)
+        with open(tmp["copy"], "w", encoding="utf-8") as copy_fh, \
+                open(tmp["values"], "w", encoding="utf-8") as values_fh:
+            for rows in table_rows(table, table_size(table)):
+                copy_fh.write("".join(
+                    "\t".join(_copy_value(value) for value in row) + "\n" for row in rows))
+                values_fh.write("".join(
+                    "(" + ",".join(_sql_value(value) for value in row) + ")\n"
+                    for row in rows))
+
+        data = tmp["copy"].read_bytes()
+        with open(tmp["custom"], "wb") as fh:
+            for offset in range(0, len(data), 1024 * 1024):
+                fh.write(_pg_custom_member(data[offset:offset + 1024 * 1024]))
+        tmp["gz"].write_bytes(gzip.compress(data, 6))
+
+        for fmt, path in tmp.items():
+            os.replace(path, cache_path(table, fmt))
+
+
+def table_data(table, fmt, start=None, stop=None, block=1024 * 1024):
+    """
+    Yield the data of 'table' in 'fmt' format by blocks.
+
+    With a clock range only the matching share of the rows (whole lines).
+    """
+    build_cache([table])
+    path = cache_path(table, fmt)
+    lower, upper = _clock_fraction(start, stop)
+    size = path.stat().st_size
+
+    with open(path, "rb") as fh:
+        begin, end = 0, size
+        if (lower, upper) != (0.0, 1.0):
+            begin, end = (_line_offset(fh, int(size * bound)) for bound in (lower, upper))
+
+        fh.seek(begin)
+        left = end - begin
+        while left > 0:
+            data = fh.read(min(block, left))
+            if not data:
+                break
+            left -= len(data)
+            yield data
+
+
+def _line_offset(fh, offset):
+    """Offset of the first line starting at or after 'offset'."""
+    if offset == 0:
+        return 0
+    fh.seek(offset - 1)
+    fh.readline()
+    return fh.tell()
+
+
+def create_table(table, quote='"'):
+    """A CREATE TABLE statement for 'table'."""
+    columns = ",\n".join(
+        f"  {quote}{column}{quote} bigint NOT NULL" for column in TABLES[table][1])
+    return f"CREATE TABLE {quote}{table}{quote} (\n{columns}\n);\n\n"
+
+
+def _options(argv, with_value):
+    """Split 'argv' in ({option: [values]}, positionals)."""
+    options, positionals = {}, []
+    argv = iter(argv)
+    for arg in argv:
+        if arg.startswith("--"):
+            name, sep, value = arg.partition("=")
+            if not sep and name in with_value:
+                value = next(argv, "")
+            options.setdefault(name, []).append(value)
+        elif arg.startswith("-") and len(arg) == 2 and arg in with_value:
+            options.setdefault(arg, []).append(next(argv, ""))
+        else:
+            positionals.append(arg)
+
+    return options, positionals
+
+
+def _clock_range(where):
+    """Clock range [start, stop) of a 'clock >= A AND clock < B' condition."""
+    match = re.search(r"clock >= (\d+) AND clock < (\d+)", where or "")
+    if match is None:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+
+def _answer(query, separator):
+    """Lines answering a metadata query, None if not known."""
+    if "dbversion" in query:
+        return [DBVERSION]
+
+    if "MIN(clock)" in query:
+        return [str(int(time.time()) - SPAN)]
+
+    if "data_length" in query or "pg_total_relation_size" in query:
+        return [
+            separator.join((table, str(table_size(table) // 40), str(table_size(table))))
+            for table in TABLES
+        ]
+
+    if "table_name" in query:
+        return list(TABLES)
+
+    if "pg_export_snapshot" in query:
+        return [SNAPSHOT]
+
+    if "extract(epoch from now())" in query or "UNIX_TIMESTAMP()" in query:
+        return [str(int(time.time()))]
+
+    # the data is the same on every run: checksums are stable
+    if query.startswith("CHECKSUM TABLE"):
+        return [
+            f"zabbix.{table}{separator}{zlib.crc32(table.encode())}"
+            for table in re.findall(r"`([^`]+)`", query)
+        ]
+
+    if "hashtextextended" in query:
+        table = re.search(r'FROM "[^"]+"\."([^"]+)"', query).group(1)
+        return [f"{table_size(table) // 40}:{zlib.crc32(table.encode())}"]
+
+    return None
+
+
+def mysql_main(argv):
+    """`mysql --batch`: queries from --execute or stdin."""
+    options, _ = _options(argv, ("--execute", "-e", "--host", "--user", "--port", "--socket"))
+
+    queries = options.get("--execute", []) + options.get("-e", [])
+    lines = queries if queries else sys.stdin
+    for query in lines:
+        if "SELECT 'locked'" in query:
+            print("locked")
+        elif "__zabbixbackup_" in query or query.startswith("SELECT '"):
+            print(query.split("'")[1])
+        else:
+            for line in _answer(query, "\t") or ():
+                print(line)
+        sys.stdout.flush()
+
+    return 0
+
+
+def psql_main(argv):
+    """`psql --no-align --tuples-only`: queries from --command or stdin, COPY to stdout."""
+    options, _ = _options(argv, (
+        "--command", "-c", "--host", "--username", "--port", "--dbname", "--set"))
+
+    queries = options.get("--command", []) + options.get("-c", [])
+    lines = queries if queries else sys.stdin
+    for query in lines:
+        query = query.strip()
+        if query.startswith("\\echo"):
+            print(query.split(" ", 1)[1])
+        elif query.startswith("COPY"):
+            table = re.search(r'FROM "[^"]+"\."([^"]+)"', query).group(1)
+            sys.stdout.flush()
+            for data in table_data(table, "copy", *_clock_range(query)):
+                sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            for line in _answer(query, "|") or ():
+                print(line)
+        sys.stdout.flush()
+
+    return 0
+
+
+def mysqldump_main(argv):
+    """`mysqldump`: schema (--no-data) or data as INSERT statements."""
+    options, positionals = _options(argv, (
+        "--host", "--user", "--port", "--socket", "--compression-algorithms",
+        "--ignore-table", "--net-buffer-length", "--where", "--result-file",
+        "--defaults-file"))
+
+    dbname, tables = positionals[0], positionals[1:]
+    ignored = set(name.partition(".")[2] for name in options.get("--ignore-table", []))
+    tables = [table for table in (tables or TABLES) if table not in ignored]
+
+    # pylint: disable-next=consider-using-with
+    out = open(options["--result-file"][0], "wb") if "--result-file" in options else sys.stdout.buffer
+
+    verbose = "--verbose" in options
+    extended = "--skip-extended-insert" not in options
+    buffer_length = int(options.get("--net-buffer-length", [1024 * 1024])[0])
+    start, stop = _clock_range(options.get("--where", [None])[0])
+
+    out.write(
+        f"-- MySQL dump 10.13  Distrib 8.0.36\n-- Host: localhost    Database: {dbname}\n\n"
+        .encode())
+    for table in tables:
+        if verbose:
+            sys.stderr.write(f"-- Retrieving table structure for table {table}...\n")
+            sys.stderr.flush()
+
+        if "--no-data" in options:
+            out.write(create_table(table, "`").encode())
+            continue
+
+        if start is not None and table not in CLOCK_TABLES:
+            continue
+
+        insert = f"INSERT INTO `{table}` VALUES ".encode()
+        out.write(f"LOCK TABLES `{table}` WRITE;\n".encode())
+        for lines in _lines(table_data(table, "values", start, stop)):
+            if not extended:
+                out.write(b"".join(insert + line + b";\n" for line in lines))
+                continue
+
+            # about 'buffer_length' bytes per statement
+            count = max(1, buffer_length * len(lines) // (sum(map(len, lines)) + len(lines)))
+            out.write(b"".join(
+                insert + b",".join(lines[i:i + count]) + b";\n"
+                for i in range(0, len(lines), count)))
+        out.write(b"UNLOCK TABLES;\n\n")
+
+    out.write(b"-- Dump completed\n")
+    out.close()
+    return 0
+
+
+def _lines(blocks):
+    """Yield lists of whole lines (without newlines) from 'blocks' of bytes."""
+    carry = b""
+    for block in blocks:
+        lines = (carry + block).split(b"\n")
+        carry = lines.pop()
+        if lines:
+            yield lines
+
+    if carry:
+        yield [carry]
+
+
+def _pg_tables(options):
+    """Tables dumped with and without data by pg_dump 'options'."""
+    def _excluded(option):
+        patterns = [re.compile(pattern) for pattern in options.get(option, [])]
+        return set(
+            table for table in TABLES
+            if any(pattern.fullmatch(table) for pattern in patterns))
+
+    excluded = _excluded("--exclude-table")
+    nodata = _excluded("--exclude-table-data")
+    tables = [table for table in TABLES if table not in excluded]
+    return tables, [table for table in tables if table not in nodata]
+
+
+def pg_dump_main(argv):
+    """`pg_dump`: plain, custom or directory format."""
+    options, _ = _options(argv, (
+        "--host", "--username", "--port", "--dbname", "--schema", "--format",
+        "--compress", "--file", "--jobs", "--snapshot", "--exclude-table",
+        "--exclude-table-data"))
+
+    fmt = options.get("--format", ["plain"])[0]
+    path = options.get("--file", [None])[0]
+    verbose = "--verbose" in options
+    tables, data_tables = _pg_tables(options)
+
+    def _finished(index, table):
+        if verbose:
+            sys.stderr.write(f"pg_dump: finished item {index} TABLE DATA {table}\n")
+            sys.stderr.flush()
+
+    if fmt == "directory":
+        os.makedirs(path)
+        with open(os.path.join(path, "toc.dat"), "wb") as fh:
+            fh.write(b"PGDMP" + "".join(map(create_table, tables)).encode())
+        for index, table in enumerate(data_tables):
+            with open(os.path.join(path, f"{index + 3000}.dat.gz"), "wb") as fh:
+                for data in table_data(table, "gz"):
+                    fh.write(data)
+            _finished(index, table)
+        return 0
+
+    # pylint: disable-next=consider-using-with
+    out = sys.stdout.buffer if path is None else open(path, "wb")
+
+    if fmt == "custom":
+        out.write(b"PGDMP\x01\x0e\x00\x04\x08\x01\x01")
+        out.write(_pg_custom_member("".join(map(create_table, tables)).encode()))
+        for index, table in enumerate(data_tables):
+            for data in table_data(table, "custom"):
+                out.write(data)
+            _finished(index, table)
+    else:
+        out.write("".join(map(create_table, tables)).encode())
+        for index, table in enumerate(data_tables):
+            out.write(f"COPY public.{table} FROM stdin;\n".encode())
+            for data in table_data(table, "copy"):
+                out.write(data)
+            out.write(b"\\.\n\n")
+            _finished(index, table)
+
+    out.close()
+    return 0
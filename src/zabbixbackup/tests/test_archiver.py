@@ -1,8 +1,61 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
 # pylint: disable=unused-import
+import os
 import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from types import SimpleNamespace as NS
+from unittest import mock
+import logging
+from .. import console_logger
+from .. import archiver as archiver_module
+from ..archiver import archive
+from ..progress import Progress
 
 
-class TestDummy(unittest.TestCase):
-    def test_dummy(self):
-        self.assertEqual(True, True)
+console_logger.setLevel(logging.ERROR)
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.cwd = Path(".").absolute()
+        self.outdir = Path(mkdtemp())
+        self.backup = self.outdir / "zabbix_host_20240101-000000"
+        self.backup.mkdir()
+        (self.backup / "dump.log").write_text("log\n")
+        os.chdir(self.outdir)
+        return super().setUp()
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        rmtree(self.outdir)
+        return super().tearDown()
+
+
+    def _args(self):
+        return NS(repository=False, scope={
+            "archive": ("gzip", "1", ()), "threads": None, "progress": Progress(0)})
+
+
+    def test_archive(self):
+        args = self._args()
+        status, path = archive(self.backup, args)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(path, self.outdir / f"{self.backup.name}.tar.gz")
+        self.assertFalse(self.backup.exists())
+        self.assertEqual(args.scope["archive_size"][1], path.stat().st_size)
+
+
+    def test_archive_failure(self):
+        failing = ({}, ".tar.gz", ("sh", "-c", "echo partial; exit 2", "--"))
+        with mock.patch.object(archiver_module, "build_tar_command", return_value=failing):
+            with self.assertLogs(level=logging.ERROR):
+                status, path = archive(self.backup, self._args())
+
+        # the backup folder is left, the partial archive removed
+        self.assertNotEqual(status, 0)
+        self.assertEqual(path, self.backup)
+        self.assertListEqual(sorted(p.name for p in self.outdir.iterdir()), [self.backup.name])
@@ -1,3 +1,36 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
 # pylint: disable=unused-import
+import sys
 import unittest
+import logging
+from subprocess import PIPE, Popen
+from .. import console_logger
+from ..backup_postgre import _pg_dump_progress
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+def _fake_pg_dump(lines, status):
+    script = f"import sys\nsys.stderr.write({''.join(lines)!r})\nsys.exit({status})\n"
+    return Popen([sys.executable, "-c", script], stderr=PIPE, text=True)
+
+
+class TestPgDumpProgress(unittest.TestCase):
+    def test_errors(self):
+        lines = [
+            "pg_dump: finished item 3 TABLE DATA hosts\n",
+            "pg_dump: dumping contents of table public.items\n",
+            "pg_dump: warning: could not find where to insert IF EXISTS\n",
+        ]
+
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            _pg_dump_progress(_fake_pg_dump(lines, 0))
+        self.assertListEqual([record.levelno for record in logs.records], [
+            logging.INFO, logging.ERROR, logging.DEBUG])
+
+        # pg_dump failed: everything but the progress is an error
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            _pg_dump_progress(_fake_pg_dump(lines, 1))
+        self.assertListEqual([record.levelno for record in logs.records], [
+            logging.INFO, logging.ERROR, logging.ERROR])
@@ -0,0 +1,70 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import os
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest import mock
+import logging
+from .. import console_logger
+from ..utils import check_binary
+from .benchmark import fakedb
+from .benchmark.__main__ import HERE, SRC, compare, run_scenario
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.cache = mkdtemp()
+        self.env = {
+            **os.environ,
+            "PATH": f"{HERE / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}",
+            "PYTHONPATH": str(SRC),
+            "ZBXBENCH_SIZE": str(256 * 1024),
+            "ZBXBENCH_CACHE": self.cache,
+        }
+        return super().setUp()
+
+
+    def tearDown(self):
+        rmtree(self.cache)
+        return super().tearDown()
+
+
+    def test_fakedb_range(self):
+        with mock.patch.dict(os.environ, self.env):
+            whole = b"".join(fakedb.table_data("history", "copy"))
+            half = b"".join(fakedb.table_data(
+                "history", "copy", 0, int(fakedb.time.time()) - fakedb.SPAN // 2))
+
+        self.assertGreater(len(whole), 0.3 * 256 * 1024)
+        self.assertTrue(whole.startswith(half))
+        self.assertTrue(half.endswith(b"\n"))
+        self.assertAlmostEqual(len(half) / len(whole), 0.5, delta=0.05)
+
+
+    @unittest.skipUnless(check_binary("gzip", "tar"), "requires gzip and tar")
+    def test_scenario(self):
+        with mock.patch.dict(os.environ, self.env):
+            result = run_scenario("mysql-gzip", self.env)
+
+        self.assertGreater(result["mb_s"], 0)
+        self.assertGreater(result["archive_mib"], 0)
+        self.assertIn("data_dump", result["phases"])
+
+
+
+    def test_compare(self):
+        baselines = {"scenario": {"wall": 2.0, "peak_rss_mib": 100}}
+
+        def _compare(wall, rss):
+            return compare("scenario", {"wall": wall, "peak_rss_mib": rss}, baselines, 0.2)
+
+        self.assertEqual([], _compare(2.3, 110))
+        # within the noise
+        self.assertEqual([], _compare(2.45, 100))
+        self.assertEqual(1, len(_compare(3.0, 100)))
+        self.assertEqual(2, len(_compare(3.0, 130)))
+        self.assertEqual([], compare("other", {"wall": 9, "peak_rss_mib": 9}, baselines, 0.2))
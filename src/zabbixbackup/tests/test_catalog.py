@@ -0,0 +1,270 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import io
+import os
+import json
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from types import SimpleNamespace as NS
+import logging
+from .. import console_logger
+from ..catalog import (
+    CATALOG, catalog, catalog_table, fill_checksums, read_catalog, record_backup,
+    scan_backups, update_catalog, verify_entry,
+)
+from ..rotation import rotate
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.cwd = Path(".").absolute()
+        self.outdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        rmtree(self.outdir)
+        return super().tearDown()
+
+
+    def _record(self, name, data=b"data", status=0):
+        path = self.outdir / name
+        path.write_bytes(data)
+        args = NS(scope={
+            "dbms": "mysql", "version": "6.4.10",
+            "progress": NS(timings={"dump": {"wall": 1.5}, "archive": {"wall": 0.25}})})
+        record_backup(args, path, status)
+        return path
+
+
+    def test_scan_backups(self):
+        (self.outdir / "zabbix_host_20240102-000000").mkdir()
+        (self.outdir / "zabbix_host_20240101-000000.tar.xz").write_bytes(b"xz")
+        (self.outdir / "zabbix_other_20240103-000000.manifest").touch()
+        (self.outdir / "unrelated.txt").touch()
+
+        entries = scan_backups(self.outdir)
+
+        self.assertListEqual([entry["file"] for entry in entries], [
+            "zabbix_host_20240101-000000.tar.xz",
+            "zabbix_host_20240102-000000",
+            "zabbix_other_20240103-000000.manifest",
+        ])
+        self.assertEqual(entries[0]["name"], "zabbix_host_20240101-000000")
+        self.assertEqual(entries[0]["size"], 2)
+        self.assertIsNone(entries[1]["size"])
+        self.assertEqual(entries[2]["host"], "other")
+        self.assertLess(entries[0]["timestamp"], entries[1]["timestamp"])
+
+
+    def test_record_update(self):
+        self.assertIsNone(read_catalog(self.outdir))
+
+        # an older backup: the catalog is built from the names first
+        (self.outdir / "zabbix_host_20240101-000000.tar.gz").touch()
+        self._record("zabbix_host_20240102-000000.tar.gz")
+
+        entries = read_catalog(self.outdir)
+        self.assertEqual(len(entries), 2)
+        self.assertIsNone(entries[0]["status"])
+        self.assertDictEqual(entries[1], {
+            "name": "zabbix_host_20240102-000000",
+            "host": "host",
+            "file": "zabbix_host_20240102-000000.tar.gz",
+            "timestamp": entries[1]["timestamp"],
+            "dbms": "mysql",
+            "version": "6.4.10",
+            "size": 4,
+            "checksum": "sha256:3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7",
+            "duration": 1.75,
+            "status": 0,
+            "holders": [],
+        })
+
+        # recorded again: replaced
+        self._record("zabbix_host_20240102-000000.tar.gz", b"other")
+        entries = update_catalog(self.outdir, remove=["zabbix_host_20240101-000000.tar.gz"])
+        self.assertListEqual(
+            [(entry["file"], entry["size"]) for entry in entries],
+            [("zabbix_host_20240102-000000.tar.gz", 5)])
+        self.assertListEqual(
+            sorted(path.name for path in self.outdir.iterdir() if path.name.startswith(".z")),
+            [".zabbix_catalog.lock"])
+
+        # one JSON object per line
+        lines = (self.outdir / CATALOG).read_text(encoding="utf-8").splitlines()
+        self.assertEqual(json.loads(lines[0])["file"], "zabbix_host_20240102-000000.tar.gz")
+
+
+    def test_verify(self):
+        path = self._record("zabbix_host_20240101-000000.tar.gz")
+        entry = read_catalog(self.outdir)[0]
+        self.assertListEqual(verify_entry(self.outdir, entry), [])
+
+        path.write_bytes(b"DATA")
+        self.assertListEqual(verify_entry(self.outdir, entry), ["checksum mismatch"])
+
+        path.write_bytes(b"truncated")
+        self.assertListEqual(verify_entry(self.outdir, entry), ["size 9 (expected 4)"])
+
+        path.unlink()
+        self.assertListEqual(verify_entry(self.outdir, entry), ["missing"])
+
+
+    def test_fill_checksums(self):
+        fill_checksums(self.outdir, "host")
+        self.assertIsNone(read_catalog(self.outdir))
+
+        (self.outdir / "zabbix_host_20240101-000000.tar.gz").write_bytes(b"data")
+        (self.outdir / "zabbix_other_20240101-000000.tar.gz").write_bytes(b"data")
+        self._record("zabbix_host_20240102-000000.tar.gz")
+
+        fill_checksums(self.outdir, "host")
+        self.assertListEqual(
+            [entry["checksum"] is not None for entry in read_catalog(self.outdir)],
+            [True, False, True])
+
+
+    def test_catalog(self):
+        with redirect_stdout(io.StringIO()):
+            self._test_catalog()
+
+
+    def _test_catalog(self):
+        args = NS(outdir=self.outdir, name=None, verify=True, rebuild=False)
+        self.assertEqual(catalog(args)[0], 1)
+
+        self._record("zabbix_host_20240101-000000.tar.gz")
+        self._record("zabbix_other_20240101-000000.tar.gz", status=5)
+        self.assertEqual(catalog(args)[0], 0)
+
+        (self.outdir / "zabbix_host_20240101-000000.tar.gz").unlink()
+        status, message = catalog(args)
+        self.assertEqual(status, 2)
+        self.assertIn("zabbix_host_20240101-000000.tar.gz", message)
+
+        args.name = "other"
+        self.assertEqual(catalog(args)[0], 0)
+
+        # details are lost, the missing backup as well
+        args.name, args.rebuild = None, True
+        self.assertEqual(catalog(args)[0], 0)
+        self.assertEqual(len(read_catalog(self.outdir)), 1)
+
+
+    def test_catalog_table(self):
+        self._record("zabbix_host_20240101-000000.tar.gz")
+        entries = read_catalog(self.outdir)
+        table = catalog_table(entries, [["missing"]]).splitlines()
+
+        self.assertEqual(len(table), 2)
+        self.assertTrue(table[0].startswith("backup"))
+        self.assertTrue(table[1].startswith("zabbix_host_20240101-000000.tar.gz  mysql  6.4.10"))
+        self.assertListEqual(table[1].split()[-2:], ["0", "missing"])
+
+
+    def test_rotate_from_catalog(self):
+        for day in (1, 2, 3):
+            self._record(f"zabbix_host_2024010{day}-000000.tar.gz")
+        # not in the catalog: left alone
+        (self.outdir / "zabbix_host_20231231-000000.tar.gz").touch()
+
+        os.chdir(self.outdir)
+        args = NS(
+            host="host", name=None, rotate=1, dry_run=False, repository=False,
+            keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+            background_delete=False, delete_rate=0)
+        self.assertTupleEqual(rotate(args), (1, 2))
+
+        self.assertListEqual(
+            [entry["file"] for entry in read_catalog(self.outdir)],
+            ["zabbix_host_20240103-000000.tar.gz"])
+        self.assertListEqual(sorted(path.name for path in self.outdir.glob("zabbix_host_*")), [
+            "zabbix_host_20231231-000000.tar.gz",
+            "zabbix_host_20240103-000000.tar.gz",
+        ])
+
+
+    def test_rotate_failed_runs(self):
+        self._record("zabbix_host_20240101-000000.tar.gz")
+        # newer failed runs (kept as folders) don't push the good backup out
+        for day in (2, 3):
+            (self.outdir / f"zabbix_host_2024010{day}-000000").mkdir()
+            args = NS(scope={
+                "dbms": "mysql", "version": "6.4.10",
+                "progress": NS(timings={"dump": {"wall": 1.5}})})
+            record_backup(args, self.outdir / f"zabbix_host_2024010{day}-000000", 5)
+
+        os.chdir(self.outdir)
+        args = NS(
+            host="host", name=None, rotate=1, dry_run=False, repository=False,
+            keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+            background_delete=False, delete_rate=0)
+        self.assertTupleEqual(rotate(args), (1, 2))
+
+        self.assertListEqual(
+            [entry["file"] for entry in read_catalog(self.outdir)],
+            ["zabbix_host_20240101-000000.tar.gz"])
+        self.assertListEqual(
+            sorted(path.name for path in self.outdir.glob("zabbix_host_*")),
+            ["zabbix_host_20240101-000000.tar.gz"])
+
+
+    def test_rotate_failed_archive(self):
+        self._record("zabbix_host_20240101-000000.tar.gz")
+        self._record("zabbix_host_20240102-000000.tar.gz")
+        # the dump is complete, only its archive failed: kept as a folder
+        for day, status in ((3, 6), (4, 5)):
+            (self.outdir / f"zabbix_host_2024010{day}-000000").mkdir()
+            args = NS(scope={
+                "dbms": "mysql", "version": "6.4.10",
+                "progress": NS(timings={"dump": {"wall": 1.5}})})
+            record_backup(args, self.outdir / f"zabbix_host_2024010{day}-000000", status)
+
+        os.chdir(self.outdir)
+        args = NS(
+            host="host", name=None, rotate=1, dry_run=False, repository=False,
+            keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+            background_delete=False, delete_rate=0)
+        self.assertTupleEqual(rotate(args), (2, 2))
+
+        self.assertListEqual(
+            sorted(path.name for path in self.outdir.glob("zabbix_host_*")), [
+                "zabbix_host_20240102-000000.tar.gz",
+                "zabbix_host_20240103-000000",
+            ])
+        self.assertListEqual(
+            [entry["file"] for entry in read_catalog(self.outdir)], [
+                "zabbix_host_20240102-000000.tar.gz",
+                "zabbix_host_20240103-000000",
+            ])
+
+
+    def test_rotate_holders(self):
+        # the newest backup refers to the first one, the state doesn't
+        self._record("zabbix_host_20240101-000000.tar.gz")
+        self._record("zabbix_host_20240102-000000.tar.gz")
+        args = NS(scope={
+            "dbms": "mysql", "version": "6.4.10",
+            "progress": NS(timings={"dump": {"wall": 1.5}}),
+            "checksums": {"hosts": ("1", "zabbix_host_20240101-000000")}})
+        path = self.outdir / "zabbix_host_20240103-000000.tar.gz"
+        path.write_bytes(b"data")
+        record_backup(args, path, 0)
+        self.assertListEqual(read_catalog(self.outdir)[-1]["holders"], ["zabbix_host_20240101-000000"])
+
+        os.chdir(self.outdir)
+        args = NS(
+            host="host", name=None, rotate=1, dry_run=False, repository=False,
+            keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+            background_delete=False, delete_rate=0)
+        self.assertTupleEqual(rotate(args), (2, 1))
+        self.assertListEqual([entry["file"] for entry in read_catalog(self.outdir)], [
+            "zabbix_host_20240101-000000.tar.gz", "zabbix_host_20240103-000000.tar.gz"])
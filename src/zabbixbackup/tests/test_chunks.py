@@ -0,0 +1,218 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import os
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+import logging
+from types import SimpleNamespace as NS
+from .. import console_logger
+from ..chunks import (
+    chunk_path, clock_ranges, dump_chunks, largest_first, plan_chunks, plan_table_chunks,
+    commit_watermarks, read_watermarks, save_watermarks,
+)
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestLargestFirst(unittest.TestCase):
+    def test_largest_first(self):
+        chunks = [
+            ("history", 0, 100), ("history", 100, 200),
+            ("history_uint", 0, 100), ("history_uint", 100, 150),
+            ("trends", 0, 100),
+        ]
+        sizes = {"history": 1000, "history_uint": 3000}
+
+        expected = [
+            ("history_uint", 0, 100),   # 2000
+            ("history_uint", 100, 150), # 1000
+            ("history", 0, 100),        # 500
+            ("history", 100, 200),      # 500
+            ("trends", 0, 100),         # unknown
+        ]
+
+        self.assertListEqual(largest_first(chunks, sizes), expected)
+
+
+class TestClockRanges(unittest.TestCase):
+    def test_clock_ranges(self):
+        with self.subTest("aligned"):
+            result = clock_ranges(0, 3 * 86400, 86400)
+            expected = [(0, 86400), (86400, 172800), (172800, 259200)]
+            self.assertListEqual(result, expected)
+
+        with self.subTest("unaligned begin and end"):
+            result = clock_ranges(100, 86400 + 100, 86400)
+            expected = [(0, 86400), (86400, 86500)]
+            self.assertListEqual(result, expected)
+
+        with self.subTest("empty"):
+            self.assertListEqual(clock_ranges(100, 100, 86400), [])
+
+        with self.subTest("single range"):
+            self.assertListEqual(clock_ranges(100, 200, None), [(100, 200)])
+
+
+    def test_plan_chunks(self):
+        begins = {"trends": 3600, "history": 0, "history_str": None}
+        result = plan_chunks(begins, 7200, 3600)
+        expected = [
+            ("history", 0, 3600),
+            ("history", 3600, 7200),
+            ("trends", 3600, 7200),
+        ]
+
+        self.assertListEqual(result, expected)
+
+
+    def test_chunk_path(self):
+        result = chunk_path("history_uint", 86400, ".sql")
+        expected = Path("chunks/history_uint/history_uint_19700102-000000.sql")
+
+        self.assertEqual(result, expected)
+
+
+class TestDumpChunks(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(".").absolute()
+
+        # pylint: disable-next=consider-using-with
+        self.tmp_dir = mkdtemp(prefix="test_chunks_", dir=self.root)
+        self.test_root = Path(self.tmp_dir).absolute()
+        os.chdir(self.test_root)
+
+
+    def tearDown(self):
+        os.chdir(self.root)
+        rmtree(self.test_root)
+        return super().tearDown()
+
+
+    def test_dump_chunks_retry(self):
+        attempts = {}
+
+        # every chunk fails once (leaving a partial file), 'history' always fails
+        def _dump(table, start, _stop, outpath):
+            key = (table, start)
+            attempts[key] = attempts.get(key, 0) + 1
+            outpath.with_name(outpath.name + ".sql").write_text(table)
+            return table != "history" and attempts[key] > 1
+
+        chunks = [("history", 0, 3600), ("trends", 0, 3600), ("trends", 3600, 7200)]
+        failed = dump_chunks(chunks, _dump, jobs=2, retries=2)
+
+        self.assertListEqual(failed, [("history", 0, 3600)])
+        self.assertEqual(attempts[("history", 0)], 3)
+        self.assertEqual(attempts[("trends", 0)], 2)
+
+        self.assertFalse(tuple(Path("chunks/history").iterdir()))
+        self.assertEqual(len(tuple(Path("chunks/trends").iterdir())), 2)
+
+
+class TestWatermarks(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(".").absolute()
+
+        # pylint: disable-next=consider-using-with
+        self.tmp_dir = mkdtemp(prefix="test_watermarks_", dir=self.root)
+        self.test_root = Path(self.tmp_dir).absolute()
+        os.chdir(self.test_root)
+
+
+    def tearDown(self):
+        os.chdir(self.root)
+        rmtree(self.test_root)
+        return super().tearDown()
+
+
+    def _args(self, monitoring="incremental", chunk=None, watermark_lag=0):
+        return NS(
+            name=None, host="127.0.0.1", outdir=self.test_root, dry_run=False,
+            monitoring=monitoring, watermark_lag=watermark_lag, scope={"chunk": chunk})
+
+
+    def test_save_watermarks(self):
+        args = self._args()
+        state_path = self.test_root / "zabbix_127.0.0.1.watermarks"
+
+        save_watermarks(args, {"history": 100, "events": 100})
+        commit_watermarks(args)
+        save_watermarks(args, {"history": 200})
+
+        # the state moves only once committed (the backup is archived)
+        self.assertDictEqual(read_watermarks("watermarks"), {"history": 200})
+        self.assertDictEqual(read_watermarks(state_path), {"history": 100, "events": 100})
+
+        commit_watermarks(args)
+        self.assertDictEqual(read_watermarks(state_path), {"history": 200, "events": 100})
+
+
+    def test_plan_table_chunks(self):
+        def _first_clocks(tables):
+            return dict((table, 3600) for table in tables)
+
+        with self.subTest("first incremental backup"):
+            args = self._args()
+            chunks, watermarks = plan_table_chunks(
+                args, ["events", "history"], _first_clocks, 7200)
+
+            self.assertListEqual(chunks, [("events", 0, 7200), ("history", 0, 7200)])
+            self.assertDictEqual(watermarks, {"events": 7200, "history": 7200})
+
+        with self.subTest("next incremental backup"):
+            save_watermarks(args, watermarks)
+            commit_watermarks(args)
+            chunks, watermarks = plan_table_chunks(
+                args, ["events", "history"], _first_clocks, 9000)
+
+            self.assertListEqual(
+                chunks, [("events", 7200, 9000), ("history", 7200, 9000)])
+            self.assertDictEqual(watermarks, {"events": 9000, "history": 9000})
+
+        with self.subTest("chunks only"):
+            args = self._args(monitoring="dump", chunk=3600)
+            chunks, watermarks = plan_table_chunks(
+                args, ["history"], _first_clocks, 9000)
+
+            self.assertListEqual(
+                chunks, [("history", 3600, 7200), ("history", 7200, 9000)])
+            self.assertDictEqual(watermarks, {})
+
+
+    def test_watermark_lag(self):
+        def _first_clocks(tables):
+            return dict((table, 0) for table in tables)
+
+        def _exported(chunks, table, clock):
+            return any(
+                name == table and start <= clock < stop
+                for name, start, stop in chunks)
+
+        args = self._args(watermark_lag=300)
+        chunks, watermarks = plan_table_chunks(args, ["history"], _first_clocks, 7200)
+
+        self.assertListEqual(chunks, [("history", 0, 6900)])
+        self.assertDictEqual(watermarks, {"history": 6900})
+
+        # a row committed after the backup, with an older clock
+        late = 7000
+        self.assertFalse(_exported(chunks, "history", late))
+
+        save_watermarks(args, watermarks)
+        commit_watermarks(args)
+        chunks, watermarks = plan_table_chunks(args, ["history"], _first_clocks, 9000)
+
+        self.assertListEqual(chunks, [("history", 6900, 8700)])
+        self.assertTrue(_exported(chunks, "history", late))
+
+        with self.subTest("longer lag"):
+            save_watermarks(args, watermarks)
+            commit_watermarks(args)
+            args.watermark_lag = 3600
+            chunks, watermarks = plan_table_chunks(args, ["history"], _first_clocks, 9000)
+
+            self.assertListEqual(chunks, [])
+            self.assertDictEqual(watermarks, {"history": 8700})
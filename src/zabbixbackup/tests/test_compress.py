@@ -0,0 +1,66 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import io
+import os
+import bz2
+import gzip
+import lzma
+import unittest
+from unittest import mock
+import logging
+from .. import console_logger
+from .. import compress as compress_module
+from ..compress import CompressThread, ParallelCompressor, compress_stream
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+DECOMPRESS = {
+    "gzip": gzip.decompress,
+    "bzip2": bz2.decompress,
+    "xz": lzma.decompress,
+}
+
+
+class TestParallelCompressor(unittest.TestCase):
+    def test_multi_member(self):
+        data = os.urandom(1000) * 50
+        block_sizes = {"gzip": 4096, "bzip2": 4096, "xz": 4096}
+
+        for algo, decompress in DECOMPRESS.items():
+            for threads in (1, 3):
+                with self.subTest(f"input: {algo!r}, {threads!r}"), \
+                    mock.patch.dict(compress_module.BLOCK_SIZES, block_sizes):
+                    out = io.BytesIO()
+                    compress_stream(io.BytesIO(data), out, (algo, "1", tuple()), threads)
+
+                    self.assertEqual(decompress(out.getvalue()), data)
+
+
+    def test_empty(self):
+        for algo, decompress in DECOMPRESS.items():
+            with self.subTest(f"input: {algo!r}"):
+                out = io.BytesIO()
+                compressor = ParallelCompressor(out, (algo, "6", tuple()), 2)
+                compressor.close()
+
+                self.assertEqual(decompress(out.getvalue()), b"")
+
+
+    def test_not_available(self):
+        with self.assertRaises(NotImplementedError):
+            ParallelCompressor(io.BytesIO(), ("zstd", "3", tuple()))
+
+
+class TestCompressThread(unittest.TestCase):
+    def test_pipe(self):
+        data = b"zabbix " * 10000
+
+        compress = CompressThread(io.BytesIO(data), None, ("xz", "6", ("--extreme", )))
+        output = compress.stdout.read()
+        compress.communicate()
+        compress.stdout.close()
+
+        self.assertEqual(compress.returncode, 0)
+        self.assertEqual(lzma.decompress(output), data)
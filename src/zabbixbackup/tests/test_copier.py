@@ -0,0 +1,135 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import os
+import stat
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+import logging
+from .. import console_logger
+from ..archiver import FILES_INDEX, copy_files, read_files_index
+from ..copier import copy_trees
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestCopier(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(mkdtemp())
+        self.src = self.tmpdir / "src"
+        self.dst = self.tmpdir / "dst"
+
+        (self.src / "conf.d").mkdir(parents=True)
+        (self.src / "zabbix_server.conf").write_text("DBName=zabbix\n")
+        (self.src / "conf.d" / "custom.conf").write_bytes(b"x" * 100000)
+        (self.src / "script.sh").write_text("#!/bin/sh\n")
+        os.chmod(self.src / "script.sh", 0o750)
+        os.link(self.src / "script.sh", self.src / "script_link.sh")
+        (self.src / "current").symlink_to("conf.d")
+        (self.src / "broken").symlink_to("missing")
+        os.mkfifo(self.src / "fifo")
+        os.utime(self.src / "zabbix_server.conf", ns=(10**18, 10**18))
+        os.chmod(self.src / "conf.d", 0o700)
+        os.utime(self.src / "conf.d", ns=(2 * 10**18, 2 * 10**18))
+        return super().setUp()
+
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def test_copy_trees(self):
+        try:
+            os.setxattr(self.src / "zabbix_server.conf", "user.test", b"value")
+            xattrs = True
+        except OSError:
+            xattrs = False
+
+        files, size, linked, index = copy_trees([(self.src, self.dst)], threads=2)
+        self.assertEqual(files, 4)
+        self.assertEqual(size, 14 + 100000 + 10)
+        self.assertEqual(linked, 0)
+        self.assertListEqual(index, [])
+
+        self.assertEqual(
+            (self.dst / "conf.d" / "custom.conf").read_bytes(), b"x" * 100000)
+        self.assertEqual(os.readlink(self.dst / "current"), "conf.d")
+        self.assertEqual(os.readlink(self.dst / "broken"), "missing")
+        self.assertTrue(stat.S_ISFIFO(os.lstat(self.dst / "fifo").st_mode))
+
+        for name in ("zabbix_server.conf", "script.sh", "conf.d", "current"):
+            with self.subTest(name=name):
+                src, dst = os.lstat(self.src / name), os.lstat(self.dst / name)
+                self.assertEqual(dst.st_mode, src.st_mode)
+                self.assertEqual(dst.st_mtime_ns, src.st_mtime_ns)
+                self.assertEqual((dst.st_uid, dst.st_gid), (src.st_uid, src.st_gid))
+
+        # hard links within the copy are kept
+        self.assertEqual(
+            os.stat(self.dst / "script.sh").st_ino, os.stat(self.dst / "script_link.sh").st_ino)
+
+        if xattrs:
+            self.assertEqual(os.getxattr(self.dst / "zabbix_server.conf", "user.test"), b"value")
+
+
+    def test_copy_trees_errors(self):
+        # a missing source is logged and skipped
+        with self.assertLogs(level=logging.WARNING):
+            files, _, _, _ = copy_trees([
+                (self.tmpdir / "missing", self.dst / "missing"),
+                (self.src / "zabbix_server.conf", self.tmpdir / "zabbix_server.conf")])
+        self.assertEqual(files, 1)
+
+
+    def test_copy_files(self):
+        index = self.tmpdir / "files"
+        index.write_text(
+            f"# comment\n{self.src}/\n{self.src}/conf.d/custom.conf\n{self.tmpdir}/missing\n")
+
+        copy_files(index, self.dst)
+
+        # overlapping entries are merged
+        copied = self.dst / self.src.relative_to("/")
+        self.assertTrue((copied / "zabbix_server.conf").exists())
+        self.assertTrue((copied / "conf.d" / "custom.conf").exists())
+        self.assertFalse((copied / "conf.d" / "conf.d").exists())
+
+
+    def test_incremental(self):
+        first, second = self.tmpdir / "first", self.tmpdir / "second"
+        files, _, linked, index = copy_trees([(self.src, first / "src")], base=first)
+        self.assertEqual((files, linked), (4, 0))
+        self.assertListEqual([entry["path"] for entry in index], [
+            "src/conf.d/custom.conf", "src/script.sh", "src/script_link.sh",
+            "src/zabbix_server.conf",
+        ])
+        self.assertEqual(index[1]["sha256"], index[2]["sha256"])
+
+        # unchanged files are linked, changed ones copied
+        (self.src / "zabbix_server.conf").write_text("DBName=other\n")
+        previous = first, dict((entry["path"], entry) for entry in index)
+        files, size, linked, index = copy_trees(
+            [(self.src, second / "src")], base=second, previous=previous)
+
+        self.assertEqual((files, size, linked), (4, 13, 2))
+        self.assertEqual(
+            os.stat(first / "src" / "conf.d" / "custom.conf").st_ino,
+            os.stat(second / "src" / "conf.d" / "custom.conf").st_ino)
+        self.assertEqual(
+            (second / "src" / "zabbix_server.conf").read_text(), "DBName=other\n")
+        self.assertNotEqual(
+            index[-1]["sha256"], previous[1]["src/zabbix_server.conf"]["sha256"])
+
+
+    def test_copy_files_index(self):
+        index = self.tmpdir / "files"
+        index.write_text(f"{self.src}\n\n")
+
+        copy_files(index, self.tmpdir / "backup" / "host_root", index=True)
+
+        entries = read_files_index(self.tmpdir / "backup" / FILES_INDEX)
+        self.assertEqual(len(entries), 4)
+        self.assertIn(str(self.src.relative_to("/") / "script.sh"), entries)
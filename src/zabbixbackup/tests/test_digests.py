@@ -0,0 +1,110 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import io
+import hashlib
+import tarfile
+import unittest
+from unittest import mock
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+import logging
+from .. import console_logger
+from .. import stream as stream_module
+from ..digests import (
+    ARTIFACTS, HashingWriter, read_artifacts, tee_file, verify_artifacts, write_artifacts,
+)
+from ..stream import PART_SIZE, TarStream
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+def _sha256(data):
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+class TestDigests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def test_inline(self):
+        digests = {}
+        data = b"INSERT INTO history VALUES (1);\n" * 100000
+        path = self.tmpdir / "data_dump.sql"
+        self.assertEqual(tee_file(io.BytesIO(data), path, digests), len(data))
+        self.assertEqual(path.read_bytes(), data)
+
+        # pylint: disable-next=consider-using-with
+        writer = HashingWriter(open(self.tmpdir / "other", "wb"), digests, str(self.tmpdir / "other"))
+        writer.write(b"abc")
+        writer.close()
+
+        self.assertDictEqual(digests, {
+            str(path): (len(data), _sha256(data)),
+            str(self.tmpdir / "other"): (3, _sha256(b"abc")),
+        })
+
+
+    def test_manifest(self):
+        backup = self.tmpdir / "backup"
+        (backup / "root" / "etc").mkdir(parents=True)
+        (backup / "dump.log").write_bytes(b"log\n")
+        (backup / "root" / "etc" / "zabbix.conf").write_bytes(b"DBName=zabbix\n")
+
+        # reused as is: the manifest trusts the inline digests of the same size
+        digests = {"dump.log": (4, "sha256:inline")}
+        streamed = {"data_dump.sql": (10, _sha256(b"0123456789"))}
+        write_artifacts(backup, digests, streamed)
+
+        self.assertDictEqual(read_artifacts(backup / ARTIFACTS), {
+            "dump.log": (4, "sha256:inline"),
+            "root/etc/zabbix.conf": (14, _sha256(b"DBName=zabbix\n")),
+            "data_dump.sql": (10, _sha256(b"0123456789")),
+        })
+
+        # the streamed dump is extracted as parts
+        (backup / "data_dump.sql.part0000").write_bytes(b"01234")
+        (backup / "data_dump.sql.part0001").write_bytes(b"56789")
+        self.assertListEqual(verify_artifacts(backup), ["dump.log: checksum mismatch"])
+
+        (backup / "root" / "etc" / "zabbix.conf").unlink()
+        self.assertIn("root/etc/zabbix.conf: missing", verify_artifacts(backup))
+
+
+    def test_stream(self):
+        data = bytes(range(256)) * (PART_SIZE // 256 + 10)
+        conf = self.tmpdir / "zabbix.conf"
+        conf.write_bytes(b"DBName=zabbix\n")
+
+        for profile, fallback in (
+                (("tar", None, ()), False),
+                (("gzip", "1", ()), False),
+                (("gzip", "1", ()), True)):
+            with self.subTest(profile=profile[0], fallback=fallback):
+                path = self.tmpdir / "archive.tar"
+                with mock.patch.object(
+                    stream_module, "build_compress_command",
+                    side_effect=NotImplementedError if fallback else stream_module.build_compress_command,
+                ):
+                    stream = TarStream(path, profile, "backup")
+                stream.add_stream("data_dump.sql", io.BytesIO(data))
+                stream.add_file(conf)
+                self.assertTrue(stream.close())
+
+                self.assertDictEqual(stream.digests, {
+                    "data_dump.sql": (len(data), _sha256(data)),
+                    "zabbix.conf": (14, _sha256(b"DBName=zabbix\n")),
+                })
+                self.assertEqual(stream.digest, _sha256(path.read_bytes()))
+
+                with tarfile.open(path) as tar:
+                    member = tar.extractfile("backup/zabbix.conf")
+                    self.assertEqual(member.read(), b"DBName=zabbix\n")
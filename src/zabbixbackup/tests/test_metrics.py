@@ -0,0 +1,79 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from types import SimpleNamespace as NS
+import logging
+from .. import console_logger
+from ..metrics import collect_metrics, format_metrics, write_metrics
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def _args(self, **scope):
+        progress = NS(
+            timings={"data dump": {"wall": 1.5}, "archive": {"wall": 0.5}}, stop=lambda: 0)
+        return NS(
+            name=None, host="db.local",
+            scope={"dbms": "psql", "progress": progress, **scope})
+
+
+    def test_format_metrics(self):
+        text = format_metrics([
+            ("metric_a", "A metric.", [({"kind": 'x"y'}, 1)]),
+            ("metric_empty", "Not written.", []),
+        ], {"name": "a\\b"})
+
+        self.assertEqual(
+            '# HELP metric_a A metric.\n'
+            '# TYPE metric_a gauge\n'
+            'metric_a{name="a\\\\b",kind="x\\"y"} 1\n',
+            text)
+
+
+    def test_collect_metrics(self):
+        args = self._args(
+            archive_size=(1000, 250), tables={"config": 3}, rotate=(2, 1))
+        metrics = dict((name, samples) for name, _, samples in collect_metrics(args, 0))
+
+        self.assertEqual(
+            [({"phase": "data_dump"}, 1.5), ({"phase": "archive"}, 0.5)],
+            metrics["zabbixbackup_phase_duration_seconds"])
+        self.assertEqual([({}, 2.0)], metrics["zabbixbackup_duration_seconds"])
+        self.assertEqual([({}, 4.0)], metrics["zabbixbackup_archive_compression_ratio"])
+        self.assertEqual([({"kind": "config"}, 3)], metrics["zabbixbackup_tables"])
+        self.assertEqual(
+            [({"action": "kept"}, 2), ({"action": "removed"}, 1)],
+            metrics["zabbixbackup_rotate_backups"])
+        self.assertEqual([({}, 0)], metrics["zabbixbackup_exit_status"])
+
+
+    def test_write_metrics(self):
+        path = self.tmpdir / "zabbixbackup.prom"
+        path.write_text("old\n")
+
+        write_metrics(self._args(metrics=path), 5)
+
+        text = path.read_text()
+        self.assertIn('zabbixbackup_exit_status{dbms="psql",name="db.local"} 5\n', text)
+        self.assertNotIn("zabbixbackup_archive_bytes", text)
+        self.assertEqual([path], list(self.tmpdir.iterdir()))
+
+
+    def test_write_metrics_disabled(self):
+        write_metrics(self._args(metrics=None), 0)
+        self.assertEqual([], list(self.tmpdir.iterdir()))
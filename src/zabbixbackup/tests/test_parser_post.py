@@ -2,9 +2,19 @@
 # pylint: disable=unused-import
 import unittest
 import logging
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from types import SimpleNamespace as NS
+from unittest import mock
 from .. import console_logger
-from ..parser_post import _handle_archiving, _handle_mysqlcompression, _parse_compression
+from ..parser_defaults import PSqlArgs
+from ..progress import logger as progress_logger
+from ..parser_post import (
+    _handle_archiving, _handle_compressors, _handle_insert_size, _handle_jobs, _handle_link_files,
+    _handle_mysqlcompression, _handle_metrics, _handle_progress, _handle_repository, _handle_restore_jobs,
+    _handle_skip_unchanged, _handle_stream, _handle_threads,
+    _parse_compression, _parse_size,
+)
 
 
 console_logger.setLevel(logging.ERROR)
@@ -30,6 +40,11 @@ class TestParserPost(unittest.TestCase):
             ("xz:7e",   ("xz",    "7", ("--extreme", ))),
             ("bzip2",   ("bzip2", "6", tuple())),
             ("bzip2:1", ("bzip2", "1", tuple())),
+            ("zstd",    ("zstd",  "3", tuple())),
+            ("zstd:19", ("zstd",  "19", tuple())),
+            ("zstd:9l", ("zstd",  "9", ("--long", ))),
+            ("lz4",     ("lz4",   "1", tuple())),
+            ("lz4:12",  ("lz4",   "12", tuple())),
         )
 
         for param, expected in in_out_pairs:
@@ -46,6 +61,12 @@ class TestParserPost(unittest.TestCase):
             "gzip:0",
             "bzip2:0",
             "bzip2:6e",
+            "gzip:10",
+            "zstd:0",
+            "zstd:20",
+            "zstd:09",
+            "lz4:13",
+            "lz4:1l",
             "something",
         )
 
@@ -108,3 +129,287 @@ class TestParserPost(unittest.TestCase):
             _handle_archiving(mock_args)
 
             self.assertEqual(None, mock_args.scope["archive"])
+
+
+    def test__handle_compressors(self):
+        def _args(archive, mysqlcompression=None):
+            return NS(scope={
+                "parser": self.mock_parser, "dbms": "mysql", "threads": 1,
+                "archive": archive, "mysqlcompression": mysqlcompression,
+            }, stream=False)
+
+        zstd = ("zstd", "3", ())
+        gzip = ("gzip", "6", ())
+
+        with mock.patch("shutil.which", return_value=None):
+            # in-process compression (see `compress.py`)
+            _handle_compressors(_args(gzip, ("xz", "6", ())))
+            _handle_compressors(_args(("tar", None, None)))
+            _handle_compressors(_args(None))
+
+            with self.assertRaises(ValueError):
+                _handle_compressors(_args(zstd))
+
+            with self.assertRaises(ValueError):
+                _handle_compressors(_args(gzip, ("lz4", "1", ())))
+
+        with mock.patch("shutil.which", return_value="/usr/bin/zstd"):
+            _handle_compressors(_args(zstd, zstd))
+
+
+    def test__handle_jobs(self):
+        in_out_pairs = (
+            (("1", "custom"),       (1, "custom")),
+            (("4", "directory"),    (4, "directory")),
+            (("4", "custom"),       (4, "directory")),
+            (("auto", "custom"),    (None, "directory")),
+        )
+
+        for (jobs, pgformat), (expected_jobs, expected_format) in in_out_pairs:
+            with self.subTest(f"input: {jobs!r}, {pgformat!r}"):
+                mock_args = NS(
+                    scope={"parser": self.mock_parser, "dbms": "psql"},
+                    jobs=jobs, pgformat=pgformat)
+                mock_user_args = NS(pgformat=None)
+
+                _handle_jobs(mock_args, mock_user_args)
+
+                self.assertEqual(expected_jobs, mock_args.scope["jobs"])
+                self.assertEqual(expected_format, mock_args.pgformat)
+
+
+    def test__handle_jobs_error(self):
+        inputs = (
+            ("0", "directory", None),
+            ("-1", "directory", None),
+            ("many", "directory", None),
+            ("4", "custom", "custom"),
+        )
+
+        for jobs, pgformat, user_pgformat in inputs:
+            with self.subTest(f"input: {jobs!r}, {user_pgformat!r}"), self.assertRaises(ValueError):
+                mock_args = NS(
+                    scope={"parser": self.mock_parser, "dbms": "psql"},
+                    jobs=jobs, pgformat=pgformat)
+                mock_user_args = NS(pgformat=user_pgformat)
+
+                _handle_jobs(mock_args, mock_user_args)
+
+
+    def test__handle_restore_jobs(self):
+        with mock.patch("os.cpu_count", return_value=6):
+            for jobs, expected in (("1", 1), ("8", 8), ("auto", 6)):
+                with self.subTest(f"input: {jobs!r}"):
+                    mock_args = NS(scope={"parser": self.mock_parser}, jobs=jobs)
+                    _handle_restore_jobs(mock_args)
+                    self.assertEqual(expected, mock_args.scope["jobs"])
+
+        for jobs in ("0", "-1", "many"):
+            with self.subTest(f"input: {jobs!r}"), self.assertRaises(ValueError):
+                _handle_restore_jobs(NS(scope={"parser": self.mock_parser}, jobs=jobs))
+
+
+    def test__handle_jobs_mysql(self):
+        # mysql has no dump format to check
+        with self.subTest("input: '4'"):
+            mock_args = NS(scope={"parser": self.mock_parser, "dbms": "mysql"}, jobs="4")
+            mock_user_args = NS()
+
+            _handle_jobs(mock_args, mock_user_args)
+
+            self.assertEqual(4, mock_args.scope["jobs"])
+
+
+    def test__parse_size(self):
+        in_out_pairs = (
+            ("4096",    4096),
+            ("4K",      4096),
+            ("4k",      4096),
+            ("16M",     16 * 1024 * 1024),
+        )
+
+        for param, expected in in_out_pairs:
+            with self.subTest(f"input: {param!r}"):
+                self.assertEqual(expected, _parse_size(self.mock_parser, param))
+
+        for param in ("", "M", "1G", "-1", "1.5M"):
+            with self.subTest(f"input: {param!r}"), self.assertRaises(ValueError):
+                _parse_size(self.mock_parser, param)
+
+
+    def test__handle_insert_size(self):
+        in_out_pairs = (
+            ("-",       None),
+            ("1M",      1024 * 1024),
+            ("4K",      4096),
+        )
+
+        mock_args = NS(scope={"parser": self.mock_parser}, insert_size=None)
+        for param, expected in in_out_pairs:
+            with self.subTest(f"input: {param!r}"):
+                mock_args.insert_size = param
+
+                _handle_insert_size(mock_args)
+
+                self.assertEqual(expected, mock_args.scope["insert_size"])
+
+        for param in ("1K", "17M"):
+            with self.subTest(f"input: {param!r}"), self.assertRaises(ValueError):
+                mock_args.insert_size = param
+                _handle_insert_size(mock_args)
+
+
+    def test__handle_stream(self):
+        gzip = ("gzip", "6", tuple())
+
+        with self.subTest("mysql, compressed archive"):
+            mock_args = NS(
+                scope={"parser": self.mock_parser, "dbms": "mysql", "threads": 1,
+                       "archive": gzip, "mysqlcompression": gzip},
+                stream=True)
+            _handle_stream(mock_args, NS(mysqlcompression=None))
+            self.assertIsNone(mock_args.scope["mysqlcompression"])
+
+        with self.subTest("mysql, explicit mysqlcompression"):
+            mock_args.scope["mysqlcompression"] = gzip
+            _handle_stream(mock_args, NS(mysqlcompression="gzip"))
+            self.assertTupleEqual(gzip, mock_args.scope["mysqlcompression"])
+
+        inputs = (
+            ("mysql", None, "custom"),
+            ("psql", gzip, "directory"),
+        )
+        for dbms, archive, pgformat in inputs:
+            with self.subTest(f"input: {dbms!r}, {archive!r}, {pgformat!r}"), self.assertRaises(ValueError):
+                mock_args = NS(
+                    scope={"parser": self.mock_parser, "dbms": dbms, "archive": archive},
+                    stream=True, pgformat=pgformat)
+                _handle_stream(mock_args, NS(mysqlcompression=None))
+
+        with self.subTest("zstd archive, no binary"), self.assertRaises(ValueError):
+            mock_args = NS(
+                scope={"parser": self.mock_parser, "dbms": "psql", "threads": 1,
+                       "archive": ("zstd", "3", tuple())},
+                stream=True, pgformat="custom")
+            with mock.patch("shutil.which", return_value=None):
+                _handle_stream(mock_args, NS(mysqlcompression=None))
+
+
+    def test__handle_repository(self):
+        gzip = ("gzip", "6", tuple())
+
+        with self.subTest("mysql, uncompressed dumps"):
+            mock_args = NS(
+                scope={"parser": self.mock_parser, "dbms": "mysql",
+                       "archive": gzip, "mysqlcompression": gzip},
+                repository=True, stream=False, archive="gzip")
+            _handle_repository(mock_args, NS(mysqlcompression=None))
+            self.assertTupleEqual(gzip, mock_args.scope["repository"])
+            self.assertIsNone(mock_args.scope["mysqlcompression"])
+
+        with self.subTest("psql, tar archive"):
+            mock_args = NS(
+                scope={"parser": self.mock_parser, "dbms": "psql", "archive": ("tar", None, None)},
+                repository=True, stream=False, archive="tar", pgformat="custom",
+                pgcompression=None)
+            _handle_repository(mock_args, NS(pgcompression=None))
+            self.assertIsNone(mock_args.scope["repository"])
+            self.assertEqual("0", mock_args.pgcompression)
+
+        inputs = (
+            (("zstd", "3", tuple()), False),
+            (gzip, True),
+        )
+        for archive, stream in inputs:
+            with self.subTest(f"input: {archive!r}, {stream!r}"), self.assertRaises(ValueError):
+                mock_args = NS(
+                    scope={"parser": self.mock_parser, "dbms": "mysql", "archive": archive},
+                    repository=True, stream=stream, archive=archive[0])
+                _handle_repository(mock_args, NS(mysqlcompression=None))
+
+
+    def test__handle_skip_unchanged(self):
+        for dbms, pgformat in (("mysql", None), ("psql", "custom"), ("psql", "directory")):
+            with self.subTest(f"input: {dbms!r}, {pgformat!r}"):
+                mock_args = NS(
+                    scope={"parser": self.mock_parser, "dbms": dbms},
+                    skip_unchanged=True, pgformat=pgformat)
+                _handle_skip_unchanged(mock_args)
+
+        with self.assertRaises(ValueError):
+            mock_args = NS(
+                scope={"parser": self.mock_parser, "dbms": "psql"},
+                skip_unchanged=True, pgformat="plain")
+            _handle_skip_unchanged(mock_args)
+
+
+    def test__handle_link_files(self):
+        mock_args = NS(
+            scope={"parser": self.mock_parser, "archive": None},
+            link_files=True, repository=False)
+        _handle_link_files(mock_args)
+
+        for archive, repository in ((("xz", "6", ()), False), (None, True)):
+            with self.subTest(f"input: {archive!r}, {repository!r}"):
+                with self.assertRaises(ValueError):
+                    mock_args = NS(
+                        scope={"parser": self.mock_parser, "archive": archive},
+                        link_files=True, repository=repository)
+                    _handle_link_files(mock_args)
+
+
+    def test__handle_threads(self):
+        in_out_pairs = (
+            ("auto",    None),
+            ("1",       1),
+            ("8",       8),
+        )
+
+        mock_args = NS(scope={"parser": self.mock_parser}, threads=None)
+        for param, expected in in_out_pairs:
+            with self.subTest(f"input: {param!r}"):
+                mock_args.threads = param
+                _handle_threads(mock_args)
+                self.assertEqual(expected, mock_args.scope["threads"])
+
+        for param in ("0", "-1", "all"):
+            with self.subTest(f"input: {param!r}"), self.assertRaises(ValueError):
+                mock_args.threads = param
+                _handle_threads(mock_args)
+
+
+    def test__handle_progress(self):
+        mock_args = NS(scope={"parser": self.mock_parser}, progress=0, verbosity="quiet")
+        _handle_progress(mock_args)
+        self.assertEqual(0, mock_args.scope["progress"].interval)
+
+        # disabled by default: the console output is left as is
+        with mock.patch.object(progress_logger, "handlers", []):
+            mock_args = NS(
+                scope={"parser": self.mock_parser}, progress=PSqlArgs.progress, verbosity="normal")
+            _handle_progress(mock_args)
+            self.assertListEqual(progress_logger.handlers, [])
+
+            mock_args.progress = 60
+            _handle_progress(mock_args)
+            self.assertEqual(len(progress_logger.handlers), 1)
+
+        with self.assertRaises(ValueError):
+            mock_args.progress = -1
+            _handle_progress(mock_args)
+
+
+    def test__handle_metrics(self):
+        mock_args = NS(scope={"parser": self.mock_parser}, metrics=None)
+        _handle_metrics(mock_args)
+        self.assertIsNone(mock_args.scope["metrics"])
+
+        with TemporaryDirectory() as tmpdir:
+            mock_args.metrics = Path(tmpdir) / "zabbixbackup.prom"
+            _handle_metrics(mock_args)
+            self.assertEqual(mock_args.metrics, mock_args.scope["metrics"])
+
+            for param in (Path(tmpdir), Path(tmpdir) / "missing" / "zabbixbackup.prom"):
+                with self.subTest(f"input: {param!r}"), self.assertRaises(ValueError):
+                    mock_args.metrics = param
+                    _handle_metrics(mock_args)
@@ -0,0 +1,155 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import sys
+import json
+import time
+import unittest
+import subprocess
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+import logging
+from unittest import mock
+from .. import console_logger
+from .. import progress as progress_module
+from ..progress import (
+    Progress, disk_usage, human_size, human_time, timings_table, write_timings,
+)
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestProgress(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def test_human(self):
+        self.assertEqual("0.0 B", human_size(0))
+        self.assertEqual("1.5 KiB", human_size(1536))
+        self.assertEqual("2.0 GiB", human_size(2 * 1024 ** 3))
+        self.assertEqual("0:00:59", human_time(59.9))
+        self.assertEqual("1:02:03", human_time(3723))
+
+
+    def test_disk_usage(self):
+        (self.tmpdir / "sub").mkdir()
+        (self.tmpdir / "a").write_bytes(b"x" * 100)
+        (self.tmpdir / "sub" / "b").write_bytes(b"x" * 23)
+        self.assertEqual(123, disk_usage(self.tmpdir))
+
+
+    def test_phase_on_disk(self):
+        meter = Progress(0, self.tmpdir)
+        (self.tmpdir / "before").write_bytes(b"x" * 10)
+
+        with self.assertLogs("zabbixbackup.progress", logging.INFO) as logs:
+            meter.start("dump", 2000)
+            (self.tmpdir / "dump").write_bytes(b"x" * 1000)
+            meter.report()
+            elapsed = meter.stop()
+
+        self.assertIsNone(meter.thread)
+        self.assertGreaterEqual(elapsed, 0)
+        self.assertIn("Progress dump: 1000.0 B", logs.output[0])
+        self.assertIn("(50%, approx)", logs.output[0])
+        self.assertIn("Progress dump: done, 1000.0 B", logs.output[1])
+
+        # not in a phase
+        self.assertEqual(0, meter.stop())
+
+
+    def test_phase_path(self):
+        backup = self.tmpdir / "backup"
+        backup.mkdir()
+        meter = Progress(0, self.tmpdir)
+
+        # only the given directory is metered, not the whole output directory
+        with mock.patch.object(progress_module, "disk_usage", return_value=0) as usage:
+            meter.start("archive", path=backup)
+            meter.stop()
+            meter.start("dump")
+            meter.stop()
+
+        self.assertListEqual(
+            [call.args[0] for call in usage.call_args_list], [backup] * 2 + [self.tmpdir] * 2)
+
+
+    @unittest.skipUnless(Path("/proc/self/io").exists(), "requires /proc/<pid>/io")
+    def test_track(self):
+        meter = Progress(0, self.tmpdir)
+
+        with self.assertLogs("zabbixbackup.progress", logging.INFO) as logs:
+            meter.start("dump")
+            with subprocess.Popen(
+                    (sys.executable, "-c", "import sys, time; print('x' * 4096); "
+                     "sys.stdout.flush(); time.sleep(5)"),
+                    stdout=subprocess.DEVNULL) as proc:
+                meter.track(proc)
+                for _ in range(100):
+                    metered, _ = meter._metered()  # pylint: disable=protected-access
+                    if metered and metered >= 4096:
+                        break
+                    time.sleep(0.05)
+                meter.report()
+                proc.kill()
+            meter.stop()
+
+        self.assertGreaterEqual(metered, 4096)
+        self.assertIn("on disk", logs.output[0])
+
+
+    def test_not_metered(self):
+        meter = Progress(0, self.tmpdir)
+        with self.assertLogs("zabbixbackup.progress", logging.INFO) as logs:
+            meter.start("chunks", metered=False)
+            with subprocess.Popen((sys.executable, "-c", ""), stdout=subprocess.DEVNULL) as proc:
+                meter.track(proc)
+            self.assertEqual({}, meter.procs)
+            meter.stop()
+
+        self.assertEqual(["INFO:zabbixbackup.progress:Progress chunks: done in 0:00:00"], logs.output)
+
+
+    def test_timings(self):
+        meter = Progress(0, self.tmpdir)
+        # (cpu, children cpu, children peak rss) at start and stop
+        usages = iter([
+            (0, 0, 100), (1, 2, 300),
+            (1, 2, 300), (2, 5, 200),
+            (2, 5, 300), (2, 5, 300),
+        ])
+        with self.assertLogs("zabbixbackup.progress", logging.INFO), \
+                mock.patch.object(progress_module, "_rusage", lambda: next(usages)):
+            for _ in range(2):
+                meter.start("dump")
+                meter.stop()
+            meter.start("archive")
+            meter.stop()
+
+        self.assertEqual(["dump", "archive"], list(meter.timings))
+        dump = meter.timings["dump"]
+        self.assertGreaterEqual(dump["wall"], 0)
+        self.assertEqual(
+            (2, 5, 300), (dump["cpu"], dump["children_cpu"], dump["children_peak_rss"]))
+        # the peak did not grow in this phase
+        self.assertIsNone(meter.timings["archive"]["children_peak_rss"])
+
+        table = timings_table(meter.timings).splitlines()
+        self.assertEqual(3, len(table))
+        self.assertTrue(table[0].startswith("phase"))
+        self.assertTrue(table[2].startswith("archive"))
+        self.assertTrue(table[2].endswith(" -"))
+
+        path = self.tmpdir / "timings.json"
+        write_timings(path, meter.timings)
+        summary = json.loads(path.read_text())
+        self.assertEqual(["dump", "archive"], [item["phase"] for item in summary])
+        self.assertIsNone(summary[1]["children_peak_rss"])
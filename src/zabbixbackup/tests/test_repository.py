@@ -0,0 +1,158 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import io
+import os
+import random
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from types import SimpleNamespace as NS
+import logging
+from .. import console_logger
+from ..repository import (
+    MANIFEST, STORE, ChunkStore, collect_garbage, extract_manifest, read_manifest,
+    split_chunks, store_backup,
+)
+from ..rotation import rotate
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+def _rows(count, seed):
+    rnd = random.Random(seed)
+    return b"".join(
+        b"%d\t%d\t%s\n" % (index, rnd.randrange(10**9), b"x" * rnd.randrange(10, 200))
+        for index in range(count))
+
+
+class TestRepository(unittest.TestCase):
+    def setUp(self):
+        self.cwd = Path(".").absolute()
+        self.tmpdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def test_split_chunks(self):
+        data = _rows(20000, 1)
+        chunks = list(split_chunks(io.BytesIO(data), average=16 * 1024, read_size=1024))
+
+        self.assertEqual(b"".join(chunks), data)
+        self.assertTrue(all(len(chunk) <= 128 * 1024 for chunk in chunks))
+        self.assertTrue(all(len(chunk) >= 4 * 1024 for chunk in chunks[:-1]))
+        # boundaries are line ends unless a chunk reaches the maximum size
+        self.assertLessEqual(sum(not chunk.endswith(b"\n") for chunk in chunks), 2)
+        self.assertListEqual(list(split_chunks(io.BytesIO(b""))), [])
+
+
+    def test_split_chunks_shift(self):
+        # an insertion only changes the chunks around it
+        data = _rows(20000, 1)
+        changed = data[:1000] + b"inserted row\n" + data[1000:]
+
+        before = list(split_chunks(io.BytesIO(data), average=16 * 1024))
+        after = list(split_chunks(io.BytesIO(changed), average=16 * 1024))
+
+        self.assertGreater(len(before), 10)
+        self.assertLessEqual(len(set(after) - set(before)), 2)
+
+
+    def test_chunk_store(self):
+        for profile in (None, ("gzip", "1", ()), ("xz", "1", ())):
+            with self.subTest(f"profile: {profile!r}"):
+                store = ChunkStore(self.tmpdir / str(profile and profile[0]), profile)
+                digest, written = store.put(b"data" * 100)
+                self.assertGreater(written, 0)
+                self.assertTupleEqual(store.put(b"data" * 100), (digest, 0))
+                self.assertEqual(store.get(digest), b"data" * 100)
+                self.assertListEqual([item for item, _ in store.chunks()], [digest])
+
+        store = ChunkStore(self.tmpdir / "None")
+        store.find(digest).write_bytes(b"corrupted")
+        with self.assertRaises(ValueError):
+            store.get(digest)
+
+
+    def _backup(self, outdir, name, files):
+        backup = outdir / name
+        backup.mkdir()
+        for path, data in files.items():
+            (backup / path).parent.mkdir(parents=True, exist_ok=True)
+            (backup / path).write_bytes(data)
+        return backup
+
+
+    def test_store_extract(self):
+        outdir = self.tmpdir / "out"
+        outdir.mkdir()
+        files = {
+            "data_dump.sql": _rows(30000, 2),
+            "zabbix_dbversion": b"mysql\n6040000\n",
+            "host_root/etc/zabbix/zabbix_server.conf": b"DBName=zabbix\n",
+        }
+        backup = self._backup(outdir, "zabbix_host_20240101-000000", files)
+        (backup / "host_root" / "link").symlink_to("etc/zabbix")
+        os.chmod(backup / "zabbix_dbversion", 0o600)
+
+        args = NS(scope={"repository": ("gzip", "1", ()), "threads": 2})
+        manifest = store_backup(backup, args)
+
+        self.assertEqual(manifest, outdir / f"zabbix_host_20240101-000000{MANIFEST}")
+        self.assertFalse(backup.exists())
+        size, written = args.scope["archive_size"]
+        self.assertGreater(size, written)
+
+        restored = extract_manifest(manifest, self.tmpdir)
+        for path, data in files.items():
+            self.assertEqual((restored / path).read_bytes(), data)
+        self.assertEqual(os.readlink(restored / "host_root" / "link"), "etc/zabbix")
+        self.assertEqual((restored / "zabbix_dbversion").stat().st_mode & 0o777, 0o600)
+
+        # the next backup writes only what changed
+        _, first_written = args.scope["archive_size"]
+        files["data_dump.sql"] = b"new row\n" + files["data_dump.sql"]
+        backup = self._backup(outdir, "zabbix_host_20240102-000000", files)
+        store_backup(backup, args)
+        _, written = args.scope["archive_size"]
+        self.assertLess(written, first_written / 2)
+
+
+    def test_rotate_collect_garbage(self):
+        outdir = self.tmpdir / "out"
+        outdir.mkdir()
+        args = NS(
+            host="host", name=None, rotate=1, dry_run=False, repository=True,
+            keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+            background_delete=False, delete_rate=0,
+            scope={"repository": None, "threads": 1})
+
+        for day, seed in ((1, 4), (2, 5)):
+            backup = self._backup(
+                outdir, f"zabbix_host_2024010{day}-000000", {"dump.sql": _rows(5000, seed)})
+            store_backup(backup, args)
+
+        store = ChunkStore(outdir / STORE)
+        before = len(list(store.chunks()))
+
+        os.chdir(outdir)
+        self.assertTupleEqual(rotate(args), (1, 1))
+
+        manifests = sorted(path.name for path in outdir.glob(f"*{MANIFEST}"))
+        self.assertListEqual(manifests, [f"zabbix_host_20240102-000000{MANIFEST}"])
+
+        referenced = set(
+            digest for entry in read_manifest(outdir / manifests[0])["files"]
+            for digest, _ in entry.get("chunks", ()))
+        remaining = set(digest for digest, _ in store.chunks())
+        self.assertSetEqual(remaining, referenced)
+        self.assertLess(len(remaining), before)
+
+        # nothing else to collect
+        self.assertEqual(collect_garbage(outdir), 0)
@@ -0,0 +1,333 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import io
+import os
+import gzip
+import unittest
+import tarfile
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from types import SimpleNamespace as NS
+from unittest import mock
+import logging
+from .. import console_logger
+from ..stream import TarStream
+from ..utils import check_binary
+from ..restore import (
+    join_parts, read_dbversion, restore, split_data, split_schema, unpack,
+)
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+SCHEMA = """\
+-- MySQL dump 10.13
+/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;
+/*!40014 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0 */;
+
+--
+-- Table structure for table `hosts`
+--
+
+DROP TABLE IF EXISTS `hosts`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+CREATE TABLE `hosts` (
+  `hostid` bigint unsigned NOT NULL,
+  `host` varchar(128) NOT NULL DEFAULT '',
+  PRIMARY KEY (`hostid`),
+  KEY `hosts_1` (`host`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3 COLLATE=utf8mb3_bin;
+/*!40101 SET character_set_client = @saved_cs_client */;
+CREATE TABLE `items` (
+  `itemid` bigint unsigned NOT NULL,
+  `hostid` bigint unsigned NOT NULL,
+  `key_` varchar(2048) NOT NULL DEFAULT '',
+  PRIMARY KEY (`itemid`),
+  UNIQUE KEY `items_1` (`hostid`,`key_`(764)),
+  CONSTRAINT `c_items_1` FOREIGN KEY (`hostid`) REFERENCES `hosts` (`hostid`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3 COLLATE=utf8mb3_bin;
+/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50003 TRIGGER `items_insert` AFTER INSERT ON `items` FOR EACH ROW
+BEGIN
+  SET @x = 1;
+END */;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+CREATE TABLE `counter` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `value` int NOT NULL,
+  PRIMARY KEY (`value`),
+  KEY `counter_1` (`id`)
+) ENGINE=InnoDB;
+/*!40014 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS */;
+"""
+
+DATA = b"""\
+-- MySQL dump 10.13
+/*!40101 SET NAMES utf8mb4 */;
+/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;
+
+--
+-- Dumping data for table `hosts`
+--
+
+LOCK TABLES `hosts` WRITE;
+/*!40000 ALTER TABLE `hosts` DISABLE KEYS */;
+INSERT INTO `hosts` VALUES (1,'a'),(2,'b');
+/*!40000 ALTER TABLE `hosts` ENABLE KEYS */;
+UNLOCK TABLES;
+LOCK TABLES `items` WRITE;
+INSERT INTO `items` VALUES (1,1,'k');
+UNLOCK TABLES;
+/*!40014 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS */;
+"""
+
+# stand-in for the 'mysql' client: every input in a file of its own
+FAKE_MYSQL = """\
+#!/bin/sh
+cat > "$(mktemp "$ZBXRESTORE_LOG/input.XXXXXX")"
+"""
+
+
+class TestRestore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def test_split_schema(self):
+        tables, indexes, foreign_keys, post = split_schema(io.StringIO(SCHEMA))
+        tables_sql, post_sql = "".join(tables), "".join(post)
+
+        self.assertIn("  PRIMARY KEY (`hostid`)\n) ENGINE=InnoDB", tables_sql)
+        self.assertNotIn("hosts_1", tables_sql)
+        self.assertNotIn("items_1", tables_sql)
+        self.assertNotIn("FOREIGN KEY", tables_sql)
+        self.assertNotIn("TRIGGER", tables_sql)
+        # auto increment columns need their index
+        self.assertIn("KEY `counter_1` (`id`)", tables_sql)
+
+        self.assertDictEqual(indexes, {
+            "hosts": ["KEY `hosts_1` (`host`)"],
+            "items": ["UNIQUE KEY `items_1` (`hostid`,`key_`(764))"],
+        })
+        self.assertDictEqual(foreign_keys, {
+            "items": [
+                "CONSTRAINT `c_items_1` FOREIGN KEY (`hostid`) "
+                "REFERENCES `hosts` (`hostid`) ON DELETE CASCADE"],
+        })
+
+        # session settings first, triggers with their delimiters and settings
+        self.assertTrue(post_sql.startswith("/*!40101 SET @OLD_CHARACTER_SET_CLIENT"))
+        self.assertIn("DELIMITER ;;\n/*!50003 CREATE*/", post_sql)
+        self.assertIn("END */;;\nDELIMITER ;\n/*!50003 SET sql_mode", post_sql)
+
+
+    def test_split_schema_no_routines(self):
+        _, _, _, post = split_schema(io.StringIO(SCHEMA.split("/*!50003")[0]))
+        self.assertListEqual(post, [])
+
+
+    def test_split_data(self):
+        files = split_data(io.BytesIO(DATA), self.tmpdir, "data")
+
+        self.assertListEqual([table for table, _ in files], ["hosts", "items"])
+        hosts = files[0][1].read_bytes()
+        self.assertTrue(hosts.startswith(b"/*!40101 SET NAMES utf8mb4 */;\n"))
+        self.assertIn(b"INSERT INTO `hosts`", hosts)
+        self.assertNotIn(b"INSERT INTO `items`", hosts)
+        self.assertTrue(files[1][1].read_bytes().endswith(b"UNLOCK TABLES;\n"))
+
+
+    def test_split_data_without_locks(self):
+        data = DATA.replace(b"LOCK TABLES `items` WRITE;\n", b"")
+        self.assertIsNone(split_data(io.BytesIO(data), self.tmpdir, "data"))
+        self.assertListEqual(list(self.tmpdir.iterdir()), [])
+
+
+    def test_unpack_join_parts(self):
+        backup = self.tmpdir / "zabbix_host_20240101-000000"
+        backup.mkdir()
+        (backup / "zabbix_dbversion").write_text("mysql\n6040000\n")
+
+        data = bytes(range(256)) * 100
+        archive = self.tmpdir / "zabbix_host_20240101-000000.tar.gz"
+        with mock.patch("zabbixbackup.stream.PART_SIZE", 1000):
+            stream = TarStream(archive, ("gzip", "1", ()), backup.name)
+            stream.add_stream("data_dump.sql", io.BytesIO(data))
+            stream.add_file(backup / "zabbix_dbversion")
+            self.assertTrue(stream.close())
+
+        for fallback in (False, True):
+            with self.subTest(f"python fallback: {fallback}"):
+                workdir = self.tmpdir / f"unpack_{fallback}"
+                workdir.mkdir()
+                with mock.patch(
+                    "zabbixbackup.restore.check_binary",
+                    side_effect=(lambda *_: False) if fallback else check_binary,
+                ):
+                    backup_dir = unpack(archive, workdir)
+
+                self.assertEqual(backup_dir, workdir / backup.name)
+                self.assertListEqual(join_parts(backup_dir), [backup_dir / "data_dump.sql"])
+                self.assertEqual((backup_dir / "data_dump.sql").read_bytes(), data)
+                self.assertListEqual(
+                    sorted(path.name for path in backup_dir.iterdir()),
+                    ["data_dump.sql", "zabbix_dbversion"])
+                self.assertTupleEqual(read_dbversion(backup_dir), ("mysql", "6040000"))
+
+
+    def test_unpack_unknown(self):
+        with self.assertRaises(ValueError):
+            unpack(self.tmpdir / "backup.zip", self.tmpdir)
+
+
+    def test_restore_mysql(self):
+        bindir = self.tmpdir / "bin"
+        bindir.mkdir()
+        (bindir / "mysql").write_text(FAKE_MYSQL)
+        (bindir / "mysql").chmod(0o755)
+        log = self.tmpdir / "log"
+        log.mkdir()
+
+        backup = self.tmpdir / "zabbix_host_20240101-000000"
+        (backup / "chunks" / "history").mkdir(parents=True)
+        (backup / "zabbix_dbversion").write_text("mysql\n6040000\n")
+        (backup / "schemas_dump.sql.gz").write_bytes(gzip.compress(SCHEMA.encode()))
+        (backup / "data_dump.sql").write_bytes(DATA)
+        (backup / "chunks" / "history" / "history_20240101-000000.sql").write_bytes(
+            b"INSERT INTO `history` VALUES (1,2,3,4);\n")
+
+        args = NS(
+            archive=backup, workdir=None, keep=False, dry_run=False,
+            host="127.0.0.1", port=None, sock=None, user="zabbix", passwd=None,
+            loginfile=None, keeploginfile=False, dbname="zabbix",
+            read_mysql_config=False, mysql_config=None,
+            scope={"jobs": 2})
+
+        env = {"PATH": f"{bindir}{os.pathsep}{os.environ['PATH']}", "ZBXRESTORE_LOG": str(log)}
+        with mock.patch.dict(os.environ, env), mock.patch("atexit.register"):
+            status, _ = restore(args)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(args.port, 3306)
+
+        inputs = [path.read_text() for path in log.iterdir()]
+        # schema, 2 tables, 1 chunk, 2 indexes, 1 foreign key, triggers
+        self.assertEqual(len(inputs), 8)
+
+        joined = "".join(inputs)
+        for expected in (
+            "CREATE TABLE `hosts`",
+            "INSERT INTO `hosts`", "INSERT INTO `items`", "INSERT INTO `history`",
+            "ALTER TABLE `hosts`\n  ADD KEY `hosts_1` (`host`);",
+            "SET foreign_key_checks=0;\nALTER TABLE `items`\n  ADD CONSTRAINT `c_items_1`",
+            "TRIGGER `items_insert`",
+        ):
+            self.assertIn(expected, joined)
+
+        # the backup folder is left untouched
+        self.assertTrue((backup / "data_dump.sql").exists())
+        rmtree(next(self.tmpdir.glob("zabbixbackup_restore_*")))
+
+
+    def test_restore_mysql_references(self):
+        bindir = self.tmpdir / "bin"
+        bindir.mkdir()
+        (bindir / "mysql").write_text(FAKE_MYSQL)
+        (bindir / "mysql").chmod(0o755)
+        log = self.tmpdir / "log"
+        log.mkdir()
+
+        # 'hosts' didn't change: its data is in the previous backup only
+        previous = self.tmpdir / "zabbix_host_20240101-000000"
+        previous.mkdir()
+        (previous / "data_dump.sql").write_bytes(DATA.replace(b"(1,1,'k')", b"(0,0,'old')"))
+        with tarfile.open(f"{previous}.tar.gz", "w:gz") as tar:
+            tar.add(previous, previous.name)
+        rmtree(previous)
+
+        backup = self.tmpdir / "zabbix_host_20240102-000000"
+        backup.mkdir()
+        (backup / "zabbix_dbversion").write_text("mysql\n6040000\n")
+        (backup / "schemas_dump.sql").write_text(SCHEMA)
+        (backup / "data_dump.sql").write_bytes(DATA.replace(b"INSERT INTO `hosts`", b"-- "))
+        (backup / "table_checksums").write_text(
+            f"hosts\t1\t{previous.name}\nitems\t2\t{backup.name}\n")
+
+        args = NS(
+            archive=backup, workdir=None, keep=False, dry_run=False,
+            host="127.0.0.1", port=None, sock=None, user="zabbix", passwd=None,
+            loginfile=None, keeploginfile=False, dbname="zabbix",
+            read_mysql_config=False, mysql_config=None,
+            scope={"jobs": 2})
+
+        env = {"PATH": f"{bindir}{os.pathsep}{os.environ['PATH']}", "ZBXRESTORE_LOG": str(log)}
+        with mock.patch.dict(os.environ, env), mock.patch("atexit.register"):
+            status, _ = restore(args)
+
+        self.assertEqual(status, 0)
+
+        joined = "".join(path.read_text() for path in log.iterdir())
+        self.assertEqual(joined.count("INSERT INTO `hosts` VALUES (1,'a'),(2,'b');"), 1)
+        self.assertEqual(joined.count("INSERT INTO `items`"), 1)
+        self.assertIn("INSERT INTO `items` VALUES (1,1,'k');", joined)
+        rmtree(next(self.tmpdir.glob("zabbixbackup_restore_*")))
+
+        # the referenced backup must be next to the restored one
+        Path(f"{previous}.tar.gz").unlink()
+        with mock.patch.dict(os.environ, env), mock.patch("atexit.register"):
+            status, message = restore(args)
+        self.assertEqual(status, 1)
+        self.assertIn(previous.name, message)
+        rmtree(next(self.tmpdir.glob("zabbixbackup_restore_*")))
+
+
+    def test_restore_postgresql(self):
+        bindir = self.tmpdir / "bin"
+        bindir.mkdir()
+        for name in ("psql", "pg_restore"):
+            (bindir / name).write_text(
+                f'#!/bin/sh\n{{ echo {name} "$@"; cat; }} > '
+                '"$(mktemp "$ZBXRESTORE_LOG/input.XXXXXX")"\n')
+            (bindir / name).chmod(0o755)
+        log = self.tmpdir / "log"
+        log.mkdir()
+
+        backup = self.tmpdir / "zabbix_host_20240101-000000"
+        (backup / "chunks" / "trends").mkdir(parents=True)
+        (backup / "zabbix_dbversion").write_text("postgres\n6040000\n")
+        (backup / "zabbix_dump.pgdump").write_bytes(b"PGDMP")
+        (backup / "chunks" / "trends" / "trends_20240101-000000.copy").write_bytes(b"1\t2\n")
+
+        args = NS(
+            archive=backup, workdir=None, keep=False, dry_run=False,
+            host="127.0.0.1", port=None, user="zabbix", passwd=None,
+            loginfile=None, keeploginfile=False, dbname="zabbix", schema="public",
+            scope={"jobs": 4})
+
+        env = {"PATH": f"{bindir}{os.pathsep}{os.environ['PATH']}", "ZBXRESTORE_LOG": str(log)}
+        with mock.patch.dict(os.environ, env), mock.patch("atexit.register"):
+            status, _ = restore(args)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(args.port, 5432)
+
+        inputs = sorted(path.read_text() for path in log.iterdir())
+        self.assertEqual(len(inputs), 4)
+        self.assertIn("--section data --jobs 4", inputs[0])
+        self.assertIn("--section post-data --jobs 4", inputs[1])
+        self.assertIn("--section pre-data", inputs[2])
+        self.assertTrue(inputs[3].startswith("psql "))
+        self.assertIn('COPY "public"."trends" FROM STDIN', inputs[3])
+        self.assertTrue(inputs[3].endswith("1\t2\n"))
+
+        rmtree(next(self.tmpdir.glob("zabbixbackup_restore_*")))
@@ -1,14 +1,16 @@
 # pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
 # pylint: disable=unused-import
 import os
+import tarfile
 import unittest
+from datetime import datetime, timedelta
 from pathlib import Path
 from tempfile import mkdtemp
 from shutil import rmtree
 from types import SimpleNamespace as NS
 import logging
 from .. import console_logger
-from ..rotation import rotate
+from ..rotation import plan_retention, rotate
 
 
 console_logger.setLevel(logging.ERROR)
@@ -42,9 +44,11 @@ class TestRotation(unittest.TestCase):
         (test_bed / "zabbix_127.0.0.1_19700101-000003.tar").touch()
         (test_bed / "zabbix_127.0.0.1_19700101-000004.tar").touch()
 
-        args = NS(host="127.0.0.1", name=None, rotate=0)
+        args = NS(host="127.0.0.1", name=None, rotate=0,
+                  keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+                  background_delete=False, delete_rate=0)
 
-        rotate(args)
+        self.assertIsNone(rotate(args))
 
         items = tuple(testbed.iterdir())
 
@@ -65,9 +69,11 @@ class TestRotation(unittest.TestCase):
         (test_bed / "zabbix_127.0.0.1_19700101-000004.tar").touch()
         (test_bed / "zabbix_127.0.0.2_19700101-000003.tar").touch()
 
-        args = NS(host="127.0.0.1", name=None, rotate=1, dry_run=False)
+        args = NS(host="127.0.0.1", name=None, rotate=1, dry_run=False, repository=False,
+                  keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+                  background_delete=False, delete_rate=0)
 
-        rotate(args)
+        self.assertEqual((1, 3), rotate(args))
 
         items = sorted(map(str, testbed.iterdir()))
 
@@ -93,7 +99,9 @@ class TestRotation(unittest.TestCase):
         (test_bed / "zabbix_127.0.0.1_19700101-000004.tar").touch()
         (test_bed / "zabbix_127.0.0.2_19700101-000003.tar").touch()
 
-        args = NS(host="127.0.0.1", name=None, rotate=3, dry_run=False)
+        args = NS(host="127.0.0.1", name=None, rotate=3, dry_run=False, repository=False,
+                  keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+                  background_delete=False, delete_rate=0)
 
         rotate(args)
 
@@ -122,22 +130,122 @@ class TestRotation(unittest.TestCase):
         (test_bed / "zabbix_127.0.0.1_19700101-000003.tar.gz").touch()
         (test_bed / "zabbix_127.0.0.1_19700101-000004.tar.xz").touch()
         (test_bed / "zabbix_127.0.0.1_19700101-000005.tar.bz2").touch()
+        (test_bed / "zabbix_127.0.0.1_19700101-000006.tar.zst").touch()
+        (test_bed / "zabbix_127.0.0.1_19700101-000007.tar.lz4").touch()
         (test_bed / "zabbix_127.0.0.2_19700101-000005.tar").touch()
 
-        args = NS(host="127.0.0.1", name=None, rotate=1, dry_run=False)
+        args = NS(host="127.0.0.1", name=None, rotate=1, dry_run=False, repository=False,
+                  keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+                  background_delete=False, delete_rate=0)
 
         rotate(args)
 
         items = sorted(map(str, testbed.iterdir()))
 
         expected = [
-            "zabbix_127.0.0.1_19700101-000005.tar.bz2",
+            "zabbix_127.0.0.1_19700101-000007.tar.lz4",
             "zabbix_127.0.0.2_19700101-000005.tar",
         ]
 
         self.assertListEqual(items, expected)
 
 
+    def test_rotate_keep_referenced(self):
+        test_bed = self.test_root / "keep_referenced"
+        test_bed.mkdir()
+
+        os.chdir(test_bed)
+
+        testbed = Path(".")
+
+        (test_bed / "zabbix_127.0.0.1_19700101-000001.tar.gz").touch()
+        (test_bed / "zabbix_127.0.0.1_19700101-000002.tar.gz").touch()
+        (test_bed / "zabbix_127.0.0.1_19700101-000003.tar.gz").touch()
+        (test_bed / "zabbix_127.0.0.1.checksums").write_text(
+            "hosts\t1\tzabbix_127.0.0.1_19700101-000001\n"
+            "items\t2\tzabbix_127.0.0.1_19700101-000003\n")
+
+        args = NS(host="127.0.0.1", name=None, rotate=1, dry_run=False, repository=False,
+                  keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+                  background_delete=False, delete_rate=0)
+
+        self.assertEqual((2, 1), rotate(args))
+
+        items = sorted(map(str, testbed.iterdir()))
+
+        expected = [
+            "zabbix_127.0.0.1.checksums",
+            "zabbix_127.0.0.1_19700101-000001.tar.gz",
+            "zabbix_127.0.0.1_19700101-000003.tar.gz",
+        ]
+
+        self.assertListEqual(items, expected)
+
+
+    def test_rotate_gfs_dry_run(self):
+        test_bed = self.test_root / "gfs"
+        test_bed.mkdir()
+
+        os.chdir(test_bed)
+
+        # a backup every 12 hours for 100 days
+        start = datetime(2024, 1, 1)
+        for index in range(200):
+            stamp = (start + timedelta(hours=12 * index)).strftime("%Y%m%d-%H%M%S")
+            (test_bed / f"zabbix_127.0.0.1_{stamp}.tar.gz").touch()
+
+        args = NS(host="127.0.0.1", name=None, rotate=2, dry_run=True, repository=False,
+                  keep_daily=7, keep_weekly=4, keep_monthly=12, keep_yearly=0,
+                  background_delete=False, delete_rate=0)
+
+        with self.assertLogs(level=logging.INFO) as logs:
+            kept, removed = rotate(args)
+
+        # last 2, 7 days (6 more), 4 weeks and 4 months (2 more each, the others overlap)
+        self.assertEqual(kept, 2 + 6 + 2 + 2)
+        self.assertEqual(kept + removed, 200)
+        self.assertEqual(len(list(test_bed.iterdir())), 200)
+
+        output = "\n".join(logs.output)
+        self.assertIn(
+            "keeping backup 'zabbix_127.0.0.1_20240409-120000.tar.gz': last 1/2, daily 1/7", output)
+        self.assertIn(
+            "keeping backup 'zabbix_127.0.0.1_20240131-120000.tar.gz': monthly 4/12", output)
+        self.assertIn(
+            "deleting backup 'zabbix_127.0.0.1_20240408-000000.tar.gz': not in the last 2, "
+            "daily: 2024-04-08 has a newer backup, weekly: 2024-W15 has a newer backup, "
+            "monthly: 2024-04 has a newer backup", output)
+
+
+class TestRetention(unittest.TestCase):
+    def test_plan_retention(self):
+        timestamps = [
+            datetime(2023, 12, 31, 12),
+            datetime(2024, 1, 1, 0),
+            datetime(2024, 1, 1, 12),
+            datetime(2024, 1, 2, 12),
+        ]
+
+        plan = plan_retention(timestamps, 1, {"daily": 2, "yearly": 2})
+        self.assertListEqual(plan, [
+            (True, ["yearly 2/2 (2023)"]),
+            (False, [
+                "not in the last 1",
+                "daily: 2024-01-01 has a newer backup",
+                "yearly: 2024 has a newer backup"]),
+            (True, ["daily 2/2 (2024-01-01)"]),
+            (True, ["last 1/1", "daily 1/2 (2024-01-02)", "yearly 1/2 (2024)"]),
+        ])
+
+
+    def test_plan_retention_last_only(self):
+        timestamps = [datetime(2024, 1, day) for day in range(1, 5)]
+        plan = plan_retention(timestamps, 2, {"daily": 0})
+
+        self.assertListEqual([keep for keep, _ in plan], [False, False, True, True])
+        self.assertListEqual(plan_retention([], 2, {"weekly": 3}), [])
+
+
 class TestRotationRegex(unittest.TestCase):
     def test_rotate_valid(self):
         self.assertEqual(True, True)
@@ -145,3 +253,54 @@ class TestRotationRegex(unittest.TestCase):
 
     def test_rotate_invalid(self):
         self.assertEqual(True, True)
+
+
+class TestRotationHolders(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(".").absolute()
+        self.outdir = Path(mkdtemp())
+        os.chdir(self.outdir)
+        return super().setUp()
+
+
+    def tearDown(self):
+        os.chdir(self.root)
+        rmtree(self.outdir)
+        return super().tearDown()
+
+
+    def _backup(self, name, references):
+        """An archived backup whose 'table_checksums' refers to 'references' {table: holder}."""
+        (self.outdir / name).mkdir()
+        (self.outdir / name / "table_checksums").write_text("".join(
+            f"{table}\t1\t{holder}\n" for table, holder in references.items()))
+        with tarfile.open(self.outdir / f"{name}.tar.gz", "w:gz") as tar:
+            tar.add(name)
+        rmtree(self.outdir / name)
+
+
+    def test_rotate_gfs_holders(self):
+        # January: 'hosts' data is in the backup of the 1st
+        january = [f"zabbix_host_202401{day:02d}-000000" for day in (1, 2, 31)]
+        self._backup(january[0], {"hosts": january[0]})
+        self._backup(january[1], {"hosts": january[0]})
+        # the monthly backup refers to one no rule keeps, which refers to the 1st
+        self._backup(january[2], {"hosts": january[1]})
+        # 'hosts' changed since: the state refers to the newest backup only
+        newest = "zabbix_host_20240210-000000"
+        self._backup(newest, {"hosts": newest})
+        (self.outdir / "zabbix_host.checksums").write_text(f"hosts\t2\t{newest}\n")
+
+        args = NS(host="host", name=None, rotate=1, dry_run=False, repository=False,
+                  keep_daily=0, keep_weekly=0, keep_monthly=2, keep_yearly=0,
+                  background_delete=False, delete_rate=0)
+
+        self.assertEqual((4, 0), rotate(args))
+        self.assertEqual(len(list(self.outdir.glob("zabbix_host_*.tar.gz"))), 4)
+
+        # a newer monthly backup without holders: the chain is released
+        self._backup("zabbix_host_20240131-120000", {"hosts": newest})
+        self.assertEqual((2, 3), rotate(args))
+        self.assertListEqual(sorted(path.name for path in self.outdir.glob("zabbix_host_*")), [
+            "zabbix_host_20240131-120000.tar.gz", f"{newest}.tar.gz",
+        ])
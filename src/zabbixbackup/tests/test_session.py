@@ -0,0 +1,73 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import sys
+import sqlite3
+import unittest
+import logging
+from os import environ
+from .. import console_logger
+from ..session import ClientSession, DriverSession
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+# A minimal client: 'ECHO <marker>' prints the marker, 'FAIL' exits,
+# anything else is printed back upper case
+CLIENT = """
+import sys
+for line in sys.stdin:
+    line = line.strip().rstrip(";")
+    if line == "FAIL":
+        print("ERROR: syntax error", file=sys.stderr)
+        sys.exit(3)
+    print(line[len("ECHO "):] if line.startswith("ECHO ") else line.upper(), flush=True)
+"""
+
+
+class TestClientSession(unittest.TestCase):
+    def setUp(self):
+        self.session = ClientSession(
+            (sys.executable, "-c", CLIENT), dict(environ), lambda marker: f"ECHO {marker}")
+        return super().setUp()
+
+
+    def tearDown(self):
+        self.session.close()
+        return super().tearDown()
+
+
+    def test_query_many(self):
+        results = self.session.query_many(["select 1;", "select 2"])
+        self.assertListEqual(results, [["SELECT 1"], ["SELECT 2"]])
+
+        # same process for the next batch
+        proc = self.session.proc
+        self.assertListEqual(self.session.query_many(["select 3"]), [["SELECT 3"]])
+        self.assertIs(proc, self.session.proc)
+
+
+    def test_failure_restart(self):
+        with self.assertLogs(level=logging.ERROR) as logs:
+            self.assertIsNone(self.session.query_many(["select 1", "FAIL"]))
+        self.assertIsNone(self.session.proc)
+        self.assertEqual(logs.records[-1].getMessage(), "ERROR: syntax error")
+
+        self.assertListEqual(self.session.query_many(["select 1"]), [["SELECT 1"]])
+
+
+class TestDriverSession(unittest.TestCase):
+    def test_query_many(self):
+        connection = sqlite3.connect(":memory:")
+        session = DriverSession(connection, sqlite3.Error, "|", "")
+
+        results = session.query_many([
+            "CREATE TABLE t (a, b)",
+            "INSERT INTO t VALUES (1, 'x'), (2, NULL)",
+            "SELECT a, b FROM t ORDER BY a",
+        ])
+        self.assertListEqual(results, [[], [], ["1|x", "2|"]])
+
+        with self.assertLogs(level=logging.CRITICAL):
+            self.assertIsNone(session.query_many(["SELECT * FROM missing"]))
+        session.close()
@@ -0,0 +1,96 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import io
+import unittest
+import tarfile
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest import mock
+import logging
+from .. import console_logger
+from .. import stream as stream_module
+from ..stream import TarStream
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestTarStream(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def _members(self, path):
+        with tarfile.open(path, "r:*") as tar:
+            return {
+                member.name: tar.extractfile(member).read()
+                for member in tar.getmembers() if member.isfile()
+            }
+
+
+    def test_add_stream_parts(self):
+        data = bytes(range(256)) * 10
+        path = self.tmpdir / "archive.tar"
+
+        with mock.patch.object(stream_module, "PART_SIZE", 1000):
+            stream = TarStream(path, ("tar", None, ()), "backup")
+            total = stream.add_stream("dump.sql", io.BytesIO(data))
+            self.assertTrue(stream.close())
+
+        self.assertEqual(total, len(data))
+
+        members = self._members(path)
+        self.assertListEqual(
+            sorted(members),
+            [f"backup/dump.sql.part{index:04d}" for index in range(3)])
+        self.assertEqual(b"".join(members[name] for name in sorted(members)), data)
+
+
+    def test_add_stream_empty(self):
+        path = self.tmpdir / "archive.tar"
+
+        stream = TarStream(path, ("tar", None, ()), "backup")
+        stream.add_stream("dump.sql", io.BytesIO(b""))
+        self.assertTrue(stream.close())
+
+        self.assertDictEqual(self._members(path), {"backup/dump.sql.part0000": b""})
+
+
+    def test_compressed(self):
+        staged = self.tmpdir / "dump.log"
+        staged.write_bytes(b"log")
+        path = self.tmpdir / "archive.tar.gz"
+
+        for fallback in (False, True):
+            with self.subTest(f"python fallback: {fallback}"):
+                with mock.patch.object(
+                    stream_module, "build_compress_command",
+                    side_effect=NotImplementedError if fallback else stream_module.build_compress_command,
+                ):
+                    stream = TarStream(path, ("gzip", "1", ()), "backup")
+
+                stream.add_stream("dump.sql", io.BytesIO(b"data"))
+                stream.add_file(staged)
+                self.assertTrue(stream.close())
+
+                self.assertDictEqual(self._members(path), {
+                    "backup/dump.sql.part0000": b"data",
+                    "backup/dump.log": b"log",
+                })
+
+
+    def test_abort(self):
+        path = self.tmpdir / "archive.tar.gz.part"
+
+        stream = TarStream(path, ("gzip", "1", ()), "backup")
+        stream.add_stream("dump.sql", io.BytesIO(b"data"))
+        stream.abort()
+
+        self.assertFalse(path.exists())
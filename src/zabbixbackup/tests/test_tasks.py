@@ -0,0 +1,84 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import time
+import threading
+import unittest
+import logging
+from .. import console_logger
+from ..progress import Progress, run_duration
+from ..tasks import TaskGraph
+
+
+console_logger.setLevel(logging.ERROR)
+
+logger = logging.getLogger()
+
+
+class TestTasks(unittest.TestCase):
+    def test_log_order(self):
+        # 'slow' logs last but is joined first
+        released = threading.Event()
+
+        def slow():
+            released.wait(5)
+            logger.warning("slow")
+
+        def fast():
+            logger.warning("fast")
+            released.set()
+
+        with self.assertLogs(level=logging.WARNING) as logs:
+            tasks = TaskGraph()
+            tasks.submit("slow", slow)
+            tasks.submit("fast", fast)
+            # the main thread logs while tasks run, theirs are held back
+            released.wait(5)
+            logger.warning("main")
+            self.assertTupleEqual(tasks.close(), (0, "+OK"))
+
+        self.assertListEqual(
+            [record.getMessage() for record in logs.records], ["main", "slow", "fast"])
+
+
+    def test_dependencies(self):
+        order = []
+        tasks = TaskGraph(workers=3)
+        tasks.submit("first", lambda: time.sleep(0.05) or order.append("first"))
+        tasks.submit("second", order.append, "second", after=["first"])
+        tasks.close()
+
+        self.assertListEqual(order, ["first", "second"])
+
+
+    def test_failures(self):
+        def fails():
+            raise OSError("disk full")
+
+        tasks = TaskGraph()
+        tasks.submit("ok", lambda: None)
+        tasks.submit("status", lambda: (3, "failed"))
+        tasks.submit("raises", fails)
+        tasks.submit("skipped", lambda: (0, "+OK"), after=["raises"])
+
+        with self.assertLogs(level=logging.ERROR) as logs:
+            self.assertTupleEqual(tasks.join("raises"), (1, "Task 'raises' failed: disk full"))
+            self.assertEqual(tasks.join("skipped")[0], 1)
+            # the first submitted failure, not the first joined
+            self.assertTupleEqual(tasks.close(), (3, "failed"))
+
+        self.assertEqual(len(logs.records), 3)
+
+
+    def test_timings(self):
+        meter = Progress(0)
+        tasks = TaskGraph(meter=meter)
+        tasks.submit("background", time.sleep, 0.05)
+        meter.start("dump")
+        time.sleep(0.05)
+        meter.stop()
+        tasks.close()
+
+        self.assertTrue(meter.timings["background"]["background"])
+        self.assertGreaterEqual(meter.timings["background"]["wall"], 0.05)
+        self.assertIsNone(meter.timings["background"]["cpu"])
+        self.assertAlmostEqual(run_duration(meter.timings), meter.timings["dump"]["wall"])
@@ -0,0 +1,117 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import os
+import time
+import fcntl
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from types import SimpleNamespace as NS
+import logging
+from .. import console_logger
+from ..trash import (
+    REAPER_LOCK, TRASH, empty_trash, move_to_trash, reap, start_reaper, trash_items,
+)
+from ..rotation import rotate
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestTrash(unittest.TestCase):
+    def setUp(self):
+        self.cwd = Path(".").absolute()
+        self.outdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        rmtree(self.outdir)
+        return super().tearDown()
+
+
+    def _backup(self, name, files=10):
+        backup = self.outdir / name
+        (backup / "data").mkdir(parents=True)
+        for index in range(files):
+            (backup / "data" / f"{index}.dat").write_bytes(b"data")
+        return backup
+
+
+    def test_move_empty_trash(self):
+        backup = self._backup("zabbix_host_20240101-000000")
+        archive = self.outdir / "zabbix_host_20240102-000000.tar.gz"
+        archive.touch()
+        # links are deleted, not followed
+        outside = self.outdir / "outside"
+        outside.mkdir()
+        (outside / "keep").touch()
+        (backup / "link").symlink_to(outside)
+
+        for path in (backup, archive):
+            target = move_to_trash(path, self.outdir)
+            self.assertFalse(path.exists())
+            self.assertEqual(target.parent, self.outdir / TRASH)
+            self.assertTrue(target.name.startswith(path.name))
+
+        self.assertEqual(len(trash_items(self.outdir)), 2)
+
+        # 10 files, a link, an archive and 2 folders
+        self.assertEqual(empty_trash(self.outdir, batch=3), 14)
+        self.assertListEqual(trash_items(self.outdir), [])
+        self.assertTrue((outside / "keep").exists())
+
+
+    def test_empty_trash_rate(self):
+        move_to_trash(self._backup("zabbix_host_20240101-000000", files=18), self.outdir)
+
+        start = time.monotonic()
+        self.assertEqual(empty_trash(self.outdir, rate=100, batch=5), 20)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+
+    def test_reap_locked(self):
+        move_to_trash(self._backup("zabbix_host_20240101-000000"), self.outdir)
+
+        with open(self.outdir / TRASH / REAPER_LOCK, "a", encoding="ascii") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            self.assertEqual(reap(self.outdir), 0)
+
+        self.assertEqual(reap(self.outdir), 12)
+        self.assertListEqual(trash_items(self.outdir), [])
+
+
+    def _wait_empty(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while trash_items(self.outdir) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return trash_items(self.outdir)
+
+
+    def test_start_reaper(self):
+        move_to_trash(self._backup("zabbix_host_20240101-000000"), self.outdir)
+
+        reaper = start_reaper(self.outdir)
+        self.assertEqual(reaper.wait(timeout=10), 0)
+        self.assertListEqual(self._wait_empty(), [])
+
+
+    def test_rotate_background_delete(self):
+        for day in (1, 2, 3):
+            self._backup(f"zabbix_host_2024010{day}-000000")
+
+        os.chdir(self.outdir)
+        args = NS(
+            host="host", name=None, rotate=1, dry_run=False, repository=False,
+            keep_daily=0, keep_weekly=0, keep_monthly=0, keep_yearly=0,
+            background_delete=True, delete_rate=0, scope={})
+        self.assertTupleEqual(rotate(args), (1, 2))
+
+        # gone from the output directory as soon as rotated
+        self.assertListEqual(
+            sorted(path.name for path in self.outdir.iterdir()),
+            [TRASH, "zabbix_host_20240103-000000"])
+        self.assertEqual(args.scope["reaper"].wait(timeout=10), 0)
+        self.assertListEqual(self._wait_empty(), [])
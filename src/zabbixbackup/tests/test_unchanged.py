@@ -0,0 +1,113 @@
+# pylint: disable=missing-module-docstring,missing-function-docstring,missing-class-docstring
+# pylint: disable=unused-import
+import os
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from types import SimpleNamespace as NS
+import logging
+from .. import console_logger
+from ..unchanged import (
+    TABLE_CHECKSUMS, checksum_candidates, checksums_path, find_backup, read_checksums,
+    commit_checksums, read_references, referenced_backups, save_checksums, select_unchanged,
+    write_checksums,
+)
+
+
+console_logger.setLevel(logging.ERROR)
+
+
+class TestUnchanged(unittest.TestCase):
+    def setUp(self):
+        self.cwd = Path(".").absolute()
+        self.tmpdir = Path(mkdtemp())
+        return super().setUp()
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        rmtree(self.tmpdir)
+        return super().tearDown()
+
+
+    def _args(self, dry_run=False):
+        return NS(
+            host="host", name=None, outdir=self.tmpdir, dry_run=dry_run,
+            scope={"tables": {}})
+
+
+    def test_read_write_checksums(self):
+        path = self.tmpdir / "checksums"
+        self.assertDictEqual(read_checksums(path), {})
+
+        checksums = {"hosts": ("123", "zabbix_host_20240101-000000"), "items": ("0:0", "b")}
+        write_checksums(path, checksums)
+        self.assertDictEqual(read_checksums(path), checksums)
+        self.assertListEqual(list(self.tmpdir.iterdir()), [path])
+
+
+    def test_checksum_candidates(self):
+        self.assertListEqual(
+            checksum_candidates(["history", "hosts", "items", "unknown"], ["items"]),
+            ["hosts"])
+
+
+    def test_find_backup(self):
+        self.assertIsNone(find_backup(self.tmpdir, "zabbix_host_20240101-000000"))
+
+        for name in ("zabbix_host_20240101-000000", "zabbix_host_20240101-000000.tar.xz",
+                     "zabbix_host_20240101-000000.manifest"):
+            with self.subTest(name=name):
+                (self.tmpdir / name).touch()
+                self.assertEqual(
+                    find_backup(self.tmpdir, "zabbix_host_20240101-000000"), self.tmpdir / name)
+                (self.tmpdir / name).unlink()
+
+
+    def test_select_save_unchanged(self):
+        first, second, third = (
+            f"zabbix_host_2024010{day}-000000" for day in (1, 2, 3))
+
+        # first backup: every table is dumped
+        args = self._args()
+        (self.tmpdir / first).mkdir()
+        os.chdir(self.tmpdir / first)
+        unchanged, references = select_unchanged(args, {"hosts": "1", "items": "2"}, first)
+        self.assertListEqual(unchanged, [])
+        save_checksums(args, references)
+        self.assertTrue(Path(TABLE_CHECKSUMS).exists())
+        # the state is written once the backup is archived
+        self.assertFalse(checksums_path(args).exists())
+        commit_checksums(args)
+        self.assertEqual(checksums_path(args), self.tmpdir / "zabbix_host.checksums")
+
+        # second backup: 'items' changed, 'hosts' data is in the first one
+        (self.tmpdir / second).mkdir()
+        os.chdir(self.tmpdir / second)
+        unchanged, references = select_unchanged(args, {"hosts": "1", "items": "3"}, second)
+        self.assertListEqual(unchanged, ["hosts"])
+        self.assertDictEqual(references, {"hosts": ("1", first), "items": ("3", second)})
+        self.assertEqual(args.scope["tables"]["unchanged"], 1)
+        save_checksums(args, references)
+        commit_checksums(args)
+
+        self.assertDictEqual(read_references(self.tmpdir / second), {first: ["hosts"]})
+        self.assertDictEqual(read_references(self.tmpdir / first), {})
+        self.assertSetEqual(referenced_backups(checksums_path(args)), {first, second})
+
+        # the first backup is gone: 'hosts' is dumped again
+        rmtree(self.tmpdir / first)
+        unchanged, references = select_unchanged(args, {"hosts": "1", "items": "3"}, third)
+        self.assertListEqual(unchanged, ["items"])
+        self.assertDictEqual(references, {"hosts": ("1", third), "items": ("3", second)})
+
+
+    def test_save_checksums_dry_run(self):
+        os.chdir(self.tmpdir)
+        args = self._args(dry_run=True)
+        save_checksums(args, {"hosts": ("1", "a")})
+        commit_checksums(args)
+
+        self.assertTrue(Path(TABLE_CHECKSUMS).exists())
+        self.assertFalse(checksums_path(args).exists())
@@ -2,11 +2,15 @@
 # pylint: disable=unused-import
 import unittest
 import logging
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
 from types import SimpleNamespace as NS
 from . import TZUTC
 from .. import console_logger
 from ..utils import (
-    build_compress_command, build_tar_command, create_name, parse_zabbix_version
+    auto_jobs, build_compress_command, build_tar_command, create_name,
+    parse_table_stats, parse_zabbix_version, partition_tables, write_table_stats,
 )
 
 
@@ -68,6 +72,32 @@ class TestBuildCompress(unittest.TestCase):
         self.assertTupleEqual(result, expected)
 
 
+    def test_compress_parallel_cli(self):
+        in_out_pairs = (
+            (("gzip", None),    ("pigz", "-6", "some_params", )),
+            (("gzip", 4),       ("pigz", "-6", "--processes", "4", "some_params", )),
+            (("bzip2", 4),      ("pbzip2", "-6", "-p4", "some_params", )),
+            (("xz", None),      ("xz", "-6", "-T0", "some_params", )),
+            (("xz", 4),         ("xz", "-6", "-T4", "some_params", )),
+            (("zstd", None),    ("zstd", "-q", "-6", "-T0", "some_params", )),
+            (("lz4", None),     ("lz4", "-q", "-6", "some_params", )),
+        )
+
+        for (algo, threads), expected in in_out_pairs:
+            with self.subTest(f"input: {algo!r}, {threads!r}"):
+                profile = (algo, 6, ("some_params", ))
+                _, _, cmd, pipe = build_compress_command(
+                    profile, check=False, threads=threads)
+
+                self.assertTupleEqual(cmd, expected)
+                self.assertTupleEqual(pipe, expected)
+
+        with self.subTest("single thread"):
+            profile = ("gzip", 6, tuple())
+            _, _, cmd, _ = build_compress_command(profile, check=False, threads=1)
+            self.assertTupleEqual(cmd, ("gzip", "-6", ))
+
+
     def test_compress_not_available_cli(self):
         profile = ("xz", 6, ("some_params", ))
 
@@ -129,6 +159,58 @@ class TestBuildTar(unittest.TestCase):
             self.assertTupleEqual(result, expected)
 
 
+    def test_build_tar_parallel_cli(self):
+        with self.subTest("xz"):
+            profile = ("xz", 6, ("some_params", ))
+            result = build_tar_command(profile, check=False, threads=None)
+
+            expected = (
+                {"XZ_OPT": "-6 -T0 some_params"}, # environment
+                ".tar.xz",                        # extension
+                ("tar", "-cJf", ),                # command
+            )
+
+            self.assertTupleEqual(result, expected)
+
+        with self.subTest("gzip"):
+            profile = ("gzip", 6, tuple())
+            result = build_tar_command(profile, check=False, threads=2)
+
+            expected = (
+                {},                                                            # environment
+                ".tar.gz",                                                     # extension
+                ("tar", "--use-compress-program=pigz -6 --processes 2", "-cf"), # command
+            )
+
+            self.assertTupleEqual(result, expected)
+
+
+    def test_build_tar_zstd_lz4_cli(self):
+        with self.subTest("zstd"):
+            profile = ("zstd", 3, ("--long", ))
+            result = build_tar_command(profile, check=False)
+
+            expected = (
+                {},                                                         # environment
+                ".tar.zst",                                                 # extension
+                ("tar", "--use-compress-program=zstd -q -3 --long", "-cf"), # command
+            )
+
+            self.assertTupleEqual(result, expected)
+
+        with self.subTest("lz4"):
+            profile = ("lz4", 1, tuple())
+            result = build_tar_command(profile, check=False, threads=None)
+
+            expected = (
+                {},                                               # environment
+                ".tar.lz4",                                       # extension
+                ("tar", "--use-compress-program=lz4 -q -1", "-cf"), # command
+            )
+
+            self.assertTupleEqual(result, expected)
+
+
     def test_tar_not_available_cli(self):
         profile = ("xz", 6, ("some_params", ))
 
@@ -170,3 +252,69 @@ class TestCreateName(unittest.TestCase):
             result = create_name(args)
             regex = r"^zabbix_127\.0\.0\.1_[0-9]{8}-[0-9]{6}$"
             self.assertRegex(expected, regex)
+
+
+class TestAutoJobs(unittest.TestCase):
+    def test_auto_jobs(self):
+        in_out_pairs = (
+            (((), 8), 1, ),
+            (((0, 0, 0), 8), 1, ),
+            (((100, 1, 1, 1), 8), 2, ),
+            (((100, 100, 100, 100), 8), 4, ),
+            (((100, 100, 100, 100), 2), 2, ),
+            (((10, ) * 64, 16), 16, ),
+        )
+
+        for (sizes, cpus), expected in in_out_pairs:
+            with self.subTest(f"sizes {sizes!r}, cpus {cpus!r}"):
+                self.assertEqual(auto_jobs(sizes, cpus), expected)
+
+
+class TestPartitionTables(unittest.TestCase):
+    def test_partition_tables(self):
+        sizes = {"history": 100, "history_uint": 80, "trends": 30, "items": 20, "hosts": 1}
+
+        with self.subTest("one bucket"):
+            result = partition_tables(sizes, 1)
+            self.assertListEqual(
+                result, [["history", "history_uint", "trends", "items", "hosts"]])
+
+        with self.subTest("largest first"):
+            result = partition_tables(sizes, 2)
+            self.assertListEqual(
+                result, [["history", "items"], ["history_uint", "trends", "hosts"]])
+
+        with self.subTest("more buckets than tables"):
+            result = partition_tables({"a": 1, "b": 1}, 4)
+            self.assertListEqual(result, [["a"], ["b"]])
+
+
+class TestTableStats(unittest.TestCase):
+    def test_parse_table_stats(self):
+        lines = ["history|1000|65536", "hosts|-1|8192", "items\tNULL\tNULL"]
+
+        result = parse_table_stats(lines[:2], "|")
+        self.assertDictEqual(result, {"history": (1000, 65536), "hosts": (0, 8192)})
+
+        result = parse_table_stats(lines[2:], "\t")
+        self.assertDictEqual(result, {"items": (0, 0)})
+
+
+    def test_write_table_stats(self):
+        tmpdir = Path(mkdtemp())
+        path = tmpdir / "table_stats"
+        stats = {"hosts": (1, 10), "history": (100, 1000), "trends": (5, 50), "x": (0, 0)}
+
+        try:
+            write_table_stats(stats, ["x"], ["trends"], ["history"], path)
+            lines = path.read_text(encoding="utf-8").splitlines()
+        finally:
+            rmtree(tmpdir)
+
+        self.assertListEqual(lines, [
+            "table\trows\tbytes\taction",
+            "history\t100\t1000\tchunked",
+            "trends\t5\t50\tnodata",
+            "hosts\t1\t10\tdump",
+            "x\t0\t0\tignore",
+        ])
@@ -0,0 +1,161 @@
+"""
+Background deletion of rotated backups (see --background-delete).
+
+Removing an uncompressed backup (a directory format dump, saved files)
+means tens of thousands of unlinks, minutes on NFS. Instead, expired
+backups are renamed into the trash of the output directory, an atomic
+and immediate operation:
+
+    OUTDIR/.zabbix_trash/zabbix_host_20240101-000000.<ns>
+
+and a detached reaper process empties it: files are unlinked in batches
+by a few threads (latency bound on network file systems), throttled to
+a number of files per second and with the idle I/O priority where
+`ionice` is available, not to slow down the next backups. A single
+reaper runs at a time (it holds a lock in the trash); leftovers of an
+interrupted reaper are deleted by the next one.
+"""
+import os
+import sys
+import time
+import fcntl
+import shutil
+import logging
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+
+TRASH = ".zabbix_trash"
+REAPER_LOCK = ".reaper.lock"
+
+# files unlinked per batch and threads unlinking them
+BATCH = 256
+DELETE_THREADS = 4
+
+
+def move_to_trash(path, outdir="."):
+    """Rename 'path' into the trash of 'outdir' and return its new path."""
+    trash = Path(outdir) / TRASH
+    trash.mkdir(exist_ok=True)
+
+    target = trash / f"{Path(path).name}.{time.time_ns()}"
+    os.rename(path, target)
+
+    return target
+
+
+def trash_items(outdir="."):
+    """Backups waiting in the trash of 'outdir'."""
+    trash = Path(outdir) / TRASH
+    if not trash.is_dir():
+        return []
+
+    return sorted(item for item in trash.iterdir() if item.name != REAPER_LOCK)
+
+
+def _walk(item):
+    """Files (symlinks included) and directories, children first, of a trash item."""
+    if item.is_symlink() or not item.is_dir():
+        return [item], []
+
+    files, dirs = [], []
+    for root, dirnames, filenames in os.walk(item, topdown=False):
+        root = Path(root)
+        files.extend(root / name for name in filenames)
+        files.extend(root / name for name in dirnames if (root / name).is_symlink())
+        dirs.append(root)
+
+    return files, dirs
+
+
+def _remove(func, path):
+    """Remove 'path' with 'func' (unlink, rmdir), errors are logged only."""
+    try:
+        func(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.debug("Cannot delete %s: %s", path, e)
+
+
+def empty_trash(outdir=".", rate=0, batch=BATCH, threads=DELETE_THREADS):
+    """
+    Delete the backups in the trash of 'outdir', at most 'rate' files
+    per second (0 for no limit). Return the number of files deleted.
+    """
+    removed = 0
+    start = time.monotonic()
+
+    def _throttle(count):
+        nonlocal removed
+        removed += count
+        if rate > 0:
+            ahead = removed / rate - (time.monotonic() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    with ThreadPoolExecutor(threads) as executor:
+        for item in trash_items(outdir):
+            files, dirs = _walk(item)
+
+            for index in range(0, len(files), batch):
+                chunk = files[index:index + batch]
+                list(executor.map(lambda path: _remove(os.unlink, path), chunk))
+                _throttle(len(chunk))
+
+            # children first
+            for index in range(0, len(dirs), batch):
+                for path in dirs[index:index + batch]:
+                    _remove(os.rmdir, path)
+                _throttle(len(dirs[index:index + batch]))
+
+    return removed
+
+
+def reap(outdir=".", rate=0):
+    """
+    Empty the trash of 'outdir' until nothing is left, unless another
+    reaper is running. Return the number of files deleted.
+    """
+    trash = Path(outdir) / TRASH
+    with open(trash / REAPER_LOCK, "a", encoding="ascii") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+
+        removed = 0
+        while trash_items(outdir):
+            removed += empty_trash(outdir, rate)
+
+    return removed
+
+
+def start_reaper(outdir=".", rate=0):
+    """Empty the trash of 'outdir' in a detached process (see `reap`)."""
+    cmd = [sys.executable, "-m", "zabbixbackup.trash", str(Path(outdir).absolute()), str(rate)]
+    if shutil.which("ionice") is not None:
+        cmd = ["ionice", "-c", "3"] + cmd
+
+    # the package is importable as it is for this process
+    package_root = str(Path(__file__).parent.parent)
+    pythonpath = os.environ.get("PYTHONPATH")
+    env = {
+        **os.environ,
+        "PYTHONPATH": package_root if not pythonpath else f"{package_root}{os.pathsep}{pythonpath}",
+    }
+
+    logger.info("Deleting %d backup/s in the background", len(trash_items(outdir)))
+    logger.debug("Reaper: %r", cmd)
+
+    return subprocess.Popen(
+        cmd, env=env, start_new_session=True, close_fds=True,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+if __name__ == "__main__":
+    os.nice(19)
+    reap(sys.argv[1], int(sys.argv[2]))
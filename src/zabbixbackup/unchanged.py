@@ -0,0 +1,204 @@
+"""
+Helper functions to skip the data of unchanged configuration tables.
+
+Configuration tables are checksummed by the server before the dump
+(`CHECKSUM TABLE` on MySQL, an aggregate hash of the rows on Postgres).
+Tables whose checksum is the same as in the previous backup are dumped
+without data: the backup refers to the backup holding it instead.
+
+The references are saved with the backup ('table_checksums': table,
+checksum and the backup holding the data) and, once the backup is
+archived, in the output directory as the state for the next backup (see
+`checksums_path`). A reference to a backup no longer in the output
+directory is dropped and the table is dumped again; the rotation keeps
+the referenced backups, and the ones they refer to (see `backup_holders`).
+"""
+import os
+import tarfile
+import logging
+from pathlib import Path
+
+from .tables import zabbix
+from .utils import COMPRESS_EXTENSIONS
+from .repository import MANIFEST, read_manifest_file
+
+logger = logging.getLogger()
+
+
+TABLE_CHECKSUMS = "table_checksums"
+
+
+def checksums_path(args):
+    """Path of the checksums state (last references) in the output directory."""
+    name = args.name if args.name is not None else args.host
+    outdir = args.scope.get("outdir", args.outdir)
+
+    return Path(outdir) / f"zabbix_{name}.checksums"
+
+
+def parse_checksums(lines):
+    """Parse checksums lines as a dict {table: (checksum, backup)}."""
+    checksums = {}
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) == 3 and all(fields):
+            table, checksum, backup = fields
+            checksums[table] = (checksum, backup)
+
+    return checksums
+
+
+def read_checksums(path):
+    """
+    Read checksums as a dict {table: (checksum, backup)},
+    empty if 'path' doesn't exist.
+    """
+    if not Path(path).exists():
+        return {}
+
+    with open(path, "r", encoding="utf-8") as fh:
+        return parse_checksums(fh)
+
+
+def write_checksums(path, checksums):
+    """Write checksums atomically (tab separated table, checksum and backup)."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.writelines(
+            f"{table}\t{checksum}\t{backup}\n"
+            for table, (checksum, backup) in sorted(checksums.items()))
+
+    os.replace(tmp_path, path)
+
+
+def find_backup(directory, name):
+    """Path of the backup 'name' in 'directory' (folder, archive or manifest), None if missing."""
+    candidates = [name, f"{name}.manifest", f"{name}.tar"]
+    candidates += [f"{name}.tar{ext}" for ext in COMPRESS_EXTENSIONS.values()]
+
+    for candidate in candidates:
+        path = Path(directory) / candidate
+        if path.exists():
+            return path
+
+    return None
+
+
+def checksum_candidates(table_list, skip):
+    """Configuration tables to checksum: the ones with data to dump."""
+    return [
+        table for table in table_list
+        if table in zabbix.config and table not in skip]
+
+
+def select_unchanged(args, checksums, backup):
+    """
+    Compare 'checksums' ({table: checksum}) with the previous backup.
+
+    Return the tables to dump without data and the references of every
+    checksummed table as a dict {table: (checksum, backup holding the data)},
+    'backup' is the name of the current backup.
+    """
+    previous = read_checksums(checksums_path(args))
+    outdir = args.scope.get("outdir", args.outdir)
+
+    unchanged, references = [], {}
+    for table, checksum in sorted(checksums.items()):
+        references[table] = (checksum, backup)
+
+        if table not in previous or previous[table][0] != checksum:
+            continue
+
+        holder = previous[table][1]
+        if find_backup(outdir, holder) is None:
+            logger.info("Unchanged table %s: backup %s not found, dumped", table, holder)
+            continue
+
+        unchanged.append(table)
+        references[table] = (checksum, holder)
+
+    logger.info("Unchanged config tables (data not dumped): %d", len(unchanged))
+    logger.debug("Unchanged config tables: %r", unchanged)
+    args.scope["tables"]["unchanged"] = len(unchanged)
+
+    return unchanged, references
+
+
+def save_checksums(args, references):
+    """
+    Save the references with the backup, they are the state for the next
+    backup once committed (see `commit_checksums`).
+    """
+    write_checksums(TABLE_CHECKSUMS, references)
+    args.scope["checksums"] = references
+
+
+def commit_checksums(args):
+    """
+    Save the references of the backup as the state for the next backup,
+    only once the backup is archived.
+
+    The previous state is replaced: tables not checksummed anymore don't keep
+    an old backup from being rotated.
+    """
+    references = args.scope.get("checksums")
+    if not references or args.dry_run:
+        return
+
+    state_path = checksums_path(args)
+    write_checksums(state_path, references)
+    logger.info("Table checksums saved: %s", state_path)
+
+
+def referenced_backups(path):
+    """Names of the backups referenced by the checksums state 'path'."""
+    return set(backup for _, backup in read_checksums(path).values())
+
+
+def holders(references, backup):
+    """Names of the other backups holding data of the backup 'backup', sorted."""
+    return sorted(set(holder for _, holder in references.values()) - {backup})
+
+
+def backup_holders(path, name):
+    """
+    Names of the other backups holding data of the backup 'name' at 'path'
+    (folder, archive or manifest), read from its 'table_checksums'.
+    """
+    path = Path(path)
+    member = f"{name}/{TABLE_CHECKSUMS}"
+    lines = []
+    try:
+        if path.is_dir():
+            return holders(read_checksums(path / TABLE_CHECKSUMS), name)
+
+        if path.name.endswith(MANIFEST):
+            data = read_manifest_file(path, TABLE_CHECKSUMS)
+            lines = [] if data is None else data.decode().splitlines()
+        else:
+            # members are read in order: the whole archive at worst
+            with tarfile.open(path, "r|*") as tar:
+                for info in tar:
+                    if info.name == member and info.isfile():
+                        lines = tar.extractfile(info).read().decode().splitlines()
+                        break
+    except (OSError, ValueError, tarfile.TarError) as e:
+        logger.warning("Cannot read the table checksums of %s: %s", path, e)
+
+    return holders(parse_checksums(lines), name)
+
+
+def read_references(backup_dir):
+    """
+    Tables whose data is in another backup, as a dict {backup: [tables]}
+    (empty if the backup has no 'table_checksums').
+    """
+    backup_dir = Path(backup_dir)
+    references = {}
+    for table, (_, backup) in read_checksums(backup_dir / TABLE_CHECKSUMS).items():
+        if backup != backup_dir.name:
+            references.setdefault(backup, []).append(table)
+
+    return references
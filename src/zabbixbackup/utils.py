@@ -2,6 +2,7 @@
 Helper functions for zabbixbackup.
 """
 import logging
+import os
 import shutil
 import socket
 import subprocess
@@ -27,12 +28,18 @@ def quote(s):
 
 
 def DPopen(*args, **kwargs): # pylint: disable=C0103:invalid-name
-    """Execute a command via `Popen`."""
-    stderr = kwargs.get("stderr", subprocess.PIPE)
-    if logger.isEnabledFor(logging.DEBUG):
-        stderr = None
+    """
+    Execute a command via `Popen`.
+
+    Unless explicitly provided, stderr is captured or, while debugging,
+    left attached to the console.
+    """
+    if "stderr" not in kwargs:
+        stderr = subprocess.PIPE
+        if logger.isEnabledFor(logging.DEBUG):
+            stderr = None
 
-    kwargs["stderr"] = stderr
+        kwargs["stderr"] = stderr
 
     return subprocess.Popen(*args, **kwargs)
 
@@ -143,21 +150,71 @@ def rlookup(ipaddr):
     return None
 
 
-def build_compress_command(profile, check=True, strategy=("standard", "fallback")):
-    """Helper function to prepare a compress command."""
-    algo, level, extra = profile
+# tables statistics saved in the backup (see `write_table_stats`)
+TABLE_STATS = "table_stats"
+
+# compressed file extensions
+COMPRESS_EXTENSIONS = {"xz": ".xz", "gzip": ".gz", "bzip2": ".bz2", "zstd": ".zst", "lz4": ".lz4"}
+
+# progress and statistics are printed by default if stderr is a terminal
+QUIET = {"zstd": ("-q", ), "lz4": ("-q", )}
+
+
+def parallel_compress_command(algo, level, extra, threads=None):
+    """
+    Helper function to prepare a parallel compress command.
+
+    'threads' None stands for every available core.
+    Return None if there's no parallel implementation for 'algo'.
+    """
+    if algo == "gzip":
+        flags = () if threads is None else ("--processes", str(threads))
+        return ("pigz", f"-{level}", ) + flags + extra
+
+    if algo == "bzip2":
+        flags = () if threads is None else (f"-p{threads}", )
+        return ("pbzip2", f"-{level}", ) + flags + extra
+
+    if algo == "xz":
+        return ("xz", f"-{level}", f"-T{threads or 0}", ) + extra
+
+    if algo == "zstd":
+        return ("zstd", "-q", f"-{level}", f"-T{threads or 0}", ) + extra
+
+    return None
 
-    extension = {"xz": ".xz", "gzip": ".gz", "bzip2": ".bz2"}
+
+def build_compress_command(
+    profile, check=True, strategy=("parallel", "standard", "fallback"), threads=1
+):
+    """
+    Helper function to prepare a compress command.
+
+    With 'threads' other than 1 (None for every core) a parallel
+    implementation is preferred if available.
+    """
+    algo, level, extra = profile
 
     env = {}
-    ext = extension[algo]
+    ext = COMPRESS_EXTENSIONS[algo]
+
+    if "parallel" in strategy and threads != 1:
+        cmd = parallel_compress_command(algo, level, extra, threads)
+        if cmd is not None and (not check or check_binary(cmd[0])):
+            pipe = cmd
+            return env, ext, cmd, pipe
+
+        logger.debug("No parallel compressor for %s, using single-threaded", algo)
 
     if "standard" in strategy and (not check or check_binary(algo)):
-        cmd = (algo, f"-{level}", ) + extra
+        cmd = (algo, ) + QUIET.get(algo, ()) + (f"-{level}", ) + extra
         pipe = cmd
         return env, ext, cmd, pipe
 
-    if "fallback" in strategy and (not check or check_binary("7z")):
+    # 7z doesn't support zstd and lz4
+    if ("fallback" in strategy and algo in ("xz", "gzip", "bzip2")
+        and (not check or check_binary("7z"))
+    ):
         cmd = ("7z", "a", f"-t{algo}", )
         pipe = ("7z", "a", f"-t{algo}", "-si", )
         return env, ext, cmd, pipe
@@ -166,8 +223,13 @@ def build_compress_command(profile, check=True, strategy=("standard", "fallback"
 
 
 # pylint: disable-next=too-many-locals
-def build_tar_command(profile, check=True, strategy=("tar", )):
-    """Helper function to prepare a tar/compress command."""
+def build_tar_command(profile, check=True, strategy=("tar", ), threads=1):
+    """
+    Helper function to prepare a tar/compress command.
+
+    With 'threads' other than 1 (None for every core) a parallel
+    compressor is used if available.
+    """
     binary = None
 
     if "tar" in strategy:
@@ -182,16 +244,43 @@ def build_tar_command(profile, check=True, strategy=("tar", )):
     if algo == "tar":
         return {}, ".tar", (binary, "-cf", )
 
-    extension = {"xz": ".tar.xz", "gzip": ".tar.gz", "bzip2": ".tar.bz2"}
+    extension = {
+        "xz": ".tar.xz", "gzip": ".tar.gz", "bzip2": ".tar.bz2",
+        "zstd": ".tar.zst", "lz4": ".tar.lz4",
+    }
     env_map = {"xz": "XZ_OPT", "gzip": "GZIP", "bzip2": "BZIP2"}
     tar_map = {"xz": "J", "gzip": "z", "bzip2": "j"}
 
+    ext = extension[algo]
+
+    # no tar flag (nor environment variable) for these, tar runs them as-is
+    if algo in ("zstd", "lz4"):
+        _, _, compressor, _ = build_compress_command(
+            profile, check=check, strategy=("parallel", "standard"), threads=threads)
+        program = " ".join(compressor)
+        return {}, ext, (binary, f"--use-compress-program={program}", "-cf", )
+
+    if threads != 1:
+        parallel = parallel_compress_command(algo, level, extra, threads)
+
+        # xz reads its threads from XZ_OPT, others are run by tar as-is
+        if algo == "xz":
+            extra = parallel[2:]
+        elif not check or check_binary(parallel[0]):
+            program = " ".join(parallel)
+            return {}, ext, (binary, f"--use-compress-program={program}", "-cf", )
+        else:
+            logger.debug("No parallel compressor for %s, using single-threaded", algo)
+
+    # tar runs the compression binary itself
+    if check and not check_binary(algo):
+        raise NotImplementedError(f"Compression binary not available '{algo}'")
+
     compr_env_var = env_map[algo]
     compr_flags = " ".join((f"-{level}", ) + extra)
     tar_flag = tar_map[algo]
 
     env = {compr_env_var: compr_flags}
-    ext = extension[algo]
     cmd = (binary, f"-c{tar_flag}f", )
 
     return env, ext, cmd
@@ -243,6 +332,13 @@ def preprocess_tables_lists(args, table_list):
     logger.info("Monitoring tables: %d", len(monitoring))
     logger.info("Unknown tables: %d", len(unknown))
 
+    args.scope["tables"] = {
+        "total": len(tables),
+        "config": len(config),
+        "monitoring": len(monitoring),
+        "unknown": len(unknown),
+    }
+
     nodata, ignore, fail = [], [], []
     if args.monitoring == "nodata":
         nodata += monitoring
@@ -254,9 +350,116 @@ def preprocess_tables_lists(args, table_list):
     elif args.unknown == "fail":
         fail += unknown
 
+    args.scope["tables"].update(ignore=len(ignore), nodata=len(nodata))
+
     return sorted(ignore), sorted(nodata), sorted(fail)
 
 
+def parse_table_stats(lines, separator):
+    """
+    Parse tables statistics from query output lines ('table', 'rows', 'size').
+
+    Return a dict in the form of {"tablename": (rows, size in bytes), ...}.
+    Estimates can be missing (NULL or -1 if never analyzed): they count as 0.
+    """
+    def _int(value):
+        value = value.strip()
+        return int(value) if value.isdecimal() else 0
+
+    stats = {}
+    for line in lines:
+        table, rows, size = line.split(separator)
+        stats[table] = (_int(rows), _int(size))
+
+    return stats
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def write_table_stats(stats, ignore, nodata, chunked, path=TABLE_STATS, unchanged=()):
+    """
+    Save tables statistics into 'path', largest first, as tab separated
+    values: table, estimated rows, size in bytes and dump action.
+    """
+    actions = {
+        **{table: "ignore" for table in ignore},
+        **{table: "nodata" for table in nodata},
+        **{table: "chunked" for table in chunked},
+        **{table: "unchanged" for table in unchanged},
+    }
+
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("table\trows\tbytes\taction\n")
+        for table, (rows, size) in sorted(stats.items(), key=lambda item: (-item[1][1], item[0])):
+            fh.write(f"{table}\t{rows}\t{size}\t{actions.get(table, 'dump')}\n")
+
+
+def chunked_tables(args, table_list, ignore, nodata):
+    """
+    Select the tables to export by 'clock' ranges (see `chunks.py`).
+
+    History and trends tables if requested (see --chunk) and
+    the incremental tables in incremental mode (see --monitoring-action),
+    only if they have data to dump.
+    """
+    selected = set()
+    if args.scope.get("chunk", None) is not None:
+        selected.update(zabbix.chunked)
+    if args.monitoring == "incremental":
+        selected.update(zabbix.incremental)
+
+    skip = set(ignore + nodata)
+    return sorted(
+        table
+        for table in table_list
+        if table in selected and table not in skip
+    )
+
+
+def auto_jobs(sizes, cpus=None, split=()):
+    """
+    Choose a number of parallel dump workers from tables sizes.
+
+    The dump can't be faster than the time spent on the largest table, so
+    there is no gain in having more workers than 'total size / largest size'.
+    Sizes in 'split' are of tables dumped in chunks: they count in the total
+    but don't bound the number of workers.
+    The result is bounded by the number of available cores.
+    """
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+
+    sizes = tuple(size for size in sizes if size > 0)
+    total = sum(sizes) + sum(split)
+    if total == 0:
+        return 1
+
+    if not sizes:
+        return cpus
+
+    useful = -(-total // max(sizes)) # ceil division
+
+    return max(1, min(cpus, useful))
+
+
+def partition_tables(sizes, n):
+    """
+    Split tables in at most 'n' buckets of similar total size.
+
+    'sizes' is a dict in the form of {"tablename": size, ...}. Tables are
+    assigned largest first to the least loaded bucket (empty buckets are
+    omitted).
+    """
+    buckets = [[] for _ in range(n)]
+    totals = [0] * n
+
+    for table, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0])):
+        index = totals.index(min(totals))
+        buckets[index].append(table)
+        totals[index] += size
+
+    return [bucket for bucket in buckets if bucket]
+
+
 def pretty_log_args(args):
     """Print arguments via 'logging.info' in a readable way"""
 